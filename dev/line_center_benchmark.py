@@ -0,0 +1,111 @@
+#!/usr/bin/env python2
+"""Benchmark of the sub-pixel line centers of the comparison lamps
+
+WavelengthCalibration.interpolate used to evaluate the cubic spline of every lamp at 200 points per pixel, 800 thousand
+samples for a 4k lamp, to locate the lines with a resolution of 1/200 of a pixel. The same maxima are now found as the
+roots of the derivative of the spline, see WavelengthCalibration.get_spline_peaks. This script compares both on
+simulated lamps with gaussian lines at known sub-pixel positions, pixel integrated, on a constant background with
+gaussian noise. For the oversampled spline and the analytic maxima it reports the time per lamp, the memory of the
+buffer, the RMS error with respect to the true centers and the largest difference between both methods. The centroids
+of WavelengthCalibration.recenter_lines are included as a reference.
+
+Usage:
+    python2 dev/line_center_benchmark.py --lamps 5 --lines 80 --fwhm 4
+
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import scipy.interpolate
+from scipy import signal
+from scipy.special import erf
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'goodman_spec'))
+
+from wavelength import WavelengthCalibration
+
+# oversampling of the former WavelengthCalibration.interpolate
+INTERPOLATION_SIZE = 200
+
+
+def make_lamp(n_pixels, n_lines, fwhm, noise_level, random_state):
+    """Simulated lamp and the true center of every line as an index of the lamp"""
+    centers = np.sort(random_state.uniform(20, n_pixels - 20, n_lines))
+    amplitudes = 10 ** random_state.uniform(2, 4.5, n_lines)
+    sigma = fwhm / 2.3548
+    edges = np.arange(n_pixels + 1) - 0.5
+    lamp = np.zeros(n_pixels)
+    for center, amplitude in zip(centers, amplitudes):
+        cumulative = 0.5 * amplitude * sigma * np.sqrt(2 * np.pi) * erf((edges - center) / (np.sqrt(2) * sigma))
+        lamp += np.diff(cumulative)
+    lamp += random_state.normal(100, noise_level, n_pixels)
+    return lamp, centers
+
+
+def oversampled_peaks(lamp, lines):
+    """Maximum of the spline evaluated on the grid of the former interpolate method, and the size of the buffer"""
+    x_axis = np.arange(lamp.size, dtype=float)
+    new_x_axis = np.linspace(x_axis[0], x_axis[-1], lamp.size * INTERPOLATION_SIZE)
+    tck = scipy.interpolate.splrep(x_axis, lamp, s=0)
+    new_lamp = scipy.interpolate.splev(new_x_axis, tck, der=0)
+    peaks = []
+    for line in lines:
+        window = np.nonzero(np.abs(new_x_axis - line) <= 1)[0]
+        peaks.append(new_x_axis[window[np.argmax(new_lamp[window])]])
+    return np.array(peaks), new_x_axis.nbytes + new_lamp.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of lamp line centers.')
+    parser.add_argument('--lamps', type=int, default=5, help='Number of simulated lamps')
+    parser.add_argument('--pixels', type=int, default=4060, help='Pixels of every lamp')
+    parser.add_argument('--lines', type=int, default=80, help='Lines per lamp')
+    parser.add_argument('--fwhm', type=float, default=4., help='FWHM of the lines in pixels')
+    parser.add_argument('--noise', type=float, default=10., help='Standard deviation of the noise')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(args.seed)
+    calibration = WavelengthCalibration.__new__(WavelengthCalibration)
+    calibration.raw_pixel_axis = range(1, args.pixels + 1)
+    print('%4s | %10s %10s %9s | %10s %10s %9s | %9s | %9s' % ('lamp', 'spline [s]', 'mem [MB]', 'rms [px]',
+                                                                'roots [s]', 'mem [MB]', 'rms [px]', 'max diff',
+                                                                'centroid'))
+    totals = {'spline': 0., 'roots': 0.}
+    for lamp_number in range(args.lamps):
+        lamp, centers = make_lamp(args.pixels, args.lines, args.fwhm, args.noise, random_state)
+        lines = signal.argrelmax(lamp, order=6)[0]
+        lines = lines[lamp[lines] > 100 + 5 * args.noise]
+        truth = centers[np.argmin(np.abs(centers[np.newaxis, :] - lines[:, np.newaxis]), axis=1)]
+
+        start = time.time()
+        spline_peaks, buffer_size = oversampled_peaks(lamp, lines)
+        spline_time = time.time() - start
+        start = time.time()
+        root_peaks = WavelengthCalibration.get_spline_peaks(lamp, lines)
+        roots_time = time.time() - start
+        # the roots only need the coefficients of the spline, four per pixel
+        roots_size = 4 * lamp.size * lamp.itemsize
+        centroids = np.array(calibration.recenter_lines(lamp, lines)) - 1
+
+        totals['spline'] += spline_time
+        totals['roots'] += roots_time
+        # blended lines have no true center, only isolated lines are used for the errors
+        isolated = np.min(np.abs(centers[np.newaxis, :] - truth[:, np.newaxis]) +
+                          np.where(centers[np.newaxis, :] == truth[:, np.newaxis], np.inf, 0), axis=1) > 3 * args.fwhm
+        print('%4d | %10.4f %10.2f %9.4f | %10.4f %10.2f %9.4f | %9.4f | %9.4f' % (
+            lamp_number,
+            spline_time, buffer_size / 1e6, np.sqrt(np.mean((spline_peaks - truth)[isolated] ** 2)),
+            roots_time, roots_size / 1e6, np.sqrt(np.mean((root_peaks - truth)[isolated] ** 2)),
+            np.max(np.abs(spline_peaks - root_peaks)),
+            np.sqrt(np.mean((centroids - truth)[isolated] ** 2))))
+    print('speedup per lamp: %.1fx' % (totals['spline'] / max(totals['roots'], 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
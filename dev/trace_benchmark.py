@@ -0,0 +1,112 @@
+#!/usr/bin/env python2
+"""Benchmark of the centroids used by Process.trace
+
+Compares fitting a Voigt profile to every sub-sample, which is what Process.trace did before, with the closed form
+centroids of goodman_spec.tracing on frames built with the model of goodman_spec.simulator (Voigt spatial profile with
+fwhm_G 8.25 and fwhm_L 0.94, intensity(), gaussian noise around 10 counts). A tilt can be added to the traces, which
+are straight in the simulator. For every frame it reports the time per frame and the RMS difference between the fitted
+Chebyshev trace and the true center of every target.
+
+Usage:
+    python2 dev/trace_benchmark.py --frames 5 --targets 2 --tilt 4
+
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from astropy.modeling import models, fitting
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'goodman_spec'))
+
+import tracing
+from simulator import intensity
+
+# geometry and profile of goodman_spec.simulator.make_2d_spectra
+X_SIZE = 4056
+Y_SIZE = 1550
+FWHM_G = 8.24687326842
+FWHM_L = 0.942561669206
+
+# same values as Process.trace
+ENDS_PIX_SPACING = 50
+N_SAMPLES = 50
+SAMPLE_WIDTH = 50
+
+
+def make_frame(n_targets, intens, noise_level, tilt, separation, random_state):
+    """Simulated frame and the true center of every target along the dispersion axis"""
+    columns = np.arange(X_SIZE)
+    amplitude = intens * intensity(np.linspace(0, 10, X_SIZE))
+    data = random_state.normal(10, noise_level, (Y_SIZE, X_SIZE))
+    rows = np.arange(Y_SIZE)[:, np.newaxis]
+    centers = []
+    for target in range(n_targets):
+        center = Y_SIZE / 2. + (target - (n_targets - 1) / 2.) * separation + 0.37 * target
+        center = center + tilt * (columns / float(X_SIZE - 1) - 0.5)
+        voigt = models.Voigt1D(amplitude_L=1., x_0=0, fwhm_L=FWHM_L, fwhm_G=FWHM_G)
+        data += amplitude[np.newaxis, :] * voigt(rows - center[np.newaxis, :])
+        centers.append(center)
+    return data, centers
+
+
+def get_traces(data, centers, raw_width, method):
+    """Traces of all the targets with the sub-sampling of Process.trace"""
+    profile_list = []
+    limit_list = []
+    for center in centers:
+        mean = center[int(X_SIZE / 2.)]
+        x_min = int(mean - raw_width / 2.)
+        x_max = int(mean + raw_width / 2.)
+        sample_data = data[x_min:x_max, :]
+        starts = np.linspace(0, sample_data.shape[1] - ENDS_PIX_SPACING, N_SAMPLES, dtype=int)
+        profile_list.append(tracing.get_profiles(sample_data, starts, SAMPLE_WIDTH))
+        limit_list.append((x_min, starts))
+    if method == 'voigt':
+        centroid_list = [np.array([tracing.fit_voigt_centroid(profile) for profile in profiles])
+                         for profiles in profile_list]
+        refined = sum([len(profiles) for profiles in profile_list])
+    else:
+        centroid_list, ambiguous_list = tracing.get_centroids(profile_list)
+        refined = sum([np.count_nonzero(ambiguous) for ambiguous in ambiguous_list])
+    traces = []
+    for (x_min, starts), centroids in zip(limit_list, centroid_list):
+        chebyshev_init = models.Chebyshev1D(2, domain=[0, data.shape[1]])
+        traces.append(fitting.LinearLSQFitter()(chebyshev_init, starts + int(SAMPLE_WIDTH / 2.), centroids + x_min))
+    return traces, refined
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of trace centroids.')
+    parser.add_argument('--frames', type=int, default=5, help='Number of simulated frames')
+    parser.add_argument('--targets', type=int, default=1, help='Targets per frame')
+    parser.add_argument('--separation', type=float, default=80., help='Pixels between targets')
+    parser.add_argument('--tilt', type=float, default=0., help='Change of the trace along the frame in pixels')
+    parser.add_argument('--noise', type=float, default=3.5, help='Standard deviation of the noise')
+    parser.add_argument('--raw-width', type=int, default=40, help='Spatial width of the sub-samples')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(args.seed)
+    columns = np.arange(X_SIZE)
+    print('%5s %9s | %9s %9s %7s | %9s %9s %7s' % ('frame', 'intensity', 'voigt [s]', 'rms [px]', 'fits',
+                                                   'fast [s]', 'rms [px]', 'fits'))
+    totals = {'voigt': 0., 'fast': 0.}
+    for frame, intens in enumerate(np.linspace(0.1, 1.3, args.frames)):
+        data, centers = make_frame(args.targets, intens, args.noise, args.tilt, args.separation, random_state)
+        row = [frame, intens]
+        for method in ['voigt', 'fast']:
+            start = time.time()
+            traces, refined = get_traces(data, centers, args.raw_width, method)
+            elapsed = time.time() - start
+            totals[method] += elapsed
+            residuals = np.concatenate([trace(columns) - center for trace, center in zip(traces, centers)])
+            row.extend([elapsed, np.sqrt(np.mean(residuals ** 2)), refined])
+        print('%5d %9.3f | %9.3f %9.4f %7d | %9.3f %9.4f %7d' % tuple(row))
+    print('speedup per frame: %.1fx' % (totals['voigt'] / max(totals['fast'], 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
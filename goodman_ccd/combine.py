@@ -0,0 +1,182 @@
+"""Out-of-core median combination of frames
+
+ccdproc.combine needs every frame in memory as a CCDData object before it starts, with a large number of full frame
+4k x 4k flats that is more than the memory available in a small node. combine_median produces the same result as
+ccdproc.combine(method='median', sigma_clip=True) with its default clipping functions (numpy.ma.mean and numpy.ma.std,
+a single rejection pass) but reads the frames directly from disk a block of rows at a time, the size of the block is
+chosen so that the stack of all the frames fits in the memory budget.
+
+"""
+import os
+import numpy as np
+from astropy.io import fits
+from astropy import log
+from astropy import units as u
+from astropy.nddata import StdDevUncertainty
+import ccdproc
+from ccdproc import CCDData
+from ccdproc.utils.slices import slice_from_string
+
+from fix_header import fix_header, read_fixed
+
+# fraction of the available memory used when no explicit limit is given
+DEFAULT_MEMORY_FRACTION = 0.5
+
+# memory used while combining a block, relative to the size of the stack of input rows. Accounts for the float64 stack
+# plus the temporary arrays of the clipping and the median.
+_MEMORY_OVERHEAD = 6
+
+
+def get_available_memory():
+    """Amount of memory that can be used without swapping
+
+    Returns:
+        available (float): Available memory in bytes. MemAvailable from /proc/meminfo on Linux, or the size of the
+            physical memory if that is not possible.
+
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return float(line.split()[1]) * 1024
+    except IOError:
+        pass
+    try:
+        return float(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE'))
+    except (ValueError, OSError, AttributeError):
+        # a conservative guess
+        return 2E9
+
+
+def get_memory_limit(memory_limit=None, fraction=DEFAULT_MEMORY_FRACTION):
+    """Memory budget for combining frames
+
+    Args:
+        memory_limit (float): Limit in bytes given by the user. If None the limit is a fraction of the available memory.
+        fraction (float): Fraction of the available memory to use when memory_limit is None.
+
+    Returns:
+        memory_limit (float): Limit in bytes.
+
+    """
+    if memory_limit is not None:
+        return float(memory_limit)
+    return fraction * get_available_memory()
+
+
+def _trim_slices(header):
+    """Row and column slices of the TRIMSEC region of a frame
+
+    Args:
+        header (object): Header of the frame, with NAXIS1, NAXIS2 and TRIMSEC.
+
+    Returns:
+        slices (tuple): Row and column slices with explicit start and stop.
+
+    """
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    row_slice, column_slice = slice_from_string(header['TRIMSEC'], fits_convention=True)
+    return slice(*row_slice.indices(shape[0])), slice(*column_slice.indices(shape[1]))
+
+
+def _combine_block(stack, low_thresh, high_thresh):
+    """Sigma clipped median of a stack of rows
+
+    Args:
+        stack (array): Array of shape (frames, rows, columns).
+        low_thresh (float): Rejection threshold below the mean in units of standard deviation.
+        high_thresh (float): Rejection threshold above the mean in units of standard deviation.
+
+    Returns:
+        median, uncertainty, mask (tuple): Combined rows, their uncertainty and the pixels rejected in every frame.
+
+    """
+    stack = np.ma.masked_invalid(stack)
+    baseline = np.ma.mean(stack, axis=0)
+    deviation = np.ma.std(stack, axis=0)
+    stack.mask |= (stack - baseline).filled(0) < -low_thresh * deviation.filled(0)
+    stack.mask |= (stack - baseline).filled(0) > high_thresh * deviation.filled(0)
+
+    masked_values = stack.mask.sum(axis=0)
+    mask = masked_values == len(stack)
+
+    data = stack.filled(np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        median = np.nanmedian(data, axis=0)
+        uncertainty = 1.4826 * np.nanmedian(np.abs(data - median), axis=0)
+        uncertainty /= np.sqrt(len(stack) - masked_values)
+    return median, uncertainty, mask
+
+
+def combine_median(file_list, low_thresh=3.0, high_thresh=3.0, memory_limit=None, fix_raw=False):
+    """Median combination of trimmed frames read from disk in blocks of rows
+
+    Every frame is trimmed to its own TRIMSEC, all of them must have the same trimmed shape. Values that deviate from
+    the mean by more than the thresholds times the standard deviation are rejected before the median is computed, as
+    ccdproc.combine does with sigma_clip=True.
+
+    Args:
+        file_list (list): Full path of the frames to combine.
+        low_thresh (float): Rejection threshold below the mean in units of standard deviation.
+        high_thresh (float): Rejection threshold above the mean in units of standard deviation.
+        memory_limit (float): Memory budget in bytes. See get_memory_limit.
+        fix_raw (bool): The files are raw Goodman frames, their header and shape are fixed as they are read. See
+            goodman_ccd.fix_header.
+
+    Returns:
+        combined (object): CCDData with the median, the uncertainty and the mask of fully rejected pixels. The header
+            and unit are the ones of the first (trimmed) frame.
+
+    """
+    memory_limit = get_memory_limit(memory_limit)
+
+    # header and unit of the result are the ones of the first frame
+    if fix_raw:
+        data, header = read_fixed(file_list[0])
+        first = CCDData(data, meta=header, unit=u.adu)
+    else:
+        first = CCDData.read(file_list[0], unit=u.adu)
+    first = ccdproc.trim_image(first, fits_section=first.header['TRIMSEC'])
+    header, unit = first.header, first.unit
+    n_rows, n_columns = first.shape
+    del first
+
+    # without memmap the sections read only the requested rows, also for scaled (BZERO) data
+    hdu_lists = [fits.open(file_name, memmap=False, ignore_missing_end=True) for file_name in file_list]
+    try:
+        slices = []
+        for file_name, hdu_list in zip(file_list, hdu_lists):
+            if fix_raw:
+                row_slice, column_slice = _trim_slices(fix_header(hdu_list[0].header))
+            else:
+                row_slice, column_slice = _trim_slices(hdu_list[0].header)
+            if (row_slice.stop - row_slice.start, column_slice.stop - column_slice.start) != (n_rows, n_columns):
+                raise ValueError('Trimmed shape of {:s} is different from the one of {:s}'.format(
+                    os.path.basename(file_name), os.path.basename(file_list[0])))
+            slices.append((row_slice, column_slice))
+
+        row_bytes = len(file_list) * n_columns * np.dtype(np.float64).itemsize * _MEMORY_OVERHEAD
+        block_rows = int(max(1, min(n_rows, memory_limit // row_bytes)))
+        log.debug('Combining %s frames in blocks of %s rows', len(file_list), block_rows)
+
+        median = np.empty((n_rows, n_columns), dtype=np.float64)
+        uncertainty = np.empty((n_rows, n_columns), dtype=np.float64)
+        mask = np.empty((n_rows, n_columns), dtype=bool)
+        stack = np.empty((len(file_list), block_rows, n_columns), dtype=np.float64)
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            for i, (hdu_list, (row_slice, column_slice)) in enumerate(zip(hdu_lists, slices)):
+                rows = slice(row_slice.start + start, row_slice.start + stop)
+                if hdu_list[0].header['NAXIS'] == 3:
+                    # raw frames have shape [1, Y, X]
+                    stack[i, :stop - start] = hdu_list[0].section[0, rows, column_slice]
+                else:
+                    stack[i, :stop - start] = hdu_list[0].section[rows, column_slice]
+            block = _combine_block(stack[:, :stop - start], low_thresh, high_thresh)
+            median[start:stop], uncertainty[start:stop], mask[start:stop] = block
+    finally:
+        for hdu_list in hdu_lists:
+            hdu_list.close()
+
+    return CCDData(median, uncertainty=StdDevUncertainty(uncertainty), mask=mask, meta=header, unit=unit)
@@ -0,0 +1,174 @@
+"""Cosmic ray cleaning stage
+
+LACosmic is by far the slowest step of the CCD reduction. Instead of running it inside the calibration of every science
+frame, the flat corrected frames are cleaned afterwards by clean_frames, which distributes the work with
+goodman_ccd.parallel.map_frames. By default every worker cleans whole frames. Frames can also be split in horizontal
+tiles that overlap, so a single large frame can use several cores, each tile is cleaned including the overlap and only
+its core rows are kept. The algorithm works on local neighbourhoods (median filters of a few pixels grown over a few
+iterations), so with an overlap wider than that reach the tiled result is the same as the one of the full frame.
+
+"""
+import os
+from functools import partial
+import numpy as np
+from astropy.io import fits
+from astropy import log
+import ccdproc
+
+from parallel import map_frames
+
+# parameters of ccdproc.cosmicray_lacosmic that are the same for every frame
+LACOSMIC_PARAMETERS = {'sigclip': 2.5,
+                       'satlevel': np.inf,
+                       'sepmed': True,
+                       'fsmode': 'median',
+                       'psfmodel': 'gaussy',
+                       'verbose': True}
+
+# rows shared by neighbouring tiles
+DEFAULT_OVERLAP = 64
+
+
+def get_cleaning_parameters(header):
+    """Values of sigfrac and objlim for a frame
+
+    Function to determine the sigfrac and objlim: y = 0.16 * exptime + 1.2
+
+    Args:
+        header (object): Header of the frame, with EXPTIME.
+
+    Returns:
+        sigfrac, objlim (tuple): Both parameters have the same value.
+
+    """
+    value = 0.16 * float(header['EXPTIME']) + 1.2
+    return value, value
+
+
+def clean_data(data, header):
+    """Runs LACosmic on an array
+
+    OBS: cosmic ray rejection is working pretty well by defining gain = 1. It's not working when we use the real gain
+    of the image. In this case the sky level changes by a factor equal the gain, therefore the result is divided by the
+    gain.
+
+    Args:
+        data (array): 2D image, or a part of it.
+        header (object): Header of the frame, with EXPTIME, GAIN and RDNOISE.
+
+    Returns:
+        cleaned (array): Cleaned data divided by the gain.
+
+    """
+    sigfrac, objlim = get_cleaning_parameters(header)
+    nccd, _ = ccdproc.cosmicray_lacosmic(data, sigfrac=sigfrac, objlim=objlim,
+                                         gain=float(header['GAIN']),
+                                         readnoise=float(header['RDNOISE']),
+                                         **LACOSMIC_PARAMETERS)
+    return np.array(nccd, dtype=np.double) / float(header['GAIN'])
+
+
+def get_tiles(n_rows, tiles, overlap=DEFAULT_OVERLAP):
+    """Splits the rows of a frame in overlapping tiles
+
+    Args:
+        n_rows (int): Number of rows of the frame.
+        tiles (int): Number of tiles.
+        overlap (int): Number of extra rows read at each side of a tile.
+
+    Returns:
+        tile_list (list): (start, stop, read_start, read_stop) for every tile. start and stop delimit the rows the
+            tile contributes, read_start and read_stop the rows that are cleaned.
+
+    """
+    tiles = max(1, min(int(tiles), n_rows))
+    edges = np.linspace(0, n_rows, tiles + 1).astype(int)
+    return [(int(start), int(stop), int(max(0, start - overlap)), int(min(n_rows, stop + overlap)))
+            for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def _read_frame(path):
+    """Data and header of a flat corrected frame, as they were before being written
+
+    CCDData.write adds BUNIT, which is not part of the header of the frame in memory.
+
+    """
+    data, header = fits.getdata(path, header=True)
+    header.remove('BUNIT', ignore_missing=True)
+    return data, header
+
+
+def _read_rows(path, start, stop):
+    """Rows start to stop of a flat corrected frame and its header, see _read_frame
+
+    Only those rows are read, through a section of a file opened without memmap as in goodman_ccd.saturation.
+
+    """
+    with fits.open(path, memmap=False) as hdu_list:
+        header = hdu_list[0].header.copy()
+        data = hdu_list[0].section[start:stop, :]
+    header.remove('BUNIT', ignore_missing=True)
+    return data, header
+
+
+def _clean_tile(tile, path):
+    """Cleans one tile of a frame and returns its core rows"""
+    start, stop, read_start, read_stop = tile
+    data, header = _read_rows(path, read_start, read_stop)
+    cleaned = clean_data(data, header)
+    return cleaned[start - read_start:stop - read_start]
+
+
+def clean_frame(path, output_path):
+    """Cleans a whole frame and writes the result
+
+    Args:
+        path (str): Flat corrected frame.
+        output_path (str): Name of the cleaned frame.
+
+    Returns:
+        output_path (str): The same as the argument.
+
+    """
+    data, header = _read_frame(path)
+    fits.writeto(output_path, clean_data(data, header), header, clobber=True)
+    return output_path
+
+
+def _clean_frame_item(item):
+    """Unpacks the arguments of clean_frame, for map_frames"""
+    return clean_frame(*item)
+
+
+def clean_frames(file_list, prefix='c', jobs=1, tiles=1, overlap=DEFAULT_OVERLAP):
+    """Cleans cosmic rays of a list of flat corrected frames
+
+    With a single tile the frames are distributed among the processes. With more than one tile the frames are
+    processed one at a time and their tiles are distributed instead.
+
+    Args:
+        file_list (list): Frames to clean. The output is written to the same directory.
+        prefix (str): Prefix added to the name of the output files.
+        jobs (int): Number of processes. See goodman_ccd.parallel.get_number_of_jobs.
+        tiles (int): Number of tiles per frame.
+        overlap (int): Number of rows shared by neighbouring tiles.
+
+    Returns:
+        output_list (list): Names of the cleaned frames.
+
+    """
+    items = [(path, os.path.join(os.path.dirname(path), prefix + os.path.basename(path))) for path in file_list]
+    if tiles <= 1:
+        output_list = map_frames(_clean_frame_item, items, jobs=jobs)
+    else:
+        output_list = []
+        for path, output_path in items:
+            header = fits.getheader(path)
+            header.remove('BUNIT', ignore_missing=True)
+            tile_list = get_tiles(header['NAXIS2'], tiles, overlap)
+            cleaned = np.concatenate(map_frames(partial(_clean_tile, path=path), tile_list, jobs=jobs))
+            fits.writeto(output_path, cleaned, header, clobber=True)
+            output_list.append(output_path)
+    for path, output_path in items:
+        log.info('Cosmic rays have been cleaned ' + path + ' --> ' + output_path)
+    return output_list
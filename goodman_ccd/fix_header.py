@@ -8,6 +8,61 @@ __date__ = '2016-07-15'
 __version__ = "1.0"
 __email__ = "dsanmartim@ctio.noao.edu"
 
+# keywords that contain non-printable ASCII characters or do not apply to the 2D image
+KEY_LIST_TO_REMOVE = ['PARAM0', 'PARAM61', 'PARAM62', 'PARAM63', 'NAXIS3', 'INSTRUME']
+
+
+def fix_header(header):
+    """
+    Returns a copy of a Goodman header without the inconvenient keywords, without
+    duplicated keywords and describing a 2D image. The header of the raw file is not
+    modified.
+    """
+    hdr = header.copy()
+    # 3D to 2D
+    if hdr.get('NAXIS') == 3:
+        hdr['NAXIS'] = 2
+
+    # Keyword to be changed (3 --> 2)
+    try:
+        hdr['N_PARAM'] -= len(KEY_LIST_TO_REMOVE)
+        # Specific keywords to be removed
+        for key in KEY_LIST_TO_REMOVE:
+            if (key in hdr) is True:
+                hdr.remove(keyword=key)
+    except KeyError as key_error:
+        log.debug(key_error)
+
+    # Removing duplicated keywords
+    key_list = []
+    for key in list(hdr.keys()):
+        if key in key_list:
+            hdr.remove(keyword=key)
+        key_list.append(key)
+
+    hdr.add_history('Header and Shape fixed.')
+    return hdr
+
+
+def fix_shape(data):
+    """
+    Returns a 2D view of the data of a Goodman frame, [1,X,Y] --> [X,Y]. No data is
+    copied.
+    """
+    if data.ndim == 3:
+        return data[0]
+    return data
+
+
+def read_fixed(path):
+    """
+    Reads a raw Goodman frame and returns its data as a 2D array and its fixed
+    header, the same content as the h_ file written by fix_header_and_shape but
+    without writing anything to disk.
+    """
+    data, hdr = fits.getdata(path, header=True, ignore_missing_end=True)
+    return fix_shape(data), fix_header(hdr)
+
 
 def fix_header_and_shape(input_path, output_path, prefix, overwrite=False):
     """
@@ -17,32 +72,7 @@ def fix_header_and_shape(input_path, output_path, prefix, overwrite=False):
     """
     for _file in sorted(glob.glob(os.path.join(input_path, '*.fits'))):
 
-        ccddata, hdr = fits.getdata(_file, header=True, ignore_missing_end=True)
-        # 3D to 2D
-        ccddata = ccddata[0]
-        # keywords to remove
-        key_list_to_remove = ['PARAM0', 'PARAM61', 'PARAM62', 'PARAM63', 'NAXIS3', 'INSTRUME']
-
-        # Keyword to be changed (3 --> 2)
-        hdr['N_PARAM'] -= len(key_list_to_remove)
-        hdr['NAXIS'] = 2
-
-        # Specific keywords to be removed
-        for key in key_list_to_remove:
-            try:
-                if (key in hdr) is True:
-                    hdr.remove(keyword=key)
-            except KeyError:
-                pass
-
-        # Removing duplicated keywords
-        key_list = []
-        for key in hdr.iterkeys():
-            if key in key_list:
-                hdr.remove(keyword=key)
-            key_list.append(key)
-
-        hdr.add_history('Header and Shape fixed.')
+        ccddata, hdr = read_fixed(_file)
         fits.writeto(os.path.join(output_path, '') + prefix + os.path.basename(_file), ccddata, hdr,
                      clobber=overwrite)
         log.info('Keywords header of ' + os.path.basename(_file) + ' have been updated --> ' + prefix
@@ -67,6 +67,7 @@ import os
 import re
 import glob
 import argparse
+import hashlib
 import numpy as np
 from astropy.io import fits
 from astropy import log
@@ -79,16 +80,28 @@ from astroplan import Observer
 # from astroplan import get_IERS_A_or_workaround, download_IERS_A
 
 import ccdproc
-from ccdproc import ImageFileCollection
 from ccdproc import CCDData
 import warnings
 
+from parallel import map_frames
+from header_index import HeaderIndex
+from combine import combine_median, get_memory_limit
+from fix_header import fix_header, read_fixed
+from flat_arcorrection import normalize_flat
+from saturation import screen_frames
+from cosmic import clean_frames
+from manifest import Manifest, hash_array
+from watcher import DirectoryWatcher
+
 __author__ = 'David Sanmartim'
 __date__ = '2016-07-15'
 __version__ = "0.1"
 __email__ = "dsanmartim@ctio.noao.edu"
 __maintainer__ = "Simon Torres"
 
+# index of the headers of the raw files, kept in red_path since raw_path may be read-only
+RAW_INDEX_FILE_NAME = '.goodman_raw_header_index.sqlite'
+
 
 class Main(object):
     """Main class
@@ -118,15 +131,27 @@ class Main(object):
         self.master_flat_name = None
         self.master_flat_nogrt_name = None
 
+        # Files left out of the reduction, e.g. saturated flats when the h_ copies are not written
+        self.excluded_files = []
+
+        # Incremental mode, record of the reduced frames and fingerprint of the master calibrations
+        self.manifest = None
+        self.calibration_fingerprint = None
+        self._pending_records = []
+
+        # Collection and options of the frames being reduced by reduce_arc_frame and reduce_sci_frame
+        self._frame_collection = None
+        self._frame_options = {}
+
         # ToDo Check if the file already exist before download it
         # if get_IERS_A_or_workaround() is None:
         #     download_IERS_A(show_progress=True)
 
-        # Memory Limit to be used
-        self.memlim = 32E9
-        # self.memlim = 1E7
-        # For computer with up to 8GB of RAM
-        # self.memlim = 6E6
+        # Memory Limit to be used when combining frames, by default a fraction of the available memory
+        if self.args.memory_limit is None:
+            self.memlim = get_memory_limit()
+        else:
+            self.memlim = get_memory_limit(self.args.memory_limit * 1E6)
 
         # Taking some args from argparse method
         self.raw_path = str(os.path.join(self.args.raw_path[0], ''))
@@ -148,18 +173,29 @@ class Main(object):
 
     def __call__(self, *args, **kwargs):
 
-        # cleaning up the reduction dir
-        self.clean_path(self.red_path)
+        # In telescope mode the watcher is created before the existing frames are listed, so the frames that arrive
+        # during the reduction of the night are not taken as existing ones
+        watcher = None
+        if self.args.telescope:
+            watcher = DirectoryWatcher(self.raw_path, interval=self.args.poll_interval)
 
-        # Fixing header and shape of raw data
-        self.fix_header_and_shape(self.raw_path, self.red_path, prefix='h_', overwrite=True)
+        # cleaning up the reduction dir, unless only new or changed frames are to be reduced
+        if self.args.incremental:
+            self.manifest = Manifest(self.red_path)
+        else:
+            self.clean_path(self.red_path)
+
+        # Fixing header and shape of raw data. Unless the h_ copies are requested the raw frames are not rewritten,
+        # header and shape are fixed in memory when each frame is read.
+        if self.args.write_fixed:
+            self.fix_header_and_shape(self.raw_path, self.red_path, prefix='h_', overwrite=True, manifest=self.manifest)
+
+        # Create image file collection for raw data, headers are cached in an index
+        ic = self.get_image_collection()
 
         # remove saturated data
         if self.args.remove_saturated:
-            self.filter_saturated_flats()
-
-        # Create image file collection for raw data
-        ic = ImageFileCollection(self.red_path)
+            self.filter_saturated_flats(ic)
 
         # Getting twilight time
         twi_eve, twi_mor = self.get_twilight_time(ic, self.observatory, self.longitude, self.latitude,
@@ -174,6 +210,9 @@ class Main(object):
             log.info('No BIAS image detected')
             log.warning('The images will be processed but the results will not be optimal')
 
+        # every reduced frame depends on the master calibrations
+        self.calibration_fingerprint = self.get_calibration_fingerprint()
+
         # Reduce Night Flat frames (if they exist)
         self.reduce_nightflats(ic, twi_eve, twi_mor, self.args.slit, prefix='z')
 
@@ -183,6 +222,10 @@ class Main(object):
         # Reduce Sci frames
         self.reduce_sci(ic, self.args.slit, self.args.clean, prefix='fz')
 
+        # Keep reducing the frames that arrive while observing
+        if watcher is not None:
+            self.run_telescope_mode(ic, watcher)
+
         return
 
     @staticmethod
@@ -212,6 +255,76 @@ class Main(object):
                             metavar='<Value>',
                             help="Saturation limit. Default to 55.000 ADU (counts)")
 
+        parser.add_argument('--write-fixed',
+                            action='store_true',
+                            dest='write_fixed',
+                            help="Write a copy of every raw frame with fixed header and shape (h_*.fits) to red_path "
+                                 "before reducing. By default they are fixed in memory when read.")
+
+        parser.add_argument('--normalize-flat',
+                            action='store_true',
+                            dest='normalize_flat',
+                            help="Divide master flats taken with a grating by a polynomial fit to every row, "
+                                 "removing the spectral response of the lamp.")
+
+        parser.add_argument('--flat-order',
+                            action='store',
+                            default=55,
+                            type=int,
+                            dest='flat_order',
+                            metavar='<Order>',
+                            help="Maximum number of polynomial degrees tried for each row when using "
+                                 "--normalize-flat. Default to 55")
+
+        parser.add_argument('--memory-limit',
+                            action='store',
+                            default=None,
+                            type=float,
+                            dest='memory_limit',
+                            metavar='<MB>',
+                            help="Maximum memory in megabytes used to combine bias and flat frames. Default to half of "
+                                 "the available memory.")
+
+        parser.add_argument('--clean-tiles',
+                            action='store',
+                            default=1,
+                            type=int,
+                            dest='clean_tiles',
+                            metavar='<N>',
+                            help="Split every science frame in N overlapping tiles when cleaning cosmic rays, so the "
+                                 "processes given by --jobs share a single frame. Default to 1 (whole frames).")
+
+        parser.add_argument('--incremental',
+                            action='store_true',
+                            dest='incremental',
+                            help="Keep the reduced frames of a previous run and only reduce the frames that are new, "
+                                 "changed, or whose master calibrations or parameters changed. Master bias and flats "
+                                 "are always recreated.")
+
+        parser.add_argument('-t', '--telescope',
+                            action='store_true',
+                            dest='telescope',
+                            help="Telescope mode. After reducing the existing data keep watching raw_path and reduce "
+                                 "the new arc and science frames as they arrive, using the master calibrations "
+                                 "available. Stop with Ctrl+C.")
+
+        parser.add_argument('--poll-interval',
+                            action='store',
+                            default=2.,
+                            type=float,
+                            dest='poll_interval',
+                            metavar='<Seconds>',
+                            help="Seconds between checks for new frames in telescope mode. Default to 2.")
+
+        parser.add_argument('-j', '--jobs',
+                            action='store',
+                            default=1,
+                            type=int,
+                            dest='jobs',
+                            metavar='<N>',
+                            help="Number of processes used to reduce arc and science frames. Zero means all the "
+                                 "available cores. Default to 1 (serial).")
+
         parser.add_argument('raw_path', metavar='raw_path', type=str, nargs=1,
                             help="Full path to raw data (e.g. /home/jamesbond/soardata/).")
 
@@ -293,7 +406,7 @@ class Main(object):
                 os.remove(_file)
 
     @staticmethod
-    def fix_header_and_shape(input_path, output_path, prefix, overwrite=False):
+    def fix_header_and_shape(input_path, output_path, prefix, overwrite=False, manifest=None):
         """Remove/Update some  inconvenient parameters in the header of the Goodman FITS files.
 
         Some of these parameters contain non-printable ASCII characters. The output
@@ -304,71 +417,159 @@ class Main(object):
             output_path (str): Location of output data.
             prefix (str): Prefix to be added in the filename of output data
             overwrite (bool): If true it will overwrite existing data. Optional.
+            manifest (object): Manifest of the reduction directory in incremental mode, the copies whose raw file did
+                not change are not written again. Optional.
 
         """
 
         for _file in sorted(glob.glob(os.path.join(input_path, '*.fits'))):
 
-            ccddata, hdr = fits.getdata(_file, header=True, ignore_missing_end=True)
-
             # if not self.args.red_camera:
+            output_file = os.path.join(output_path, '') + prefix + os.path.basename(_file)
+            if manifest is not None:
+                record = manifest.make_record([_file], None, {'fix_header': __version__})
+                if manifest.is_current([output_file], record):
+                    log.debug('Header of ' + os.path.basename(_file) + ' is up to date')
+                    continue
 
-            # 3D to 2D
-            if ccddata.ndim is 3:
-                ccddata = ccddata[0]
-                hdr['NAXIS'] = 2
-
-            # keywords to remove
-            key_list_to_remove = ['PARAM0', 'PARAM61', 'PARAM62', 'PARAM63', 'NAXIS3', 'INSTRUME']
+            # 3D to 2D, inconvenient and duplicated keywords removed
+            ccddata, hdr = read_fixed(_file)
 
-            # Keyword to be changed (3 --> 2)
-            try:
-                hdr['N_PARAM'] -= len(key_list_to_remove)
-                # Specific keywords to be removed
-                for key in key_list_to_remove:
-                    if (key in hdr) is True:
-                        hdr.remove(keyword=key)
-            except KeyError as key_error:
-                log.debug(key_error)
-
-            # Removing duplicated keywords
-            key_list = []
-            for key in hdr.iterkeys():
-                if key in key_list:
-                    hdr.remove(keyword=key)
-                key_list.append(key)
-
-            hdr.add_history('Header and Shape fixed.')
-            fits.writeto(os.path.join(output_path, '') + prefix + os.path.basename(_file), ccddata, hdr,
-                         clobber=overwrite)
+            fits.writeto(output_file, ccddata, hdr, clobber=overwrite)
+            if manifest is not None:
+                manifest.record([output_file], record)
             log.info('Header of ' + os.path.basename(_file) + ' has been updated --> ' + prefix
                      + os.path.basename(_file))
         log.info('Done: All headers have been updated.')
         return
 
-    def filter_saturated_flats(self):
+    def filter_saturated_flats(self, image_collection):
         """Remove saturated flats
 
-        This method grabs all the images of OBSTYPE equal FLAT then reads the data and gets the value of its maximum and
-        then if this maximum is larger than the threshold which by default is 55000 the image will be removed from the
-        reduction directory therefore it will not exist for further processing. Note that is not the original image the
-        the one being deleted. The threshold can be changed by parsing the argument --saturation in the command line
-        plus the new value.
+        This method grabs all the images of OBSTYPE equal FLAT and checks whether they have pixels above the threshold
+        which by default is 55000, those images are removed from the collection therefore they will not be used for
+        further processing (and deleted from the reduction directory if the h_ copies were written). Note that is not
+        the original image the one being deleted. The threshold can be changed by parsing the argument --saturation in
+        the command line plus the new value.
+
+        The frames are read in blocks of rows and the reading stops at the first saturated block, the files are
+        screened in parallel according to --jobs. The peak and saturated fraction of every flat are logged as a table.
+
+        Args:
+            image_collection (object): HeaderIndex object that contains all header information of all images.
+
+        """
+        flats = image_collection.files_filtered(obstype='FLAT')
+        if len(flats) == 0:
+            return
+        paths = [image_collection.get_path(flat_image) for flat_image in flats]
+        summary = screen_frames(flats, paths, float(self.args.saturation_limit), jobs=self.args.jobs)
+        log.info('Saturation screening of flats (limit {:.1f}):\n{:s}'.format(
+            float(self.args.saturation_limit), '\n'.join(summary.pformat(max_lines=-1, max_width=-1))))
+
+        saturated = list(summary['file'][summary['saturated']])
+        for flat_image in saturated:
+            if self.args.write_fixed:
+                os.remove(image_collection.get_path(flat_image))
+            log.warning(flat_image + ' Removed.')
+        self.excluded_files.extend(saturated)
+        image_collection.exclude_files(saturated)
+
+    def get_image_collection(self, keywords=None):
+        """Collection of the frames to reduce
+
+        If the h_ copies have been written the collection is made of the files in red_path. Otherwise it indexes the raw
+        files, headers are fixed on the fly and the files are presented with the h_ prefix so the names of the products
+        are the same in both cases. Excluded files are left out.
+
+        Args:
+            keywords (list): Keywords to include in the summary. All of them if None.
+
+        Returns:
+            image_collection (object): HeaderIndex instance.
+
+        """
+        if self.args.write_fixed:
+            return HeaderIndex(self.red_path, keywords, exclude=self.excluded_files)
+        return HeaderIndex(self.raw_path, keywords, index_file=os.path.join(self.red_path, RAW_INDEX_FILE_NAME),
+                           prefix='h_', header_function=fix_header, exclude=self.excluded_files)
+
+    def get_calibration_fingerprint(self):
+        """Fingerprint of the master bias and master flats in memory
+
+        Returns:
+            fingerprint (str): MD5 of the data of the master calibrations.
+
         """
-        keywords = ['obstype']
-        ic = ImageFileCollection(self.red_path, keywords)
-        ic_pandas = ic.summary.to_pandas()
-        flats = ic_pandas['file'][ic_pandas['obstype'] == 'FLAT']
-        for flat_image in flats:
-            if os.path.isfile(flat_image):
-                data = fits.getdata(flat_image)
-                data_max = np.max(data)
-                # print(data_max)
-                if float(data_max) > float(self.args.saturation_limit):
-                    os.remove(flat_image)
-                    log.warning(flat_image + ' Removed.')
-            else:
-                log.error("Image %s doesn't exist", flat_image)
+        md5 = hashlib.md5()
+        if self.master_bias is not None:
+            hash_array(md5, self.master_bias.data)
+        for master_flat_name in sorted(self.master_flat.keys()):
+            md5.update(master_flat_name.encode('ascii'))
+            hash_array(md5, self.master_flat[master_flat_name].data)
+        return md5.hexdigest()
+
+    def filter_up_to_date(self, image_collection, file_list, prefixes, parameters):
+        """Leaves out the frames whose outputs are up to date, in incremental mode
+
+        A frame is up to date if all its outputs exist and the manifest shows they were produced from the same input
+        file, with the same master calibrations and parameters. The outputs of the frames that are not up to date are
+        removed and their records are kept until save_manifest is called.
+
+        Args:
+            image_collection (object): HeaderIndex instance returned by get_image_collection.
+            file_list (list): Frames to be reduced.
+            prefixes (list): Prefixes of the outputs of every frame.
+            parameters (dict): Parameters of the reduction that change the outputs.
+
+        Returns:
+            file_list (list): Frames that have to be reduced, all of them if not in incremental mode.
+
+        """
+        if self.manifest is None:
+            return file_list
+        parameters = dict(parameters, version=__version__, normalize_flat=self.args.normalize_flat,
+                          flat_order=self.args.flat_order)
+        outdated = []
+        for filename in file_list:
+            outputs = [prefix + filename for prefix in prefixes]
+            record = self.manifest.make_record([image_collection.get_path(filename)], self.calibration_fingerprint,
+                                               parameters)
+            if self.manifest.is_current(outputs, record):
+                log.info('Skipping ' + filename + ', its outputs are up to date')
+                continue
+            for output in outputs:
+                if os.path.isfile(output):
+                    os.remove(output)
+            self._pending_records.append((outputs, record))
+            outdated.append(filename)
+        return outdated
+
+    def save_manifest(self):
+        """Records the outputs written since the last call and writes the manifest, in incremental mode"""
+        if self.manifest is None:
+            return
+        for outputs, record in self._pending_records:
+            if all([os.path.isfile(output) for output in outputs]):
+                self.manifest.record(outputs, record)
+        self._pending_records = []
+        self.manifest.save()
+
+    def read_ccd(self, image_collection, filename):
+        """Reads a frame of the collection as CCDData
+
+        Args:
+            image_collection (object): HeaderIndex instance returned by get_image_collection.
+            filename (str): File name as it appears in the collection.
+
+        Returns:
+            ccd (object): CCDData instance with a 2D array and a fixed header.
+
+        """
+        if self.args.write_fixed:
+            return CCDData.read(image_collection.get_path(filename), unit=u.adu)
+        data, header = read_fixed(image_collection.get_path(filename))
+        return CCDData(data, meta=header, unit=u.adu)
 
     def find_slitedge(self, ccddata):
         """Find slit edge by inspecting signal variation in the spatial direction
@@ -417,7 +618,7 @@ class Main(object):
         """Get end/start time of evening/morning twilight
 
         Args:
-            image_collection (object): ImageFileCollection object that contains all header information of all images.
+            image_collection (object): HeaderIndex object that contains all header information of all images.
             observatory (str): Observatory name.
             longitude (str): Geographic longitude in string format.
             latitude (str): Geographic latitude in string format.
@@ -450,7 +651,7 @@ class Main(object):
             This method is not being used!
 
         Args:
-            image_collection (object): ImageFileCollection object that contains all header information of all images.
+            image_collection (object): HeaderIndex object that contains all header information of all images.
             twilight_evening:
             twilight_morning:
 
@@ -480,7 +681,7 @@ class Main(object):
             This method is not being used!
 
         Args:
-            image_collection (object): ImageFileCollection object that contains all header information of all images.
+            image_collection (object): HeaderIndex object that contains all header information of all images.
             twilight_evening:
             twilight_morning:
 
@@ -505,7 +706,7 @@ class Main(object):
         """Creates Master Flat of data taken at daytime
 
         Args:
-            image_collection (object): ImageFileCollection object that contains all header information of all images.
+            image_collection (object): HeaderIndex object that contains all header information of all images.
             twilight_evening:
             twilight_morning:
             slit:
@@ -548,19 +749,16 @@ class Main(object):
                 log.info('Combining and trimming flat frames:')
                 for filename in dic_flat[grt]:
                     log.info(filename)
-                    ccd = CCDData.read(os.path.join(image_collection.location, '') + filename, unit=u.adu)
-                    ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
-                    flat_list.append(ccd)
+                    flat_list.append(image_collection.get_path(filename))
 
                 # combinning and trimming slit edges
                 log.info('Flat list length: %s' % len(flat_list))
                 if len(flat_list) >= 1:
-                    master_flat = ccdproc.combine(flat_list,
-                                                  method='median',
-                                                  mem_limit=memory_limit,
-                                                  sigma_clip=True,
-                                                  sigma_clip_low_thresh=1.0,
-                                                  sigma_clip_high_thresh=1.0)
+                    master_flat = combine_median(flat_list,
+                                                 low_thresh=1.0,
+                                                 high_thresh=1.0,
+                                                 memory_limit=memory_limit,
+                                                 fix_raw=not self.args.write_fixed)
                     # self.master_flat.append(master_flat)
                 else:
                     log.info('Flat list empty')
@@ -570,6 +768,9 @@ class Main(object):
                     self.slit1, self.slit2 = self.find_slitedge(master_flat)
                     master_flat = ccdproc.trim_image(master_flat[self.slit1:self.slit2, :])
                 # self.master_flat.append(master_flat)
+                if self.args.normalize_flat:
+                    log.info('Normalizing master flat by the lamp spectral response')
+                    master_flat = normalize_flat(master_flat, order=self.args.flat_order, jobs=self.args.jobs)
 
                 self.master_flat_name = self.get_flat_name(master_flat.header, get_name_only=True)
                 self.master_flat[self.master_flat_name] = master_flat
@@ -598,18 +799,14 @@ class Main(object):
                         log.info('Combining and trimming flat frame taken without grating:')
                         for filename in no_grating_files:
                             log.info(filename)
-                            ccd = CCDData.read(os.path.join(image_collection.location, '') + filename, unit=u.adu)
-                            ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
-
-                            flatnogrt_list.append(ccd)
+                            flatnogrt_list.append(image_collection.get_path(filename))
 
                         # combining and trimming slit edges
-                        master_flat_nogrt = ccdproc.combine(flatnogrt_list,
-                                                            method='median',
-                                                            mem_limit=memory_limit,
-                                                            sigma_clip=True,
-                                                            sigma_clip_low_thresh=3.0,
-                                                            sigma_clip_high_thresh=3.0)
+                        master_flat_nogrt = combine_median(flatnogrt_list,
+                                                           low_thresh=3.0,
+                                                           high_thresh=3.0,
+                                                           memory_limit=memory_limit,
+                                                           fix_raw=not self.args.write_fixed)
 
                         if slit is True:
                             master_flat_nogrt = ccdproc.trim_image(
@@ -644,7 +841,7 @@ class Main(object):
             It does not discriminate different ROI's
 
         Args:
-            image_collection (object): ImageFileCollection object that contains all header information of all images.
+            image_collection (object): HeaderIndex object that contains all header information of all images.
             slit (bool): Whether to find slit limits and trim the image.
             memory_limit (float): Maximum amount of memory to use.
 
@@ -655,17 +852,15 @@ class Main(object):
         log.info('Combining and trimming bias frames:')
         for filename in image_collection.files_filtered(obstype='BIAS'):
             log.info(filename)
-            ccd = CCDData.read(os.path.join(image_collection.location, '') + filename, unit=u.adu)
             # Finding overscan regions... getting from header and assuming it is at the right edge...
             # over_start = int((ccd.header['TRIMSEC'].split(':'))[1].split(',')[0]) - 1
             # over_start += 10 / int(ccd.header['CCDSUM'][0])
             # ccd = ccdproc.subtract_overscan(ccd, median=True, overscan_axis=1, overscan=ccd[:, over_start:])
-            ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
-
-            bias_list.append(ccd)
+            bias_list.append(image_collection.get_path(filename))
 
-        self.master_bias = ccdproc.combine(bias_list, method='median', mem_limit=memory_limit, sigma_clip=True,
-                                           sigma_clip_low_thresh=3.0, sigma_clip_high_thresh=3.0)
+        # frames are trimmed while they are read
+        self.master_bias = combine_median(bias_list, low_thresh=3.0, high_thresh=3.0, memory_limit=memory_limit,
+                                          fix_raw=not self.args.write_fixed)
         if slit is True:
             self.master_bias = ccdproc.trim_image(self.master_bias[self.slit1:self.slit2, :])
             # else:
@@ -695,7 +890,7 @@ class Main(object):
         """
 
         Args:
-            image_collection (object): ImageFileCollection object that contains all header information of all images.
+            image_collection (object): HeaderIndex object that contains all header information of all images.
             twilight_evening:
             twilight_morning:
             slit (bool): Whether to find slit limits and trim the image.
@@ -718,10 +913,11 @@ class Main(object):
         dfobj = df['file'][(df['obstype'] == 'FLAT') & (df['grating'] != '<NO GRATING>') & night_condition]
         nightflat_list = dfobj.tolist()
 
+        nightflat_list = self.filter_up_to_date(image_collection, sorted(nightflat_list), [prefix], {'slit': slit})
         if len(nightflat_list) > 0:
             for filename in sorted(nightflat_list):
                 log.info('Trimming and bias subtracting frame ' + filename + ' --> ' + prefix + filename)
-                ccd = CCDData.read(os.path.join(image_collection.location, '') + filename, unit=u.adu)
+                ccd = self.read_ccd(image_collection, filename)
                 ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
                 ccd.header['HISTORY'] = "Trimmed"
                 if slit is True:
@@ -733,104 +929,206 @@ class Main(object):
                     ccd.header['HISTORY'] = "Bias NOT subtracted."
                     log.warning('No bias subtraction!')
                 ccd.write(prefix + filename, clobber=True)
+            self.save_manifest()
             log.info('Done --> Night flat frames have been reduced.')
             print('\n')
         return
 
     def reduce_arc(self, image_collection, slit, prefix):
+        """Reduce all the comparison lamps (arcs)
+
+        The frames are processed by reduce_arc_frame either sequentially or using a pool of processes depending on the
+        value of --jobs.
+
+        Args:
+            image_collection (object): HeaderIndex object that contains all header information of all images.
+            slit (bool): Whether to find slit limits and trim the image.
+            prefix (str): Prefix to name new file.
+
+        """
 
         log.info('Reducing Arc frames...')
 
         arc_list = image_collection.files_filtered(obstype='COMP')
+        arc_list = self.filter_up_to_date(image_collection, sorted(arc_list), [prefix], {'slit': slit})
 
         if len(arc_list) > 0:
-            for filename in sorted(arc_list):
-                log.info('Reducing Arc frame ' + filename + ' --> ' + prefix + filename)
-                ccd = CCDData.read(os.path.join(image_collection.location, '') + filename, unit=u.adu)
-                ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
-                if slit is True:
-                    ccd = ccdproc.trim_image(ccd[self.slit1:self.slit2, :])
-                if self.master_bias is not None:
-                    ccd = ccdproc.subtract_bias(ccd, self.master_bias)
-                    ccd.header['HISTORY'] = "Bias subtracted."
-                else:
-                    ccd.header['HISTORY'] = "Bias NOT subtracted."
-                    log.warning('No bias subtraction!')
-                flat_name = self.get_flat_name(ccd.header)
-                if flat_name is not False:
-                    ccd = ccdproc.flat_correct(ccd, self.master_flat[flat_name])
-                    ccd.header['HISTORY'] = "Trimmed. Flat corrected."
-                    ccd.write(prefix + filename, clobber=True)
-                else:
-                    log.info('No flat found to process ' + filename)
+            self._frame_collection = image_collection
+            self._frame_options = {'slit': slit, 'prefix': prefix}
+            map_frames(self.reduce_arc_frame, sorted(arc_list), jobs=self.args.jobs)
+            self.save_manifest()
             log.info('Done --> Arc frames have been reduced.')
             print('\n')
         return
 
-    def reduce_sci(self, image_collection, slit, clean, prefix):
-        """
+    def reduce_arc_frame(self, filename):
+        """Trim, bias subtract and flat correct a single comparison lamp
+
+        The collection of the file, the prefix and whether to trim the slit edges are taken from the attributes
+        _frame_collection and _frame_options that are set by reduce_arc, that way the method takes a single argument
+        and can be used by goodman_ccd.parallel.map_frames.
 
         Args:
-            image_collection (object): ImageFileCollection object that contains all header information of all images.
-            slit:
-            clean:
-            prefix:
+            filename (str): File name of the comparison lamp.
 
-        Returns:
+        """
+        slit = self._frame_options['slit']
+        prefix = self._frame_options['prefix']
+        log.info('Reducing Arc frame ' + filename + ' --> ' + prefix + filename)
+        ccd = self.read_ccd(self._frame_collection, filename)
+        ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
+        if slit is True:
+            ccd = ccdproc.trim_image(ccd[self.slit1:self.slit2, :])
+        if self.master_bias is not None:
+            ccd = ccdproc.subtract_bias(ccd, self.master_bias)
+            ccd.header['HISTORY'] = "Bias subtracted."
+        else:
+            ccd.header['HISTORY'] = "Bias NOT subtracted."
+            log.warning('No bias subtraction!')
+        flat_name = self.get_flat_name(ccd.header)
+        if flat_name is not False:
+            ccd = ccdproc.flat_correct(ccd, self.master_flat[flat_name])
+            ccd.header['HISTORY'] = "Trimmed. Flat corrected."
+            ccd.write(prefix + filename, clobber=True)
+        else:
+            log.info('No flat found to process ' + filename)
+
+    def reduce_sci(self, image_collection, slit, clean, prefix):
+        """Reduce all the science and standard star frames
+
+        The frames are processed by reduce_sci_frame either sequentially or using a pool of processes depending on the
+        value of --jobs. Cosmic rays are cleaned afterwards as a separate stage, see goodman_ccd.cosmic.
+
+        Args:
+            image_collection (object): HeaderIndex object that contains all header information of all images.
+            slit (bool): Whether to find slit limits and trim the image.
+            clean (bool): Whether to clean cosmic rays.
+            prefix (str): Prefix to name new file.
 
         """
 
         log.info('Reducing Sci/Std frames...')
-        for filename in image_collection.files_filtered(obstype='OBJECT'):
-            log.info('Reducing Sci/Std frame ' + filename + ' --> ' + prefix + filename)
-            ccd = CCDData.read(os.path.join(image_collection.location, '') + filename, unit=u.adu)
-            ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
-            if slit is True:
-                ccd = ccdproc.trim_image(ccd[self.slit1:self.slit2, :])
-            if self.master_bias is not None:
-                try:
-                    ccd = ccdproc.subtract_bias(ccd, self.master_bias)
-                    ccd.header['HISTORY'] = "Bias subtracted."
-                except ValueError as err:
-                    log.error("Data must be of only one kind. Please check your source data.")
-                    log.error("ValueError: " + str(err))
-                    continue
-            else:
-                ccd.header['HISTORY'] = "Bias NOT subtracted."
-                log.warning('No bias subtraction!')
-            # print ccd.header['filter'], ccd.header['grating']
-
-            flat_name = self.get_flat_name(ccd.header)
-            if flat_name is not False:
-                # print flat_name, ccd.header['GRATING']
-                ccd = ccdproc.flat_correct(ccd, self.master_flat[flat_name])
-                # OBS: cosmic ray rejection is working pretty well by defining gain = 1. It's not working
-                # when we use the real gain of the image. In this case the sky level changes by a factor
-                # equal the gain.
-                # Function to determine the sigfrac and objlim: y = 0.16 * exptime + 1.2
-                value = 0.16 * float(ccd.header['EXPTIME']) + 1.2
-                if clean is True:
-                    log.info('Cleaning cosmic rays... ')
-                    nccd, _ = ccdproc.cosmicray_lacosmic(ccd.data, sigclip=2.5, sigfrac=value, objlim=value,
-                                                         gain=float(ccd.header['GAIN']),
-                                                         readnoise=float(ccd.header['RDNOISE']),
-                                                         satlevel=np.inf, sepmed=True, fsmode='median',
-                                                         psfmodel='gaussy', verbose=True)
-                    log.info('Cosmic rays have been cleaned ' + prefix + filename + ' --> ' + 'c' + prefix + filename)
-                    print('\n')
-                    nccd = np.array(nccd, dtype=np.double) / float(ccd.header['GAIN'])
-                    ccd.header['HISTORY'] = "Trimmed. Flat corrected."
-                    ccd.header['HISTORY'] = "Cosmic rays rejected."
-                    fits.writeto('c' + prefix + filename, nccd, ccd.header, clobber=True)
-                elif clean is False:
-                    ccd.header['HISTORY'] = "Trimmed, Flat corrected."
-                ccd.write(prefix + filename, clobber=True)
-            else:
-                log.info('No flat found to process ' + filename)
+        self._frame_collection = image_collection
+        self._frame_options = {'slit': slit, 'clean': clean, 'prefix': prefix}
+        sci_list = image_collection.files_filtered(obstype='OBJECT')
+        if clean is True:
+            prefixes = [prefix, 'c' + prefix]
+        else:
+            prefixes = [prefix]
+        sci_list = self.filter_up_to_date(image_collection, sci_list, prefixes, {'slit': slit, 'clean': clean})
+        reduced = map_frames(self.reduce_sci_frame, sci_list, jobs=self.args.jobs)
         log.info('Done: Sci/Std frames have been reduced.')
         print('\n')
+        reduced = [output for output in reduced if output is not None]
+        if clean is True and len(reduced) > 0:
+            log.info('Cleaning cosmic rays... ')
+            clean_frames(reduced, prefix='c', jobs=self.args.jobs, tiles=self.args.clean_tiles)
+            print('\n')
+        self.save_manifest()
         return
 
+    def reduce_sci_frame(self, filename):
+        """Trim, bias subtract and flat correct a single science frame
+
+        Like reduce_arc_frame it takes the file collection and options from the attributes _frame_collection and
+        _frame_options that are set by reduce_sci.
+
+        Args:
+            filename (str): File name of the science frame.
+
+        Returns:
+            output (str): Name of the reduced frame or None if it was not written.
+
+        """
+        slit = self._frame_options['slit']
+        clean = self._frame_options['clean']
+        prefix = self._frame_options['prefix']
+        log.info('Reducing Sci/Std frame ' + filename + ' --> ' + prefix + filename)
+        ccd = self.read_ccd(self._frame_collection, filename)
+        ccd = ccdproc.trim_image(ccd, fits_section=ccd.header['TRIMSEC'])
+        if slit is True:
+            ccd = ccdproc.trim_image(ccd[self.slit1:self.slit2, :])
+        if self.master_bias is not None:
+            try:
+                ccd = ccdproc.subtract_bias(ccd, self.master_bias)
+                ccd.header['HISTORY'] = "Bias subtracted."
+            except ValueError as err:
+                log.error("Data must be of only one kind. Please check your source data.")
+                log.error("ValueError: " + str(err))
+                return
+        else:
+            ccd.header['HISTORY'] = "Bias NOT subtracted."
+            log.warning('No bias subtraction!')
+        # print ccd.header['filter'], ccd.header['grating']
+
+        flat_name = self.get_flat_name(ccd.header)
+        if flat_name is not False:
+            # print flat_name, ccd.header['GRATING']
+            ccd = ccdproc.flat_correct(ccd, self.master_flat[flat_name])
+            if clean is True:
+                # cleaned afterwards by goodman_ccd.cosmic.clean_frames
+                ccd.header['HISTORY'] = "Trimmed. Flat corrected."
+                ccd.header['HISTORY'] = "Cosmic rays rejected."
+            elif clean is False:
+                ccd.header['HISTORY'] = "Trimmed, Flat corrected."
+            ccd.write(prefix + filename, clobber=True)
+            return prefix + filename
+        else:
+            log.info('No flat found to process ' + filename)
+
+    def run_telescope_mode(self, image_collection, watcher):
+        """Reduces new frames as they are written to raw_path
+
+        The frames that arrived while the existing data was reduced are reduced first.
+
+        Args:
+            image_collection (object): HeaderIndex object used for the reduction of the existing data, it is refreshed
+                for every new frame.
+            watcher (object): DirectoryWatcher of raw_path created before image_collection.
+
+        """
+        log.info('Telescope mode: waiting for new frames in ' + self.raw_path + ' (Ctrl+C to stop)')
+        self._frame_collection = image_collection
+        # frames written after the watcher was created but indexed in the collection are already reduced, and the
+        # excluded ones, e.g. saturated flats, are left out on purpose
+        processed_files = list(image_collection.files_filtered(obstype='*')) + self.excluded_files
+        watcher.mark_seen([os.path.join(self.raw_path, file_name[len('h_'):]) for file_name in processed_files])
+        watcher.watch(self.reduce_new_frame)
+
+    def reduce_new_frame(self, path):
+        """Fixes, calibrates and, if requested, cleans a single new raw frame
+
+        Only comparison lamps and science frames are reduced, with the master calibrations already in memory.
+
+        Args:
+            path (str): Full path of the raw frame.
+
+        """
+        filename = 'h_' + os.path.basename(path)
+        if self.args.write_fixed:
+            ccddata, hdr = read_fixed(path)
+            fits.writeto(os.path.join(self.red_path, filename), ccddata, hdr, clobber=True)
+        self._frame_collection.refresh()
+        if filename not in self._frame_collection.files_filtered(obstype='*'):
+            log.warning('Frame ' + filename + ' was not found in the collection')
+            return
+        obstype = self._frame_collection.headers(filename)['OBSTYPE']
+        if obstype == 'COMP':
+            if len(self.filter_up_to_date(self._frame_collection, [filename], ['fz'], {'slit': self.args.slit})) > 0:
+                self._frame_options = {'slit': self.args.slit, 'prefix': 'fz'}
+                self.reduce_arc_frame(filename)
+        elif obstype == 'OBJECT':
+            prefixes = ['fz', 'cfz'] if self.args.clean else ['fz']
+            parameters = {'slit': self.args.slit, 'clean': self.args.clean}
+            if len(self.filter_up_to_date(self._frame_collection, [filename], prefixes, parameters)) > 0:
+                self._frame_options = {'slit': self.args.slit, 'clean': self.args.clean, 'prefix': 'fz'}
+                output = self.reduce_sci_frame(filename)
+                if self.args.clean and output is not None:
+                    clean_frames([output], prefix='c', jobs=self.args.jobs, tiles=self.args.clean_tiles)
+        else:
+            log.info('Frame ' + filename + ' of type ' + str(obstype) + ' is not reduced in telescope mode')
+        self.save_manifest()
+
     def get_flat_name(self, header, get_name_only=False):
         """Reproduce the name of a suitable master flat and check if exist.
 
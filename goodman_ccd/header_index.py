@@ -0,0 +1,293 @@
+"""Persistent index of FITS headers
+
+ccdproc's ImageFileCollection opens every file of a directory each time it is created, on archives with thousands of
+frames, particularly when they are mounted through NFS, that header scan is what dominates the startup of redccd and
+redspec. HeaderIndex offers the subset of the ImageFileCollection interface used by both pipelines (location, summary,
+files_filtered and values) but keeps the headers in a small SQLite database next to the data. Every entry is keyed by
+the file name and remembers the size and modification time of the file, so when the index is refreshed only new or
+changed files are opened and entries of files that no longer exist are dropped.
+
+Examples:
+    >>> index = HeaderIndex('/data/RED/', keywords=['obstype', 'object'])
+    >>> index.files_filtered(obstype='OBJECT')
+    >>> df = index.summary.to_pandas()
+
+"""
+import os
+import glob
+import sqlite3
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table, MaskedColumn
+from astropy import log
+
+# name of the database created inside the indexed directory
+INDEX_FILE_NAME = '.goodman_header_index.sqlite'
+
+# extensions recognized as FITS files, the same as ImageFileCollection
+FITS_EXTENSIONS = ['fit', 'fits', 'fts']
+
+# header cards that are never part of the summary
+_IGNORED_KEYWORDS = ['', 'COMMENT', 'HISTORY']
+
+
+class HeaderIndex(object):
+    """Incrementally updated collection of FITS headers
+
+    Attributes:
+        location (str): Directory that is indexed.
+        keywords (list): Lower case keywords included in the summary, None means all of them.
+        index_file (str): Full path of the SQLite database.
+        prefix (str): Prefix added to the file names in the summary.
+        header_function (callable): Function applied to every header before it is used, e.g.
+            goodman_ccd.fix_header.fix_header. The index always stores the headers as they are on disk.
+        exclude (set): File names, including the prefix, left out of the summary.
+        summary (object): astropy.table.Table with a 'file' column plus one column per keyword. Missing values are
+            masked. None if there are no FITS files in location.
+
+    """
+
+    def __init__(self, location, keywords=None, index_file=None, refresh=True, prefix='', header_function=None,
+                 exclude=None):
+        """Opens or creates the index and updates it
+
+        Args:
+            location (str): Directory with FITS files.
+            keywords (list): Keywords to include in the summary, the comparison is case insensitive. If None or '*'
+                every keyword found in the headers is used.
+            index_file (str): Database to use. Default to INDEX_FILE_NAME inside location. If the location is not
+                writable the index is kept in memory for the current run only.
+            refresh (bool): Scan location and update the index at creation time.
+            prefix (str): Prefix added to the names of the files in the summary. Used to present raw files under the
+                names their fixed copies would have (h_).
+            header_function (callable): Function that takes a header and returns the header to use.
+            exclude (list): Files to leave out of the summary, with the prefix.
+
+        """
+        self.location = location
+        if keywords is None or keywords == '*':
+            self.keywords = None
+        else:
+            self.keywords = [str(key).lower() for key in keywords]
+        if index_file is None:
+            index_file = os.path.join(location, INDEX_FILE_NAME)
+        self.index_file = index_file
+        self.prefix = prefix
+        self.header_function = header_function
+        self.exclude = set(exclude or [])
+        self.summary = None
+        self._headers = {}
+        self._connection = self._connect(index_file)
+        if refresh:
+            self.refresh()
+
+    @staticmethod
+    def _connect(index_file):
+        """Opens the database and creates the table if necessary
+
+        Args:
+            index_file (str): Full path of the database.
+
+        Returns:
+            connection (object): sqlite3 connection.
+
+        """
+        try:
+            connection = sqlite3.connect(index_file)
+            connection.execute('CREATE TABLE IF NOT EXISTS headers '
+                               '(file TEXT PRIMARY KEY, size INTEGER, mtime REAL, header TEXT)')
+            connection.commit()
+        except sqlite3.Error as error:
+            log.warning("Can't use header index %s (%s), headers will not be cached", index_file, error)
+            connection = sqlite3.connect(':memory:')
+            connection.execute('CREATE TABLE headers (file TEXT PRIMARY KEY, size INTEGER, mtime REAL, header TEXT)')
+        # headers may contain non ASCII characters
+        connection.text_factory = str
+        return connection
+
+    def list_files(self):
+        """Lists the FITS files in location, not recursive
+
+        Returns:
+            file_list (list): Sorted list of file names without the directory.
+
+        """
+        file_list = []
+        for extension in FITS_EXTENSIONS:
+            for pattern in ['*.' + extension, '*.' + extension + '.gz']:
+                file_list.extend(glob.glob(os.path.join(self.location, pattern)))
+        return sorted(set([os.path.basename(path) for path in file_list]))
+
+    def refresh(self):
+        """Updates the index with the current content of location
+
+        Only the headers of files that are not in the index or whose size or modification time changed are read.
+
+        Returns:
+            updated (int): Number of headers read from disk.
+
+        """
+        cursor = self._connection.cursor()
+        cursor.execute('SELECT file, size, mtime, header FROM headers')
+        cached = dict([(row[0], row[1:]) for row in cursor.fetchall()])
+
+        headers = {}
+        updated = 0
+        for file_name in self.list_files():
+            path = os.path.join(self.location, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = cached.pop(file_name, None)
+            if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+                headers[file_name] = entry[2]
+                continue
+            try:
+                header = fits.getheader(path, ext=0, ignore_missing_end=True)
+            except (IOError, OSError) as error:
+                log.error("Can't read header of %s: %s", file_name, error)
+                continue
+            headers[file_name] = header.tostring()
+            cursor.execute('INSERT OR REPLACE INTO headers (file, size, mtime, header) VALUES (?, ?, ?, ?)',
+                           (file_name, stat.st_size, stat.st_mtime, headers[file_name]))
+            updated += 1
+
+        # what is left in cached no longer exists
+        cursor.executemany('DELETE FROM headers WHERE file = ?', [(file_name,) for file_name in cached])
+        self._connection.commit()
+        if updated > 0 or len(cached) > 0:
+            log.debug('Header index %s: %s headers read, %s removed', self.index_file, updated, len(cached))
+
+        self._headers = headers
+        self.summary = self._make_summary()
+        return updated
+
+    def headers(self, file_name):
+        """Returns the header of a file, after header_function if there is one
+
+        Args:
+            file_name (str): File name without the directory, as it appears in the summary (with the prefix).
+
+        Returns:
+            header (object): astropy.io.fits.Header
+
+        """
+        header = fits.Header.fromstring(self._headers[file_name[len(self.prefix):]])
+        if self.header_function is not None:
+            header = self.header_function(header)
+        return header
+
+    def get_path(self, file_name):
+        """Full path of the file on disk
+
+        Args:
+            file_name (str): File name as it appears in the summary (with the prefix).
+
+        Returns:
+            path (str): Path of the file in location.
+
+        """
+        return os.path.join(self.location, file_name[len(self.prefix):])
+
+    def _make_summary(self):
+        """Builds the summary table from the cached headers
+
+        Returns:
+            summary (object): astropy.table.Table or None if there are no files.
+
+        """
+        file_names = [self.prefix + file_name for file_name in sorted(self._headers.keys())]
+        file_names = [file_name for file_name in file_names if file_name not in self.exclude]
+        if len(file_names) == 0:
+            return None
+
+        rows = []
+        keywords = self.keywords
+        found = []
+        for file_name in file_names:
+            header = self.headers(file_name)
+            row = {}
+            for card in header.cards:
+                key = card.keyword.lower()
+                if card.keyword in _IGNORED_KEYWORDS or key in row:
+                    continue
+                row[key] = card.value
+                if keywords is None and key not in found:
+                    found.append(key)
+            rows.append(row)
+        if keywords is None:
+            keywords = found
+
+        summary = Table(masked=True)
+        summary['file'] = file_names
+        for key in keywords:
+            values = [row.get(key) for row in rows]
+            mask = [value is None or isinstance(value, fits.card.Undefined) for value in values]
+            present = [value for value, missing in zip(values, mask) if not missing]
+            if len(present) == 0:
+                summary[key] = MaskedColumn(data=[''] * len(values), mask=mask)
+                continue
+            column = np.array(present)
+            fill = column[0]
+            data = np.array([fill if missing else value for value, missing in zip(values, mask)], dtype=column.dtype)
+            summary[key] = MaskedColumn(data=data, mask=mask)
+        return summary
+
+    def exclude_files(self, file_list):
+        """Leaves files out of the summary
+
+        Args:
+            file_list (list): File names as they appear in the summary.
+
+        """
+        self.exclude.update(file_list)
+        self.summary = self._make_summary()
+
+    def values(self, keyword, unique=False):
+        """Values of a keyword for every file of the summary
+
+        Args:
+            keyword (str): Keyword name, case insensitive.
+            unique (bool): Return only distinct values.
+
+        Returns:
+            values (list): Values in the same order as the files, or unique values if requested.
+
+        """
+        if self.summary is None:
+            return []
+        values = list(self.summary[keyword.lower()])
+        if unique:
+            return list(set(values))
+        return values
+
+    def files_filtered(self, **kwd):
+        """Names of the files whose headers match the given keyword values
+
+        Works as ImageFileCollection.files_filtered: string comparisons are case insensitive and a value of '*'
+        matches any file that has the keyword.
+
+        Args:
+            **kwd: Keyword and value pairs, e.g. obstype='OBJECT'.
+
+        Returns:
+            file_list (list): File names, without the directory.
+
+        """
+        if self.summary is None:
+            return []
+        match = np.ones(len(self.summary), dtype=bool)
+        for key, value in kwd.items():
+            key = key.lower()
+            if key not in self.summary.colnames:
+                return []
+            column = self.summary[key]
+            present = ~np.ma.getmaskarray(column)
+            if value == '*':
+                match &= present
+            elif isinstance(value, str):
+                match &= present & np.array([str(item).lower() == value.lower() for item in column], dtype=bool)
+            else:
+                match &= present & np.array([item == value for item in column], dtype=bool)
+        return list(self.summary['file'][match])
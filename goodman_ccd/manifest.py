@@ -0,0 +1,135 @@
+"""Record of the inputs of every reduced frame
+
+Used by the incremental mode of redccd. For every output file the manifest stores the fingerprint (MD5) of the input
+frame, a fingerprint of the master calibrations that were used and the parameters of the reduction. When redccd is run
+again on the same night only the frames that are new or whose record does not match anymore are reduced. The manifest
+is a JSON file in the reduction directory. Hashing a file means reading it completely, so the fingerprints are also
+cached together with the size and modification time of the file and are only computed again if those change.
+
+"""
+import os
+import json
+import hashlib
+from astropy import log
+
+# name of the manifest inside the reduction directory
+MANIFEST_FILE_NAME = '.goodman_manifest.json'
+
+# bytes read at once when hashing a file
+_HASH_BLOCK_SIZE = 2 ** 22
+
+
+def hash_array(hash_object, array):
+    """Updates a hash object with the content of an array
+
+    Args:
+        hash_object (object): Object from hashlib.
+        array (array): numpy array, its shape and dtype are included.
+
+    """
+    hash_object.update(str(array.shape).encode('ascii'))
+    hash_object.update(str(array.dtype).encode('ascii'))
+    hash_object.update(array.tobytes() if hasattr(array, 'tobytes') else array.tostring())
+
+
+class Manifest(object):
+    """Dependency record of a reduction directory
+
+    Attributes:
+        path (str): Full path of the JSON file.
+        outputs (dict): For every output file name a dictionary with the keys 'inputs', 'calibrations' and 'parameters'.
+        fingerprints (dict): Cache of file fingerprints, path: [size, mtime, md5].
+
+    """
+
+    def __init__(self, location, file_name=MANIFEST_FILE_NAME):
+        """Loads the manifest of a reduction directory, if there is one
+
+        Args:
+            location (str): Reduction directory.
+            file_name (str): Name of the manifest file.
+
+        """
+        self.path = os.path.join(location, file_name)
+        self.outputs = {}
+        self.fingerprints = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as manifest_file:
+                    content = json.load(manifest_file)
+                self.outputs = content.get('outputs', {})
+                self.fingerprints = content.get('fingerprints', {})
+            except (IOError, ValueError) as error:
+                log.warning('Ignoring unreadable manifest %s: %s', self.path, error)
+
+    def save(self):
+        """Writes the manifest to disk"""
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump({'outputs': self.outputs, 'fingerprints': self.fingerprints}, manifest_file, indent=1,
+                      sort_keys=True)
+        os.rename(temporary_path, self.path)
+
+    def fingerprint(self, path):
+        """MD5 of the content of a file
+
+        Args:
+            path (str): Full path of the file.
+
+        Returns:
+            md5 (str): Hexadecimal digest.
+
+        """
+        stat = os.stat(path)
+        cached = self.fingerprints.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+        md5 = hashlib.md5()
+        with open(path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(_HASH_BLOCK_SIZE), b''):
+                md5.update(block)
+        self.fingerprints[path] = [stat.st_size, stat.st_mtime, md5.hexdigest()]
+        return md5.hexdigest()
+
+    def make_record(self, inputs, calibrations, parameters):
+        """Builds the record of an output
+
+        Args:
+            inputs (list): Full path of the input files.
+            calibrations (str): Fingerprint of the calibrations.
+            parameters (dict): Reduction parameters that change the output, values must be JSON serializable.
+
+        Returns:
+            record (dict): Record to be compared or stored.
+
+        """
+        return {'inputs': dict([(path, self.fingerprint(path)) for path in inputs]),
+                'calibrations': calibrations,
+                'parameters': parameters}
+
+    def is_current(self, outputs, record):
+        """Whether a set of outputs exists and was produced from the same inputs
+
+        Args:
+            outputs (list): Output files, relative to the current directory.
+            record (dict): Record returned by make_record.
+
+        Returns:
+            current (bool): True if every output exists and its stored record is equal to record.
+
+        """
+        for output in outputs:
+            if not os.path.isfile(output) or self.outputs.get(output) != record:
+                return False
+        return True
+
+    def record(self, outputs, record):
+        """Stores the record of a set of outputs
+
+        Args:
+            outputs (list): Output files.
+            record (dict): Record returned by make_record.
+
+        """
+        for output in outputs:
+            self.outputs[output] = record
@@ -0,0 +1,153 @@
+"""Process pool helpers for frame level parallelism
+
+Most of the reduction steps work on one file at a time, the helpers in this module run such a step over a list of files
+using a pool of worker processes. The pool is created after the master bias and master flats exist, since the workers
+are forked from the main process they inherit those objects as read-only (copy-on-write) memory and only the file names
+and the return values travel through the pool's queues.
+
+Log messages emitted by the workers reach the terminal in the order the workers happen to run. When the order matters
+map_frames_logged keeps the records of every item and emits them from the main process in the order of the items,
+so the log looks exactly like the one of the serial run.
+
+Notes:
+    This relies on the ``fork`` start method of multiprocessing, which is the default on Linux and Mac OSX for
+    Python 2.7.
+
+"""
+import logging
+import multiprocessing
+from functools import partial
+from astropy import log
+
+# function executed by the workers, it is set once per worker by the pool initializer
+_WORKER_FUNCTION = None
+
+
+def _init_worker(function):
+    """Pool initializer, stores the function to be executed by the worker
+
+    Args:
+        function (callable): Function or bound method that takes a single argument.
+
+    """
+    global _WORKER_FUNCTION
+    _WORKER_FUNCTION = function
+
+
+def _run_worker(item):
+    """Executes the worker function on a single item"""
+    return _WORKER_FUNCTION(item)
+
+
+def get_number_of_jobs(jobs):
+    """Translates the value given to --jobs into a number of processes
+
+    Args:
+        jobs (int): Requested number of processes. Zero or a negative value means all the available cores.
+
+    Returns:
+        jobs (int): Number of processes to use, always larger than zero.
+
+    """
+    if jobs is None:
+        return 1
+    elif int(jobs) < 1:
+        return multiprocessing.cpu_count()
+    return int(jobs)
+
+
+def map_frames(function, items, jobs=1):
+    """Applies a function to every element of a list, in parallel if requested
+
+    The results are returned in the same order as the input regardless of the order in which the workers finish,
+    therefore the outcome is the same as the one of the serial path. When jobs is one or there is a single item no pool
+    is created at all.
+
+    Args:
+        function (callable): Function or bound method that takes a single argument.
+        items (list): Arguments for function, usually file names.
+        jobs (int): Number of processes to use. See get_number_of_jobs.
+
+    Returns:
+        results (list): Return values of function in the same order as items.
+
+    """
+    items = list(items)
+    jobs = min(get_number_of_jobs(jobs), len(items))
+    if jobs <= 1:
+        return [function(item) for item in items]
+
+    log.info('Processing %s frames using %s processes', len(items), jobs)
+    pool = multiprocessing.Pool(processes=jobs, initializer=_init_worker, initargs=(function,))
+    try:
+        # map_async plus get with a timeout is the only way to keep KeyboardInterrupt working in Python 2.7
+        results = pool.map_async(_run_worker, items, chunksize=1).get(9999999)
+        pool.close()
+    except (KeyboardInterrupt, Exception):
+        # an exception raised by a worker is re-raised here, the rest of the pool is stopped
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+class _RecordBuffer(logging.Handler):
+    """Logging handler that keeps the records instead of emitting them"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        # arguments and tracebacks may not be picklable, the message is formatted in the worker
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+def _run_logged(function, item):
+    """Executes function on item and returns its result together with the log records emitted meanwhile"""
+    root = logging.getLogger()
+    buffer_handler = _RecordBuffer()
+    handlers = root.handlers[:]
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(buffer_handler)
+    try:
+        result = function(item)
+    finally:
+        root.removeHandler(buffer_handler)
+        for handler in handlers:
+            root.addHandler(handler)
+    return result, buffer_handler.records
+
+
+def map_frames_logged(function, items, jobs=1):
+    """Same as map_frames but the log of every item is emitted in order by the main process
+
+    Only the records of the standard logging module that propagate to the root logger are captured, in particular
+    the loggers of redspec. The records of an item are emitted once all the items are done.
+
+    Args:
+        function (callable): Function or bound method that takes a single argument.
+        items (list): Arguments for function.
+        jobs (int): Number of processes to use. See get_number_of_jobs.
+
+    Returns:
+        results (list): Return values of function in the same order as items.
+
+    """
+    items = list(items)
+    if min(get_number_of_jobs(jobs), len(items)) <= 1:
+        return [function(item) for item in items]
+
+    results = []
+    for result, records in map_frames(partial(_run_logged, function), items, jobs=jobs):
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        results.append(result)
+    return results
@@ -0,0 +1,83 @@
+"""Screening of saturated frames
+
+Deciding whether a flat is saturated only needs to find one pixel above the limit. screen_saturation reads the frame
+in blocks of rows and stops at the first block above the limit, so for the common case of a saturated flat only a
+fraction of the file is read and for a good one the cost is a single pass over the data, without keeping the whole
+array in memory. screen_frames runs it over many files using goodman_ccd.parallel.map_frames.
+
+"""
+from functools import partial
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+
+from parallel import map_frames
+
+# number of rows read at once
+DEFAULT_BLOCK_ROWS = 256
+
+
+def screen_saturation(path, saturation_limit, block_rows=DEFAULT_BLOCK_ROWS, full_scan=False):
+    """Checks whether a frame has pixels above the saturation limit
+
+    Args:
+        path (str): Full path of the FITS file. 3D raw frames of shape [1, Y, X] are accepted.
+        saturation_limit (float): Pixels with values larger than this are saturated.
+        block_rows (int): Number of rows read at once.
+        full_scan (bool): Read the whole frame even after a saturated block was found, which gives the true peak and
+            fraction.
+
+    Returns:
+        result (dict): 'peak' maximum value, 'fraction' fraction of saturated pixels, 'scanned' fraction of rows
+            read and 'saturated' the decision. Unless full_scan is True, peak and fraction only account for the rows
+            read.
+
+    """
+    peak = -np.inf
+    n_saturated = 0
+    n_pixels = 0
+    # sections of a file opened without memmap read only the requested rows, also for scaled (BZERO) data
+    with fits.open(path, memmap=False, ignore_missing_end=True) as hdu_list:
+        hdu = hdu_list[0]
+        n_rows = hdu.header['NAXIS2']
+        three_d = hdu.header['NAXIS'] == 3
+        for start in range(0, n_rows, block_rows):
+            if three_d:
+                block = hdu.section[0, start:start + block_rows, :]
+            else:
+                block = hdu.section[start:start + block_rows, :]
+            peak = max(peak, float(np.max(block)))
+            n_saturated += int(np.count_nonzero(block > saturation_limit))
+            n_pixels += block.size
+            if n_saturated > 0 and not full_scan:
+                break
+    return {'peak': peak,
+            'fraction': float(n_saturated) / max(n_pixels, 1),
+            'scanned': min(1., float(start + block_rows) / n_rows),
+            'saturated': n_saturated > 0}
+
+
+def screen_frames(file_names, paths, saturation_limit, jobs=1, full_scan=False):
+    """Screens a list of frames and returns a summary table
+
+    Args:
+        file_names (list): Names used in the table.
+        paths (list): Full path of every file, in the same order as file_names.
+        saturation_limit (float): Pixels with values larger than this are saturated.
+        jobs (int): Number of processes. See goodman_ccd.parallel.get_number_of_jobs.
+        full_scan (bool): See screen_saturation.
+
+    Returns:
+        summary (object): astropy.table.Table with columns file, peak, fraction, scanned and saturated.
+
+    """
+    results = map_frames(partial(screen_saturation, saturation_limit=saturation_limit, full_scan=full_scan),
+                         paths, jobs=jobs)
+    summary = Table()
+    summary['file'] = list(file_names)
+    for column in ['peak', 'fraction', 'scanned', 'saturated']:
+        summary[column] = [result[column] for result in results]
+    summary['peak'].format = '.1f'
+    summary['fraction'].format = '.2e'
+    summary['scanned'].format = '.2f'
+    return summary
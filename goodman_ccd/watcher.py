@@ -0,0 +1,165 @@
+"""Detection of new frames for the telescope mode
+
+DirectoryWatcher polls a directory for new FITS files. A file is considered complete when its size did not change
+between two consecutive polls, so frames being written by the acquisition system (or by redccd, when redspec watches
+the reduction directory) are not read half written. Complete files are put in a bounded queue by a background thread
+and consumed in the main thread by watch(), therefore the latency is at most two polling intervals plus the time to
+process the frames queued before. When a burst of frames fills the queue the extra files wait in a backlog of the
+watcher and are queued as soon as there is room, nothing is lost and the detection of new files is never blocked.
+
+Polling is used instead of inotify because it has no dependencies and also works on NFS mounted directories.
+
+"""
+import os
+import glob
+import time
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from astropy import log
+
+# seconds between polls
+DEFAULT_INTERVAL = 2.0
+
+# maximum number of complete frames waiting to be processed
+DEFAULT_QUEUE_SIZE = 32
+
+
+class DirectoryWatcher(object):
+    """Polls a directory and queues the new files
+
+    Attributes:
+        location (str): Watched directory.
+        patterns (list): glob patterns of the files of interest.
+        interval (float): Seconds between polls.
+        frames (object): Bounded queue of full paths of complete files, in order of detection.
+
+    """
+
+    def __init__(self, location, patterns=None, interval=DEFAULT_INTERVAL, queue_size=DEFAULT_QUEUE_SIZE,
+                 ignore_existing=True):
+        """Creates the watcher, the polling starts with start() or watch()
+
+        Args:
+            location (str): Directory to watch.
+            patterns (list): glob patterns of the files of interest. Default to ['*.fits'].
+            interval (float): Seconds between polls.
+            queue_size (int): Maximum number of files in the queue.
+            ignore_existing (bool): Files already present are not reported.
+
+        """
+        self.location = location
+        if patterns is None:
+            patterns = ['*.fits']
+        self.patterns = patterns
+        self.interval = interval
+        self.frames = queue.Queue(maxsize=queue_size)
+        self._seen = set()
+        self._sizes = {}
+        self._backlog = []
+        self._stop = threading.Event()
+        self._thread = None
+        if ignore_existing:
+            self._seen.update(self._list_files())
+
+    def mark_seen(self, paths):
+        """Files that are not reported as new, e.g. those already processed since the watcher was created
+
+        Args:
+            paths (list): Full paths of the files.
+
+        """
+        self._seen.update(paths)
+
+    def _list_files(self):
+        """Full path of the files that match the patterns"""
+        file_list = set()
+        for pattern in self.patterns:
+            file_list.update(glob.glob(os.path.join(self.location, pattern)))
+        return file_list
+
+    def poll(self):
+        """Looks for new complete files
+
+        Returns:
+            new_files (list): Sorted full paths of files that were not reported before and whose size did not change
+                since the previous poll.
+
+        """
+        new_files = []
+        sizes = {}
+        for path in sorted(self._list_files() - self._seen):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if size > 0 and self._sizes.get(path) == size:
+                new_files.append(path)
+                self._seen.add(path)
+            else:
+                sizes[path] = size
+        self._sizes = sizes
+        return new_files
+
+    def _queue_files(self, new_files):
+        """Moves files to the queue, those that do not fit stay in the backlog"""
+        self._backlog.extend(new_files)
+        while len(self._backlog) > 0:
+            try:
+                self.frames.put_nowait(self._backlog[0])
+            except queue.Full:
+                if len(new_files) > 0:
+                    log.warning('Frame queue is full, %s frames waiting', len(self._backlog))
+                break
+            self._backlog.pop(0)
+
+    def _run(self):
+        """Polling loop of the background thread"""
+        while not self._stop.is_set():
+            self._queue_files(self.poll())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Starts polling in a background thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='DirectoryWatcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def watch(self, callback, timeout=None):
+        """Calls a function for every new file until interrupted
+
+        Errors raised by callback are logged and the watcher continues with the next file.
+
+        Args:
+            callback (callable): Function that takes the full path of a new file.
+            timeout (float): Stop after this many seconds without new files. None means forever, until Ctrl+C.
+
+        """
+        self.start()
+        last_frame = time.time()
+        try:
+            while timeout is None or time.time() - last_frame < timeout:
+                try:
+                    # a finite timeout keeps KeyboardInterrupt working in Python 2.7
+                    path = self.frames.get(timeout=self.interval)
+                except queue.Empty:
+                    continue
+                last_frame = time.time()
+                try:
+                    callback(path)
+                except Exception as error:
+                    log.error('Processing of %s failed: %s', os.path.basename(path), error)
+        except KeyboardInterrupt:
+            log.info('Telescope mode interrupted')
+        finally:
+            self.stop()
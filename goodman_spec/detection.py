@@ -0,0 +1,181 @@
+"""Detection of spectra in a spatial profile
+
+Process.identify_spectra collapses a band of the image along the dispersion axis and looks for the peaks of the
+resulting spatial profile. The peaks are found with array operations only, in the spirit of scipy.signal.find_peaks,
+which is not available in the scipy version used by the pipeline:
+
+* local maxima are the samples where the profile stops rising, the last sample of a flat top counts as the maximum.
+* the prominence of a maximum is its height over the highest of the two minima found between it and the closest
+  higher maximum at each side (or the end of the profile).
+* the half width of a peak is the distance to the closest sample where the profile stops decreasing, the same window
+  that was grown pixel by pixel before.
+
+All the candidates are then measured at once with goodman_spec.tracing.estimate_centroids, only those whose closed
+form estimate is ambiguous need a Voigt fit.
+
+"""
+import logging
+import numpy as np
+
+import tracing
+
+log = logging.getLogger('redspec.detection')
+
+# minimum prominence in units of the noise of the profile
+DEFAULT_PROMINENCE_SIGMAS = 5.
+# minimum half width of a spectrum in pixels
+DEFAULT_MIN_HALF_WIDTH = 5
+# spectra closer than this to the ends of the profile are ignored
+DEFAULT_MARGIN = 100
+
+
+def get_noise(profile):
+    """Robust standard deviation of the noise of a smooth profile
+
+    Uses the median absolute deviation of the differences between consecutive samples, which is not sensitive to
+    the slow changes of the profile.
+
+    Args:
+        profile (array): 1D profile.
+
+    Returns:
+        noise (float): Estimated standard deviation.
+
+    """
+    diff = np.diff(profile)
+    return 1.4826 * np.median(np.abs(diff - np.median(diff))) / np.sqrt(2.)
+
+
+def find_local_maxima(profile):
+    """Indices of the local maxima of a profile
+
+    Args:
+        profile (array): 1D profile.
+
+    Returns:
+        maxima (array): Indices where the profile rose before and falls after. For a flat top the last index is used.
+
+    """
+    diff = np.diff(profile)
+    index = np.arange(len(diff))
+    # sign of the last non zero step before every sample
+    nonzero = np.where(diff != 0, index, -1)
+    last_nonzero = np.maximum.accumulate(nonzero)
+    last_sign = np.where(last_nonzero >= 0, np.sign(diff[np.maximum(last_nonzero, 0)]), 0)
+    # sample i + 1 is a maximum when it falls after it and the last step before it was rising
+    return np.nonzero((diff[1:] < 0) & (last_sign[:-1] > 0))[0] + 1
+
+
+def get_prominences(profile, maxima):
+    """Prominence of every local maximum
+
+    Args:
+        profile (array): 1D profile.
+        maxima (array): Indices of the local maxima, sorted.
+
+    Returns:
+        prominences (array): Height of every maximum over its highest base.
+
+    """
+    n_samples = len(profile)
+    heights = profile[maxima]
+    # closest higher maximum at each side, the ends of the profile when there is none
+    higher = heights[np.newaxis, :] > heights[:, np.newaxis]
+    before = maxima[np.newaxis, :] < maxima[:, np.newaxis]
+    left_limit = np.max(np.where(higher & before, maxima[np.newaxis, :], 0), axis=1)
+    right_limit = np.min(np.where(higher & ~before & (maxima[np.newaxis, :] != maxima[:, np.newaxis]),
+                                  maxima[np.newaxis, :], n_samples - 1), axis=1)
+    left_base = _interval_minima(profile, left_limit, maxima)
+    right_base = _interval_minima(profile, maxima, right_limit)
+    return heights - np.maximum(left_base, right_base)
+
+
+def _interval_minima(profile, starts, stops):
+    """Minimum of profile[start:stop + 1] for every pair of limits, with start <= stop"""
+    extended = np.append(profile, np.inf)
+    indices = np.column_stack([starts, np.asarray(stops) + 1]).ravel()
+    return np.minimum.reduceat(extended, indices)[::2]
+
+
+def get_half_widths(profile, maxima):
+    """Distance from every maximum to the closest sample where the profile stops decreasing
+
+    Args:
+        profile (array): 1D profile.
+        maxima (array): Indices of the local maxima.
+
+    Returns:
+        half_widths (array): Half width of the window of every maximum.
+
+    """
+    diff = np.diff(profile)
+    # j where profile[j - 1] > profile[j], going left the profile rises again
+    left_turns = np.nonzero(diff < 0)[0] + 1
+    # j where profile[j + 1] > profile[j], going right the profile rises again
+    right_turns = np.nonzero(diff > 0)[0]
+    left = np.searchsorted(left_turns, maxima, side='right') - 1
+    right = np.searchsorted(right_turns, maxima, side='left')
+    left_distance = np.where(left >= 0, maxima - left_turns[np.maximum(left, 0)], maxima)
+    right_distance = np.where(right < len(right_turns),
+                              right_turns[np.minimum(right, len(right_turns) - 1)] - maxima,
+                              len(profile) - 1 - maxima)
+    return np.minimum(left_distance, right_distance)
+
+
+def find_peaks(profile, height, min_prominence=None, min_half_width=DEFAULT_MIN_HALF_WIDTH, margin=DEFAULT_MARGIN):
+    """Spectra candidates in a spatial profile
+
+    Args:
+        profile (array): 1D profile.
+        height (float): Minimum value of a peak.
+        min_prominence (float): Minimum prominence, defaults to DEFAULT_PROMINENCE_SIGMAS times the noise.
+        min_half_width (int): Minimum half width in pixels.
+        margin (int): The window of a peak must be at least this far from the ends of the profile.
+
+    Returns:
+        peaks (array): Index of every peak.
+        half_widths (array): Half width of the window of every peak.
+
+    """
+    profile = np.asarray(profile, dtype=np.float64)
+    if min_prominence is None:
+        min_prominence = DEFAULT_PROMINENCE_SIGMAS * get_noise(profile)
+    maxima = find_local_maxima(profile)
+    maxima = maxima[profile[maxima] > height]
+    if len(maxima) == 0:
+        return maxima, maxima
+    prominences = get_prominences(profile, maxima)
+    half_widths = get_half_widths(profile, maxima)
+    inside = half_widths < np.minimum(maxima, len(profile) - maxima) - margin
+    keep = (prominences >= min_prominence) & (half_widths >= min_half_width) & inside
+    log.debug('%s local maxima above %s, %s peaks kept', len(maxima), height, np.count_nonzero(keep))
+    return maxima[keep], half_widths[keep]
+
+
+def measure_peaks(profile, peaks, half_widths):
+    """Center, amplitude and width of all the peaks at once
+
+    Args:
+        profile (array): 1D profile.
+        peaks (array): Index of every peak.
+        half_widths (array): Half width of the window of every peak.
+
+    Returns:
+        centers (array): Centroid of every peak in pixels, see goodman_spec.tracing.estimate_centroids.
+        amplitudes (array): Height of every peak over the lowest end of its window.
+        fwhms (array): Number of pixels of every window above half of the amplitude.
+        ambiguous (array): Boolean array, True for the peaks that need to be fitted.
+
+    """
+    profile = np.asarray(profile, dtype=np.float64)
+    if len(peaks) == 0:
+        return np.array([]), np.array([]), np.array([]), np.array([], dtype=bool)
+    windows = [profile[peak - half_width:peak + half_width][np.newaxis, :]
+               for peak, half_width in zip(peaks, half_widths)]
+    stacked = tracing.stack_profiles(windows)
+    offsets, ambiguous = tracing.estimate_centroids(stacked)
+    centers = peaks - half_widths + offsets
+    background = np.minimum(stacked[:, 0], np.array([window[0, -1] for window in windows]))
+    amplitudes = profile[peaks] - background
+    fwhms = np.sum(stacked - background[:, np.newaxis] > 0.5 * amplitudes[:, np.newaxis], axis=1)
+    return centers, amplitudes, fwhms, ambiguous
@@ -12,14 +12,938 @@ The current elements present are:
     He: Helium
     CuAr: Copper Argon
 
+The lines of all the elements are kept in a line catalog, a structured array with the wavelength, element and
+relative intensity of every line sorted by wavelength. It is built from this dictionary and the CSV line lists of the
+reference directory, saved as a binary file next to them and memory mapped, once per process, see get_line_catalog.
+Only the main lines of this dictionary are matched to the lines of the lamps. The faint lines of the CSV line lists
+are flagged as not main and only contribute to the synthetic reference spectra, so the wavelength solutions do not
+depend on which line lists are available.
+
 """
+import os
 import logging
+import collections
+import numpy as np
 import pandas
 
 # FORMAT = '%(levelname)s:%(filename)s:%(module)s: 	%(message)s'
 # log.basicConfig(level=log.DEBUG, format=FORMAT)
 log = logging.getLogger('redspec.linelist')
 
+# CSV line lists with all the lines of every element, optional, in the reference directory
+LINE_LIST_FILES = {'cu': 'Cu_3000A-10000A_clean.csv',
+                   'he': 'He_3000A-10000A_clean.csv',
+                   'ne': 'Ne_3000A-10000A_clean.csv',
+                   'ar': 'Ar_3000A-10000A_clean.csv',
+                   'hg': 'Hg_3000A-10000A_clean.csv'}
+
+# binary line catalog built from the line lists, see get_line_catalog
+LINE_CATALOG_FILE_NAME = 'line_catalog.npy'
+LINE_CATALOG_DTYPE = [('wavelength', 'f8'), ('element', 'S2'), ('intensity', 'f4'), ('main', '?')]
+
+# largest difference in Angstrom between a main line and the same line in a CSV line list
+MAIN_LINE_TOLERANCE = 0.5
+
+# line catalog of every reference directory
+_line_catalogs = {}
+
+# number of synthetic spectra kept in memory by every line catalog
+SYNTHETIC_CACHE_SIZE = 32
+
+# main emission lines of the elements used in comparison lamps, used for the elements without a CSV line list
+LINE_LIST = {'hg': [3125.67,
+                    3131.70,
+                    3341.48,
+                    3650.153,
+                    3654.84,
+                    3663.279,
+                    4046.563,
+                    4077.831,
+                    4358.327,
+                    4916.068,
+                    5460.750,
+                    5769.598,
+                    5790.663],
+             'cu': [1999.698,
+                    2035.854,
+                    2037.127,
+                    2043.802,
+                    2135.981,
+                    2165.09,
+                    2178.94,
+                    2179.410,
+                    2181.72,
+                    2189.630,
+                    2192.268,
+                    2199.58,
+                    2210.268,
+                    2214.58,
+                    2218.108,
+                    2225.70,
+                    2227.78,
+                    2230.08,
+                    2242.618,
+                    2244.26,
+                    2247.002,
+                    2263.08,
+                    2293.84,
+                    2392.63,
+                    2406.66,
+                    2441.64,
+                    2492.15,
+                    2618.37,
+                    2689.300,
+                    2700.962,
+                    2703.184,
+                    2713.508,
+                    2718.778,
+                    2766.37,
+                    2769.669,
+                    2877.100,
+                    2961.16,
+                    3036.10,
+                    3063.41,
+                    3108.60,
+                    3194.10,
+                    3243.16,
+                    3247.54,
+                    3273.96,
+                    3290.54,
+                    3307.95,
+                    3337.84,
+                    3530.38,
+                    3686.555,
+                    4062.64,
+                    4651.12,
+                    4909.734,
+                    4931.698,
+                    4953.724,
+                    5051.793,
+                    5105.54,
+                    5153.24,
+                    5218.20,
+                    5292.52,
+                    5700.24,
+                    5782.13,
+                    6000.120,
+                    6150.384,
+                    6154.222,
+                    6216.939,
+                    6219.844,
+                    6273.349,
+                    6301.009,
+                    6377.840,
+                    6423.884,
+                    6448.559,
+                    6470.168,
+                    6481.437,
+                    6624.292,
+                    6641.396,
+                    7404.354,
+                    7652.333,
+                    7664.648,
+                    7778.738,
+                    7805.184,
+                    7807.659,
+                    7825.654,
+                    7902.553,
+                    7933.13,
+                    7988.163,
+                    8092.63,
+                    8283.160,
+                    8511.061,
+                    9861.280,
+                    9864.137,
+                    10054.938],
+             'ne': [5852.488,
+                    5881.895,
+                    5944.834,
+                    5975.534,
+                    6029.997,
+                    6074.337,
+                    6096.163,
+                    6128.450,
+                    6143.062,
+                    6163.594,
+                    6217.281,
+                    6266.495,
+                    6304.789,
+                    6334.428,
+                    6382.991,
+                    6402.246,
+                    6506.528,
+                    6532.882,
+                    6598.953,
+                    6652.092,
+                    6678.276,
+                    6717.043,
+                    6929.467,
+                    7024.050,
+                    7032.413,
+                    7173.938,
+                    7245.166,
+                    7438.898,
+                    7488.871,
+                    7535.774,
+                    7544.044,
+                    7943.180,
+                    8082.457,
+                    8136.406,
+                    8300.324,
+                    8377.606,
+                    8418.426,
+                    8495.359,
+                    8591.258,
+                    8634.647,
+                    8654.384,
+                    8853.867,
+                    8865.756,
+                    8919.499,
+                    8988.58,
+                    9148.68,
+                    9201.76,
+                    9300.85,
+                    9313.98,
+                    9326.52,
+                    9354.218,
+                    9425.38,
+                    9459.21,
+                    9486.680,
+                    9534.167,
+                    9547.40,
+                    9665.424],
+             'he': [3187.745,
+                    3354.55,
+                    3613.643,
+                    3819.6072,
+                    3888.648,
+                    3964.7289,
+                    4009.268,
+                    4120.815,
+                    4168.967,
+                    4437.551,
+                    4471.479,
+                    4713.1455,
+                    4921.931,
+                    5015.6779,
+                    5047.738,
+                    5875.621,
+                    7281.349,
+                    10830.337],
+             'ar': [3093.4019,
+                    3139.0176,
+                    3161.3726,
+                    3169.6685,
+                    3181.0376,
+                    3204.3210,
+                    3243.6887,
+                    3249.8003,
+                    3281.7016,
+                    3307.2283,
+                    3350.9243,
+                    3376.4359,
+                    3388.5309,
+                    3454.0952,
+                    3476.7474,
+                    3478.2324,
+                    3480.5055,
+                    3499.4765,
+                    3509.7785,
+                    3514.3877,
+                    3519.9936,
+                    3521.2601,
+                    3521.9781,
+                    3535.3196,
+                    3548.5144,
+                    3554.3058,
+                    3556.9041,
+                    3559.5081,
+                    3561.0304,
+                    3565.0298,
+                    3567.6564,
+                    3576.6156,
+                    3581.6084,
+                    3582.3546,
+                    3588.4407,
+                    3605.8792,
+                    3606.5218,
+                    3622.1375,
+                    3632.6831,
+                    3637.0310,
+                    3639.8329,
+                    3649.8323,
+                    3650.8896,
+                    3655.2782,
+                    3656.0498,
+                    3659.5289,
+                    3660.437,
+                    3669.6024,
+                    3671.0048,
+                    3673.2645,
+                    3678.2701,
+                    3680.0609,
+                    3682.5448,
+                    3690.8951,
+                    3706.9302,
+                    3709.9088,
+                    3714.7337,
+                    3717.1713,
+                    3718.2065,
+                    3720.4265,
+                    3724.5165,
+                    3729.3087,
+                    3737.889,
+                    3746.4476,
+                    3750.4799,
+                    3753.5177,
+                    3754.0498,
+                    3763.5053,
+                    3765.27,
+                    3766.1186,
+                    3770.52,
+                    3780.8398,
+                    3786.3824,
+                    3796.5934,
+                    3799.382,
+                    3803.1724,
+                    3808.5748,
+                    3809.4561,
+                    3819.0159,
+                    3825.6729,
+                    3826.8072,
+                    3834.6787,
+                    3841.5187,
+                    3844.7311,
+                    3845.4055,
+                    3850.5813,
+                    3856.1382,
+                    3861.747,
+                    3868.5284,
+                    3872.1371,
+                    3875.2645,
+                    3880.3332,
+                    3891.4017,
+                    3891.9792,
+                    3894.66,
+                    3895.2502,
+                    3900.6266,
+                    3911.576,
+                    3914.7675,
+                    3925.7188,
+                    3926.0456,
+                    3928.6233,
+                    3931.2359,
+                    3932.5466,
+                    3944.2717,
+                    3946.0971,
+                    3947.5046,
+                    3948.9789,
+                    3952.7291,
+                    3958.38,
+                    3968.3594,
+                    3974.4766,
+                    3974.759,
+                    3979.3559,
+                    3979.7155,
+                    3988.1576,
+                    3992.0535,
+                    3994.7918,
+                    3999.252,
+                    4001.1379,
+                    4005.3628,
+                    4011.2093,
+                    4013.8566,
+                    4019.8429,
+                    4022.629,
+                    4031.3783,
+                    4033.8093,
+                    4035.46,
+                    4038.8043,
+                    4042.8937,
+                    4044.4179,
+                    4045.6773,
+                    4045.9654,
+                    4047.4815,
+                    4052.9208,
+                    4054.5258,
+                    4062.641,
+                    4063.238,
+                    4070.7835,
+                    4072.0047,
+                    4072.3849,
+                    4076.6284,
+                    4076.9432,
+                    4079.5738,
+                    4082.3872,
+                    4099.4563,
+                    4103.9121,
+                    4112.8153,
+                    4116.3753,
+                    4128.64,
+                    4129.6823,
+                    4131.7235,
+                    4144.2435,
+                    4156.086,
+                    4158.5905,
+                    4164.1795,
+                    4168.9682,
+                    4178.3658,
+                    4179.2973,
+                    4181.8836,
+                    4189.6511,
+                    4190.7129,
+                    4191.0294,
+                    4198.317,
+                    4199.8891,
+                    4200.6745,
+                    4201.5549,
+                    4201.9715,
+                    4203.4109,
+                    4217.4308,
+                    4218.6649,
+                    4222.6373,
+                    4226.6089,
+                    4226.9876,
+                    4228.158,
+                    4229.8696,
+                    4237.2198,
+                    4248.956,
+                    4251.1846,
+                    4255.6034,
+                    4259.3619,
+                    4266.2864,
+                    4266.5271,
+                    4272.1689,
+                    4277.5282,
+                    4282.8976,
+                    4297.9645,
+                    4300.1008,
+                    4300.6495,
+                    4309.2392,
+                    4331.1995,
+                    4332.0297,
+                    4333.5612,
+                    4335.3379,
+                    4337.0708,
+                    4338.2314,
+                    4345.168,
+                    4345.8966,
+                    4348.064,
+                    4352.2049,
+                    4362.0662,
+                    4363.7945,
+                    4367.8316,
+                    4370.7532,
+                    4371.329,
+                    4372.49,
+                    4374.8579,
+                    4375.9542,
+                    4379.6668,
+                    4382.928,
+                    4383.7535,
+                    4385.0566,
+                    4386.9656,
+                    4397.7971,
+                    4400.0968,
+                    4400.9863,
+                    4401.755,
+                    4404.9022,
+                    4406.4704,
+                    4420.9124,
+                    4423.9944,
+                    4426.0011,
+                    4430.189,
+                    4430.9963,
+                    4433.838,
+                    4438.1175,
+                    4439.4614,
+                    4439.8793,
+                    4440.1216,
+                    4445.8483,
+                    4448.4597,
+                    4448.8792,
+                    4449.5206,
+                    4460.5574,
+                    4474.7594,
+                    4480.35,
+                    4481.8107,
+                    4490.9816,
+                    4498.5384,
+                    4502.9268,
+                    4507.8339,
+                    4509.374,
+                    4510.7332,
+                    4522.323,
+                    4530.5523,
+                    4530.785,
+                    4535.4903,
+                    4537.6426,
+                    4543.8692,
+                    4545.0519,
+                    4547.7589,
+                    4561.0128,
+                    4563.7429,
+                    4564.4054,
+                    4579.3495,
+                    4589.8978,
+                    4596.0967,
+                    4598.7627,
+                    4609.5673,
+                    4628.4409,
+                    4637.2328,
+                    4651.124,
+                    4657.9012,
+                    4682.2759,
+                    4702.3161,
+                    4721.5910,
+                    4726.8683,
+                    4732.0532,
+                    4735.9058,
+                    4764.8646,
+                    4806.0205,
+                    4847.8095,
+                    4865.9105,
+                    4876.2611,
+                    4879.8635,
+                    4882.2432,
+                    4888.2612,
+                    4889.0422,
+                    4904.7516,
+                    4914.3146,
+                    4933.2091,
+                    4942.9214,
+                    4965.0795,
+                    4972.1597,
+                    5009.3344,
+                    5017.1628,
+                    5062.0371,
+                    5090.4951,
+                    5118.2023,
+                    5125.7654,
+                    5141.7827,
+                    5145.3083,
+                    5151.3907,
+                    5162.2846,
+                    5165.7728,
+                    5176.2292,
+                    5187.7462,
+                    5216.8139,
+                    5218.2020,
+                    5221.2710,
+                    5254.4648,
+                    5421.3517,
+                    5439.9891,
+                    5442.2427,
+                    5443.6893,
+                    5451.6520,
+                    5457.4157,
+                    5467.1608,
+                    5473.4516,
+                    5490.1194,
+                    5495.8738,
+                    5498.1841,
+                    5506.1128,
+                    5524.9570,
+                    5558.7020,
+                    5572.5413,
+                    5577.6845,
+                    5581.8714,
+                    5588.7200,
+                    5597.4756,
+                    5601.1216,
+                    5606.7330,
+                    5641.3751,
+                    5648.6863,
+                    5650.7043,
+                    5659.1272,
+                    5681.9001,
+                    5691.6612,
+                    5700.8730,
+                    5738.3869,
+                    5739.5196,
+                    5772.1143,
+                    5774.0087,
+                    5783.5360,
+                    5802.0798,
+                    5834.2633,
+                    5860.3103,
+                    5882.6242,
+                    5888.5841,
+                    5912.0853,
+                    5916.5992,
+                    5927.1258,
+                    5928.8130,
+                    5942.6686,
+                    5949.2583,
+                    5971.6008,
+                    5998.9987,
+                    6005.7242,
+                    6013.6777,
+                    6025.1500,
+                    6032.1274,
+                    6043.2233,
+                    6046.8977,
+                    6052.7229,
+                    6059.3725,
+                    6064.7508,
+                    6081.2433,
+                    6085.8797,
+                    6090.7848,
+                    6098.8031,
+                    6101.1615,
+                    6103.5390,
+                    6105.6351,
+                    6113.4657,
+                    6114.9234,
+                    6119.6565,
+                    6123.3619,
+                    6127.4160,
+                    6128.7227,
+                    6145.4411,
+                    6155.2385,
+                    6165.1232,
+                    6170.1740,
+                    6173.0964,
+                    6174.4032,
+                    6212.5031,
+                    6215.9383,
+                    6243.1201,
+                    6296.8722,
+                    6307.6570,
+                    6333.1459,
+                    6357.0229,
+                    6364.8937,
+                    6369.5748,
+                    6384.7169,
+                    6396.6097,
+                    6399.2065,
+                    6403.0128,
+                    6416.3071,
+                    6418.3703,
+                    6431.5550,
+                    6437.6003,
+                    6441.8994,
+                    6443.8598,
+                    6466.5526,
+                    6468.0483,
+                    6472.4294,
+                    6481.1453,
+                    6483.0825,
+                    6493.9694,
+                    6499.1061,
+                    6538.1120,
+                    6604.8534,
+                    6620.9665,
+                    6632.0837,
+                    6638.2207,
+                    6639.7403,
+                    6643.6976,
+                    6656.9386,
+                    6660.6761,
+                    6664.0510,
+                    6666.3588,
+                    6677.2817,
+                    6684.2929,
+                    6719.2184,
+                    6752.8335,
+                    6756.1631,
+                    6766.6117,
+                    6827.2488,
+                    6861.2688,
+                    6863.5350,
+                    6871.2891,
+                    6879.5824,
+                    6888.1742,
+                    6937.6642,
+                    6951.4776,
+                    6965.4307,
+                    7030.2514,
+                    7067.2181,
+                    7147.0416,
+                    7206.9804,
+                    7272.9359,
+                    7311.7159,
+                    7353.2930,
+                    7372.1184,
+                    7383.9805,
+                    7503.8691,
+                    7514.6518,
+                    7635.1060,
+                    7723.7611,
+                    7724.2072,
+                    7948.1764,
+                    8006.1567,
+                    8014.7857,
+                    8103.6931,
+                    8115.311,
+                    8264.5225,
+                    8408.2096,
+                    8424.6475,
+                    8521.4422,
+                    8667.9442,
+                    9122.9674,
+                    9224.4992,
+                    9354.2198,
+                    9657.7863,
+                    9784.5028,
+                    10470.0535]}
+
+
+def get_closest_index(sorted_lines, values):
+    """Index of the closest line to every value
+
+    Args:
+        sorted_lines (array): Line positions sorted in increasing order.
+        values (array): Positions to look up.
+
+    Returns:
+        closest (array): Index in sorted_lines of the closest line to every value. When two lines are equally close
+            the first one is used, as numpy.argmin does.
+
+    """
+    values = np.asarray(values, dtype=float)
+    if len(sorted_lines) < 2:
+        return np.zeros(values.shape, dtype=int)
+    right = np.clip(np.searchsorted(sorted_lines, values), 1, len(sorted_lines) - 1)
+    left = right - 1
+    return np.where(values - sorted_lines[left] <= sorted_lines[right] - values, left, right)
+
+
+def read_line_list_file(path):
+    """Wavelength and relative intensity of the lines in a CSV line list
+
+    The wavelength is taken from the first column whose name refers to it (wave, wl or lambda), or else from the first
+    column. The relative intensity is taken from the first column whose name starts with int or rel, characters that
+    are not part of a number, like the flags of NIST tables, are ignored.
+
+    Args:
+        path (str): Full path of the CSV file.
+
+    Returns:
+        wavelengths (array): Wavelength of every line.
+        intensities (array): Relative intensity of every line, NaN when it is not available.
+
+    """
+    data_frame = pandas.read_csv(path)
+    columns = [str(column) for column in data_frame.columns]
+    wavelength_columns = [column for column in columns
+                          if any([key in column.lower() for key in ['wave', 'wl', 'lambda']])]
+    intensity_columns = [column for column in columns if column.lower().startswith(('int', 'rel'))]
+    wavelength_column = (wavelength_columns + columns)[0]
+    wavelengths = pandas.to_numeric(data_frame[wavelength_column], errors='coerce').values.astype(float)
+    if len(intensity_columns) > 0:
+        intensities = data_frame[intensity_columns[0]].astype(str).str.extract(r'([0-9]+\.?[0-9]*)', expand=False)
+        intensities = pandas.to_numeric(intensities, errors='coerce').values.astype(float)
+    else:
+        intensities = np.nan * np.ones(len(wavelengths))
+    valid = np.isfinite(wavelengths)
+    return wavelengths[valid], intensities[valid]
+
+
+def build_line_catalog(reference_dir):
+    """Builds the line catalog of all the elements
+
+    Every element has its main lines from LINE_LIST. When its CSV line list from LINE_LIST_FILES is in the reference
+    directory the main lines take their intensities from it, and the rest of its lines are added as not main.
+
+    Args:
+        reference_dir (str): Directory of the reference files.
+
+    Returns:
+        catalog (array): Structured array with the fields of LINE_CATALOG_DTYPE sorted by wavelength.
+
+    """
+    parts = []
+    for element in sorted(LINE_LIST.keys()):
+        wavelengths = np.array(LINE_LIST[element], dtype=float)
+        intensities = np.nan * np.ones(len(wavelengths))
+        main = np.ones(len(wavelengths), dtype=bool)
+        path = os.path.join(reference_dir, LINE_LIST_FILES.get(element, ''))
+        if element in LINE_LIST_FILES and os.path.isfile(path):
+            file_wavelengths, file_intensities = read_line_list_file(path)
+            log.debug('Read %s lines of %s from %s', len(file_wavelengths), element, path)
+            order = np.argsort(file_wavelengths)
+            file_wavelengths = file_wavelengths[order]
+            file_intensities = file_intensities[order]
+            if len(file_wavelengths) > 0:
+                closest = get_closest_index(file_wavelengths, wavelengths)
+                found = np.abs(file_wavelengths[closest] - wavelengths) <= MAIN_LINE_TOLERANCE
+                intensities[found] = file_intensities[closest[found]]
+                extra = np.ones(len(file_wavelengths), dtype=bool)
+                extra[closest[found]] = False
+                wavelengths = np.concatenate([wavelengths, file_wavelengths[extra]])
+                intensities = np.concatenate([intensities, file_intensities[extra]])
+                main = np.concatenate([main, np.zeros(np.sum(extra), dtype=bool)])
+        part = np.zeros(len(wavelengths), dtype=LINE_CATALOG_DTYPE)
+        part['wavelength'] = wavelengths
+        part['element'] = element
+        part['intensity'] = intensities
+        part['main'] = main
+        parts.append(part)
+    catalog = np.concatenate(parts)
+    return catalog[np.argsort(catalog['wavelength'], kind='mergesort')]
+
+
+def get_line_catalog(reference_dir):
+    """Line catalog of a reference directory, shared by all the calibrations
+
+    The catalog is built once and written as a binary file (LINE_CATALOG_FILE_NAME) to the reference directory, later
+    runs memory map it. It is built again when a CSV line list or this module are newer than the file. If the directory
+    is not writable the catalog is kept in memory only.
+
+    Args:
+        reference_dir (str): Directory of the reference files.
+
+    Returns:
+        catalog (object): LineCatalog instance.
+
+    """
+    if reference_dir in _line_catalogs:
+        return _line_catalogs[reference_dir]
+    path = os.path.join(reference_dir, LINE_CATALOG_FILE_NAME)
+    sources = [os.path.abspath(__file__)] + [os.path.join(reference_dir, file_name)
+                                             for file_name in LINE_LIST_FILES.values()]
+    newest_source = max([os.path.getmtime(source) for source in sources if os.path.isfile(source)])
+    lines = None
+    if os.path.isfile(path) and os.path.getmtime(path) >= newest_source:
+        try:
+            lines = np.load(path, mmap_mode='r')
+        except (IOError, ValueError) as error:
+            log.warning('Ignoring unreadable line catalog %s: %s', path, error)
+    if lines is None:
+        lines = build_line_catalog(reference_dir)
+        try:
+            temporary_path = path + '.tmp'
+            with open(temporary_path, 'wb') as catalog_file:
+                np.save(catalog_file, lines)
+            os.rename(temporary_path, path)
+            lines = np.load(path, mmap_mode='r')
+        except (IOError, OSError) as error:
+            log.debug('Line catalog kept in memory: %s', error)
+    _line_catalogs[reference_dir] = LineCatalog(lines)
+    return _line_catalogs[reference_dir]
+
+
+class LineCatalog(object):
+    """Reference lines of all the elements
+
+    Attributes:
+        lines (array): Structured array with the fields of LINE_CATALOG_DTYPE sorted by wavelength, usually memory
+            mapped.
+
+    """
+
+    def __init__(self, lines):
+        """Creates the catalog
+
+        Args:
+            lines (array): Structured array with the fields of LINE_CATALOG_DTYPE sorted by wavelength.
+
+        """
+        self.lines = lines
+        self._lamp_lines = {}
+        self._synthetic_spectra = collections.OrderedDict()
+
+    def get_lamp_lines(self, lamp_name, main_only=True):
+        """Lines of the elements of a lamp
+
+        The name is split in chunks of two characters, one per element. The result is cached by lamp, it is read-only
+        since it is shared by all the callers.
+
+        Args:
+            lamp_name (str): Lamp's name as in the header keyword OBJECT.
+            main_only (bool): Only the main lines, those matched to the lines of the lamps.
+
+        Returns:
+            lamp_lines (array): Structured array of the lines of the lamp, sorted by wavelength.
+
+        """
+        lamp_key = (lamp_name.lower(), main_only)
+        if lamp_key not in self._lamp_lines:
+            elements = [lamp_key[0][i:i + 2] for i in range(0, len(lamp_key[0]), 2)]
+            for element in elements:
+                if element not in LINE_LIST:
+                    log.error('There are no reference lines for element %s of lamp %s', element, lamp_name)
+            selected = np.in1d(self.lines['element'], np.array(elements, dtype='S2'))
+            if main_only:
+                selected &= self.lines['main']
+            lamp_lines = np.array(self.lines[selected])
+            lamp_lines.flags.writeable = False
+            self._lamp_lines[lamp_key] = lamp_lines
+        return self._lamp_lines[lamp_key]
+
+    def get_wavelengths(self, lamp_name):
+        """Sorted wavelengths of the main lines of a lamp, see get_lamp_lines"""
+        return self.get_lamp_lines(lamp_name)['wavelength']
+
+    def get_lines_in_range(self, blue, red, lamp_name, main_only=True):
+        """Lines of a lamp within a wavelength range
+
+        Args:
+            blue (float): Blue limit.
+            red (float): Red limit.
+            lamp_name (str): Lamp's name as in the header keyword OBJECT.
+            main_only (bool): Only the main lines, see get_lamp_lines.
+
+        Returns:
+            lamp_lines (array): Structured array of the lines of the lamp between blue and red, both included.
+
+        """
+        lamp_lines = self.get_lamp_lines(lamp_name, main_only)
+        first = np.searchsorted(lamp_lines['wavelength'], blue, side='left')
+        last = np.searchsorted(lamp_lines['wavelength'], red, side='right')
+        return lamp_lines[first:last]
+
+    def get_synthetic_spectrum(self, lamp_name, blue, red, sampling=1., fwhm=2.):
+        """Synthetic spectrum of a lamp from its reference lines
+
+        Every line of the lamp, including those that are not main, is placed on a linear wavelength grid with its
+        relative intensity, or one when the intensity is not known, and the result is convolved with a gaussian of the
+        resolution of the instrument. Lines up to five sigma outside of the range contribute to its ends. The last
+        SYNTHETIC_CACHE_SIZE spectra are kept, the least recently used is discarded first.
+
+        Args:
+            lamp_name (str): Lamp's name as in the header keyword OBJECT, any combination of elements.
+            blue (float): First wavelength of the grid.
+            red (float): Last wavelength of the grid, included if it falls on the grid.
+            sampling (float): Angstrom between samples.
+            fwhm (float): Resolution of the instrument, FWHM in Angstrom.
+
+        Returns:
+            wavelength (array): Wavelength grid.
+            intensity (array): Synthetic spectrum, read-only.
+
+        """
+        key = (lamp_name.lower(), round(blue, 3), round(red, 3), round(sampling, 6), round(fwhm, 4))
+        if key in self._synthetic_spectra:
+            spectrum = self._synthetic_spectra.pop(key)
+            self._synthetic_spectra[key] = spectrum
+            return spectrum
+
+        sigma = fwhm / 2.3548
+        pad = int(np.ceil(5 * sigma / sampling))
+        n_samples = int(np.floor((red - blue) / sampling + 1e-9)) + 1
+        lamp_lines = self.get_lines_in_range(blue - pad * sampling, red + pad * sampling, lamp_name, main_only=False)
+        intensities = np.where(np.isfinite(lamp_lines['intensity']) & (lamp_lines['intensity'] > 0),
+                               lamp_lines['intensity'],
+                               1.)
+        # every line is split between the two closest samples of the padded grid
+        position = (lamp_lines['wavelength'] - blue) / sampling + pad
+        lower = np.clip(np.floor(position).astype(int), 0, n_samples + 2 * pad - 2)
+        fraction = position - lower
+        deposit = np.bincount(lower, intensities * (1 - fraction), minlength=n_samples + 2 * pad)
+        deposit += np.bincount(lower + 1, intensities * fraction, minlength=n_samples + 2 * pad)
+        kernel = np.exp(-0.5 * (np.arange(-pad, pad + 1) * sampling / sigma) ** 2)
+        intensity = np.convolve(deposit, kernel, mode='same')[pad:pad + n_samples]
+        wavelength = blue + sampling * np.arange(n_samples)
+        wavelength.flags.writeable = False
+        intensity.flags.writeable = False
+
+        self._synthetic_spectra[key] = (wavelength, intensity)
+        while len(self._synthetic_spectra) > SYNTHETIC_CACHE_SIZE:
+            self._synthetic_spectra.popitem(last=False)
+        return wavelength, intensity
+
 
 class ReferenceData(object):
     """Contains spectroscopic reference lines values and filename to templates.
@@ -27,7 +951,7 @@ class ReferenceData(object):
     This class stores:
         - file names for reference fits spectrum
         - file names for CSV tables with reference lines and relative intensities
-        - line positions only for the elements used in SOAR comparison lamps
+        - the line catalog of the reference directory, shared by all the instances
     """
     def __init__(self, args):
         """Initializes the class ReferenceData
@@ -36,652 +960,13 @@ class ReferenceData(object):
             args(class): All the arguments parsed to the parent program
         """
         self.args = args
+        self.line_list = LINE_LIST
+        self.line_catalog = get_line_catalog(args.reference_dir)
         # self.reference_files_path = os.path.expanduser('~/') + './refdata/'
         self.lamps_file_list = {'cuhear': 'goodman_comp_600_BLUE_CuHeAr.fits',
                                 'hgar': 'hgar_reference_soar.fits',
                                 'hgarne': 'goodman_comp_400_M2_GG455_HgArNe.fits'}
-        self.line_list_files = {'cu': 'Cu_3000A-10000A_clean.csv',
-                                'he': 'He_3000A-10000A_clean.csv',
-                                'ne': 'Ne_3000A-10000A_clean.csv',
-                                'ar': 'Ar_3000A-10000A_clean.csv',
-                                'hg': 'Hg_3000A-10000A_clean.csv'}
-
-        self.line_list = {'hg': [3125.67,
-                                 3131.70,
-                                 3341.48,
-                                 3650.153,
-                                 3654.84,
-                                 3663.279,
-                                 4046.563,
-                                 4077.831,
-                                 4358.327,
-                                 4916.068,
-                                 5460.750,
-                                 5769.598,
-                                 5790.663],
-                          'cu': [1999.698,
-                                 2035.854,
-                                 2037.127,
-                                 2043.802,
-                                 2135.981,
-                                 2165.09,
-                                 2178.94,
-                                 2179.410,
-                                 2181.72,
-                                 2189.630,
-                                 2192.268,
-                                 2199.58,
-                                 2210.268,
-                                 2214.58,
-                                 2218.108,
-                                 2225.70,
-                                 2227.78,
-                                 2230.08,
-                                 2242.618,
-                                 2244.26,
-                                 2247.002,
-                                 2263.08,
-                                 2293.84,
-                                 2392.63,
-                                 2406.66,
-                                 2441.64,
-                                 2492.15,
-                                 2618.37,
-                                 2689.300,
-                                 2700.962,
-                                 2703.184,
-                                 2713.508,
-                                 2718.778,
-                                 2766.37,
-                                 2769.669,
-                                 2877.100,
-                                 2961.16,
-                                 3036.10,
-                                 3063.41,
-                                 3108.60,
-                                 3194.10,
-                                 3243.16,
-                                 3247.54,
-                                 3273.96,
-                                 3290.54,
-                                 3307.95,
-                                 3337.84,
-                                 3530.38,
-                                 3686.555,
-                                 4062.64,
-                                 4651.12,
-                                 4909.734,
-                                 4931.698,
-                                 4953.724,
-                                 5051.793,
-                                 5105.54,
-                                 5153.24,
-                                 5218.20,
-                                 5292.52,
-                                 5700.24,
-                                 5782.13,
-                                 6000.120,
-                                 6150.384,
-                                 6154.222,
-                                 6216.939,
-                                 6219.844,
-                                 6273.349,
-                                 6301.009,
-                                 6377.840,
-                                 6423.884,
-                                 6448.559,
-                                 6470.168,
-                                 6481.437,
-                                 6624.292,
-                                 6641.396,
-                                 7404.354,
-                                 7652.333,
-                                 7664.648,
-                                 7778.738,
-                                 7805.184,
-                                 7807.659,
-                                 7825.654,
-                                 7902.553,
-                                 7933.13,
-                                 7988.163,
-                                 8092.63,
-                                 8283.160,
-                                 8511.061,
-                                 9861.280,
-                                 9864.137,
-                                 10054.938],
-                          'ne': [5852.488,
-                                 5881.895,
-                                 5944.834,
-                                 5975.534,
-                                 6029.997,
-                                 6074.337,
-                                 6096.163,
-                                 6128.450,
-                                 6143.062,
-                                 6163.594,
-                                 6217.281,
-                                 6266.495,
-                                 6304.789,
-                                 6334.428,
-                                 6382.991,
-                                 6402.246,
-                                 6506.528,
-                                 6532.882,
-                                 6598.953,
-                                 6652.092,
-                                 6678.276,
-                                 6717.043,
-                                 6929.467,
-                                 7024.050,
-                                 7032.413,
-                                 7173.938,
-                                 7245.166,
-                                 7438.898,
-                                 7488.871,
-                                 7535.774,
-                                 7544.044,
-                                 7943.180,
-                                 8082.457,
-                                 8136.406,
-                                 8300.324,
-                                 8377.606,
-                                 8418.426,
-                                 8495.359,
-                                 8591.258,
-                                 8634.647,
-                                 8654.384,
-                                 8853.867,
-                                 8865.756,
-                                 8919.499,
-                                 8988.58,
-                                 9148.68,
-                                 9201.76,
-                                 9300.85,
-                                 9313.98,
-                                 9326.52,
-                                 9354.218,
-                                 9425.38,
-                                 9459.21,
-                                 9486.680,
-                                 9534.167,
-                                 9547.40,
-                                 9665.424],
-                          'he': [3187.745,
-                                 3354.55,
-                                 3613.643,
-                                 3819.6072,
-                                 3888.648,
-                                 3964.7289,
-                                 4009.268,
-                                 4120.815,
-                                 4168.967,
-                                 4437.551,
-                                 4471.479,
-                                 4713.1455,
-                                 4921.931,
-                                 5015.6779,
-                                 5047.738,
-                                 5875.621,
-                                 7281.349,
-                                 10830.337],
-                          'ar': [3093.4019,
-                                 3139.0176,
-                                 3161.3726,
-                                 3169.6685,
-                                 3181.0376,
-                                 3204.3210,
-                                 3243.6887,
-                                 3249.8003,
-                                 3281.7016,
-                                 3307.2283,
-                                 3350.9243,
-                                 3376.4359,
-                                 3388.5309,
-                                 3454.0952,
-                                 3476.7474,
-                                 3478.2324,
-                                 3480.5055,
-                                 3499.4765,
-                                 3509.7785,
-                                 3514.3877,
-                                 3519.9936,
-                                 3521.2601,
-                                 3521.9781,
-                                 3535.3196,
-                                 3548.5144,
-                                 3554.3058,
-                                 3556.9041,
-                                 3559.5081,
-                                 3561.0304,
-                                 3565.0298,
-                                 3567.6564,
-                                 3576.6156,
-                                 3581.6084,
-                                 3582.3546,
-                                 3588.4407,
-                                 3605.8792,
-                                 3606.5218,
-                                 3622.1375,
-                                 3632.6831,
-                                 3637.0310,
-                                 3639.8329,
-                                 3649.8323,
-                                 3650.8896,
-                                 3655.2782,
-                                 3656.0498,
-                                 3659.5289,
-                                 3660.437,
-                                 3669.6024,
-                                 3671.0048,
-                                 3673.2645,
-                                 3678.2701,
-                                 3680.0609,
-                                 3682.5448,
-                                 3690.8951,
-                                 3706.9302,
-                                 3709.9088,
-                                 3714.7337,
-                                 3717.1713,
-                                 3718.2065,
-                                 3720.4265,
-                                 3724.5165,
-                                 3729.3087,
-                                 3737.889,
-                                 3746.4476,
-                                 3750.4799,
-                                 3753.5177,
-                                 3754.0498,
-                                 3763.5053,
-                                 3765.27,
-                                 3766.1186,
-                                 3770.52,
-                                 3780.8398,
-                                 3786.3824,
-                                 3796.5934,
-                                 3799.382,
-                                 3803.1724,
-                                 3808.5748,
-                                 3809.4561,
-                                 3819.0159,
-                                 3825.6729,
-                                 3826.8072,
-                                 3834.6787,
-                                 3841.5187,
-                                 3844.7311,
-                                 3845.4055,
-                                 3850.5813,
-                                 3856.1382,
-                                 3861.747,
-                                 3868.5284,
-                                 3872.1371,
-                                 3875.2645,
-                                 3880.3332,
-                                 3891.4017,
-                                 3891.9792,
-                                 3894.66,
-                                 3895.2502,
-                                 3900.6266,
-                                 3911.576,
-                                 3914.7675,
-                                 3925.7188,
-                                 3926.0456,
-                                 3928.6233,
-                                 3931.2359,
-                                 3932.5466,
-                                 3944.2717,
-                                 3946.0971,
-                                 3947.5046,
-                                 3948.9789,
-                                 3952.7291,
-                                 3958.38,
-                                 3968.3594,
-                                 3974.4766,
-                                 3974.759,
-                                 3979.3559,
-                                 3979.7155,
-                                 3988.1576,
-                                 3992.0535,
-                                 3994.7918,
-                                 3999.252,
-                                 4001.1379,
-                                 4005.3628,
-                                 4011.2093,
-                                 4013.8566,
-                                 4019.8429,
-                                 4022.629,
-                                 4031.3783,
-                                 4033.8093,
-                                 4035.46,
-                                 4038.8043,
-                                 4042.8937,
-                                 4044.4179,
-                                 4045.6773,
-                                 4045.9654,
-                                 4047.4815,
-                                 4052.9208,
-                                 4054.5258,
-                                 4062.641,
-                                 4063.238,
-                                 4070.7835,
-                                 4072.0047,
-                                 4072.3849,
-                                 4076.6284,
-                                 4076.9432,
-                                 4079.5738,
-                                 4082.3872,
-                                 4099.4563,
-                                 4103.9121,
-                                 4112.8153,
-                                 4116.3753,
-                                 4128.64,
-                                 4129.6823,
-                                 4131.7235,
-                                 4144.2435,
-                                 4156.086,
-                                 4158.5905,
-                                 4164.1795,
-                                 4168.9682,
-                                 4178.3658,
-                                 4179.2973,
-                                 4181.8836,
-                                 4189.6511,
-                                 4190.7129,
-                                 4191.0294,
-                                 4198.317,
-                                 4199.8891,
-                                 4200.6745,
-                                 4201.5549,
-                                 4201.9715,
-                                 4203.4109,
-                                 4217.4308,
-                                 4218.6649,
-                                 4222.6373,
-                                 4226.6089,
-                                 4226.9876,
-                                 4228.158,
-                                 4229.8696,
-                                 4237.2198,
-                                 4248.956,
-                                 4251.1846,
-                                 4255.6034,
-                                 4259.3619,
-                                 4266.2864,
-                                 4266.5271,
-                                 4272.1689,
-                                 4277.5282,
-                                 4282.8976,
-                                 4297.9645,
-                                 4300.1008,
-                                 4300.6495,
-                                 4309.2392,
-                                 4331.1995,
-                                 4332.0297,
-                                 4333.5612,
-                                 4335.3379,
-                                 4337.0708,
-                                 4338.2314,
-                                 4345.168,
-                                 4345.8966,
-                                 4348.064,
-                                 4352.2049,
-                                 4362.0662,
-                                 4363.7945,
-                                 4367.8316,
-                                 4370.7532,
-                                 4371.329,
-                                 4372.49,
-                                 4374.8579,
-                                 4375.9542,
-                                 4379.6668,
-                                 4382.928,
-                                 4383.7535,
-                                 4385.0566,
-                                 4386.9656,
-                                 4397.7971,
-                                 4400.0968,
-                                 4400.9863,
-                                 4401.755,
-                                 4404.9022,
-                                 4406.4704,
-                                 4420.9124,
-                                 4423.9944,
-                                 4426.0011,
-                                 4430.189,
-                                 4430.9963,
-                                 4433.838,
-                                 4438.1175,
-                                 4439.4614,
-                                 4439.8793,
-                                 4440.1216,
-                                 4445.8483,
-                                 4448.4597,
-                                 4448.8792,
-                                 4449.5206,
-                                 4460.5574,
-                                 4474.7594,
-                                 4480.35,
-                                 4481.8107,
-                                 4490.9816,
-                                 4498.5384,
-                                 4502.9268,
-                                 4507.8339,
-                                 4509.374,
-                                 4510.7332,
-                                 4522.323,
-                                 4530.5523,
-                                 4530.785,
-                                 4535.4903,
-                                 4537.6426,
-                                 4543.8692,
-                                 4545.0519,
-                                 4547.7589,
-                                 4561.0128,
-                                 4563.7429,
-                                 4564.4054,
-                                 4579.3495,
-                                 4589.8978,
-                                 4596.0967,
-                                 4598.7627,
-                                 4609.5673,
-                                 4628.4409,
-                                 4637.2328,
-                                 4651.124,
-                                 4657.9012,
-                                 4682.2759,
-                                 4702.3161,
-                                 4721.5910,
-                                 4726.8683,
-                                 4732.0532,
-                                 4735.9058,
-                                 4764.8646,
-                                 4806.0205,
-                                 4847.8095,
-                                 4865.9105,
-                                 4876.2611,
-                                 4879.8635,
-                                 4882.2432,
-                                 4888.2612,
-                                 4889.0422,
-                                 4904.7516,
-                                 4914.3146,
-                                 4933.2091,
-                                 4942.9214,
-                                 4965.0795,
-                                 4972.1597,
-                                 5009.3344,
-                                 5017.1628,
-                                 5062.0371,
-                                 5090.4951,
-                                 5118.2023,
-                                 5125.7654,
-                                 5141.7827,
-                                 5145.3083,
-                                 5151.3907,
-                                 5162.2846,
-                                 5165.7728,
-                                 5176.2292,
-                                 5187.7462,
-                                 5216.8139,
-                                 5218.2020,
-                                 5221.2710,
-                                 5254.4648,
-                                 5421.3517,
-                                 5439.9891,
-                                 5442.2427,
-                                 5443.6893,
-                                 5451.6520,
-                                 5457.4157,
-                                 5467.1608,
-                                 5473.4516,
-                                 5490.1194,
-                                 5495.8738,
-                                 5498.1841,
-                                 5506.1128,
-                                 5524.9570,
-                                 5558.7020,
-                                 5572.5413,
-                                 5577.6845,
-                                 5581.8714,
-                                 5588.7200,
-                                 5597.4756,
-                                 5601.1216,
-                                 5606.7330,
-                                 5641.3751,
-                                 5648.6863,
-                                 5650.7043,
-                                 5659.1272,
-                                 5681.9001,
-                                 5691.6612,
-                                 5700.8730,
-                                 5738.3869,
-                                 5739.5196,
-                                 5772.1143,
-                                 5774.0087,
-                                 5783.5360,
-                                 5802.0798,
-                                 5834.2633,
-                                 5860.3103,
-                                 5882.6242,
-                                 5888.5841,
-                                 5912.0853,
-                                 5916.5992,
-                                 5927.1258,
-                                 5928.8130,
-                                 5942.6686,
-                                 5949.2583,
-                                 5971.6008,
-                                 5998.9987,
-                                 6005.7242,
-                                 6013.6777,
-                                 6025.1500,
-                                 6032.1274,
-                                 6043.2233,
-                                 6046.8977,
-                                 6052.7229,
-                                 6059.3725,
-                                 6064.7508,
-                                 6081.2433,
-                                 6085.8797,
-                                 6090.7848,
-                                 6098.8031,
-                                 6101.1615,
-                                 6103.5390,
-                                 6105.6351,
-                                 6113.4657,
-                                 6114.9234,
-                                 6119.6565,
-                                 6123.3619,
-                                 6127.4160,
-                                 6128.7227,
-                                 6145.4411,
-                                 6155.2385,
-                                 6165.1232,
-                                 6170.1740,
-                                 6173.0964,
-                                 6174.4032,
-                                 6212.5031,
-                                 6215.9383,
-                                 6243.1201,
-                                 6296.8722,
-                                 6307.6570,
-                                 6333.1459,
-                                 6357.0229,
-                                 6364.8937,
-                                 6369.5748,
-                                 6384.7169,
-                                 6396.6097,
-                                 6399.2065,
-                                 6403.0128,
-                                 6416.3071,
-                                 6418.3703,
-                                 6431.5550,
-                                 6437.6003,
-                                 6441.8994,
-                                 6443.8598,
-                                 6466.5526,
-                                 6468.0483,
-                                 6472.4294,
-                                 6481.1453,
-                                 6483.0825,
-                                 6493.9694,
-                                 6499.1061,
-                                 6538.1120,
-                                 6604.8534,
-                                 6620.9665,
-                                 6632.0837,
-                                 6638.2207,
-                                 6639.7403,
-                                 6643.6976,
-                                 6656.9386,
-                                 6660.6761,
-                                 6664.0510,
-                                 6666.3588,
-                                 6677.2817,
-                                 6684.2929,
-                                 6719.2184,
-                                 6752.8335,
-                                 6756.1631,
-                                 6766.6117,
-                                 6827.2488,
-                                 6861.2688,
-                                 6863.5350,
-                                 6871.2891,
-                                 6879.5824,
-                                 6888.1742,
-                                 6937.6642,
-                                 6951.4776,
-                                 6965.4307,
-                                 7030.2514,
-                                 7067.2181,
-                                 7147.0416,
-                                 7206.9804,
-                                 7272.9359,
-                                 7311.7159,
-                                 7353.2930,
-                                 7372.1184,
-                                 7383.9805,
-                                 7503.8691,
-                                 7514.6518,
-                                 7635.1060,
-                                 7723.7611,
-                                 7724.2072,
-                                 7948.1764,
-                                 8006.1567,
-                                 8014.7857,
-                                 8103.6931,
-                                 8115.311,
-                                 8264.5225,
-                                 8408.2096,
-                                 8424.6475,
-                                 8521.4422,
-                                 8667.9442,
-                                 9122.9674,
-                                 9224.4992,
-                                 9354.2198,
-                                 9657.7863,
-                                 9784.5028,
-                                 10470.0535]}
+        self.line_list_files = LINE_LIST_FILES
 
     def get_line_list_by_name(self, lamp_name):
         """Get the reference lines for elements in the lamp's name
@@ -695,11 +980,33 @@ class ReferenceData(object):
         Returns:
             line_list(list): Sorted line list
         """
-        elements = [lamp_name[i:i + 2].lower() for i in range(0, len(lamp_name), 2)]
-        line_list = []
-        for element in elements:
-            line_list.extend(self.line_list[element])
-        return sorted(line_list)
+        return self.get_line_array(lamp_name).tolist()
+
+    def get_line_array(self, lamp_name):
+        """Get the reference lines for elements in the lamp's name as a sorted array
+
+        Same lines as get_line_list_by_name, from the line catalog shared by all the instances. The array is read-only.
+
+        Args:
+            lamp_name(str): Lamp's name as in the header keyword OBJECT
+
+        Returns:
+            line_array(array): Sorted line positions
+        """
+        return self.line_catalog.get_wavelengths(lamp_name)
+
+    def get_closest_lines(self, lamp_name, wavelengths):
+        """Get the closest reference line to every wavelength
+
+        Args:
+            lamp_name(str): Lamp's name as in the header keyword OBJECT
+            wavelengths(array): Wavelength of the lines to match
+
+        Returns:
+            closest_lines(array): Closest reference line to every wavelength
+        """
+        line_array = self.get_line_array(lamp_name)
+        return line_array[get_closest_index(line_array, wavelengths)]
 
     def get_lines_in_range(self, blue, red, lamp_name):
         """Get the reference lines for a given comparison lamp in a wavelength range
@@ -715,15 +1022,9 @@ class ReferenceData(object):
         Returns:
             lines(list): Sorted line list
         """
-        lines = []
         if len(lamp_name) % 2 == 0:
-            for element_index in range(0, len(lamp_name), 2):
-                element = lamp_name[element_index:element_index + 2]
-                all_lines = self.line_list[element]
-                for line in all_lines:
-                    if blue <= line <= red:
-                        lines.append(line)
-        return sorted(lines)
+            return self.line_catalog.get_lines_in_range(blue, red, lamp_name)['wavelength'].tolist()
+        return []
 
     def get_reference_lamps_by_name(self, lamp_name):
         """Get lamp's template by element
@@ -744,18 +1045,25 @@ class ReferenceData(object):
             log.error('Reference lamp %s does not exist', lamp_name)
             return None
 
-    def get_ref_spectrum_from_linelist(self, blue, red, name):
-        """Experimental not working at the moment
+    def get_ref_spectrum_from_linelist(self, blue, red, name, sampling=1., fwhm=2.):
+        """Builds a unidimensional spectrum to be used as a template for finding a wavelength solution
+
+        Works for any combination of elements and range, including the configurations that have no reference lamp.
+        The spectra are cached by the line catalog, see LineCatalog.get_synthetic_spectrum.
 
-        Builds a unidimensional spectrum to be used as a template for finding an automatic wavelength solution
+        Args:
+            blue(float): Blue limit of the spectrum, e.g. from WavelengthCalibration.get_spectral_characteristics
+            red(float): Red limit of the spectrum
+            name(str): Lamp's name as in the header keyword OBJECT
+            sampling(float): Angstrom between samples
+            fwhm(float): Resolution of the instrument, FWHM of the lines in Angstrom
+
+        Returns:
+            reference_spectrum(list): Wavelength and intensity arrays, None if the lamp's name is not valid
         """
         if len(name) % 2 == 0:
-            elements = [name[i:i + 2].lower() for i in range(0, len(name), 2)]
-            for element in elements:
-                linelist_file = self.line_list_files[element]
-                pandas_data_frame = pandas.read_csv(self.args.reference_dir + linelist_file)
-                print(linelist_file, pandas_data_frame, blue, red)
-
+            wavelength, intensity = self.line_catalog.get_synthetic_spectrum(name, blue, red, sampling, fwhm)
+            return [wavelength, intensity]
         else:
             log.error('Error in the calibration lamp name: %s', name)
             return None
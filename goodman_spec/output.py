@@ -0,0 +1,184 @@
+"""Output of all the calibrated spectra of a science frame in a single file
+
+WavelengthCalibration.add_wavelength_solution writes every target and every lamp to its own file, which is still the
+default ('single' output mode). FrameWriter collects the apertures of a science frame instead and writes them with a
+single call:
+
+* 'mef': a multi-extension FITS. The primary HDU has the header of the frame and no data, then every aperture N has the
+  extensions SCI, VAR and BKG with EXTVER N, the calibrated spectrum, its variance and the background subtracted from
+  it, and one LAMP extension per comparison lamp (LAMP1, LAMP2... if there are several).
+* 'stacked': a single array in the primary HDU with one row per aperture, as IRAF multispec files. The APNUMn keyword
+  describes row n. When there is more than the spectra the array is three dimensional, with the bands described by
+  the BANDIDn keywords: spectrum, variance, background and every lamp.
+
+"""
+import logging
+import numpy as np
+from astropy.io import fits
+
+import wsbuilder
+
+log = logging.getLogger('redspec.output')
+
+OUTPUT_MODES = ['single', 'mef', 'stacked']
+
+# keywords of the wavelength solution, together with the WAT keywords
+WCS_KEYWORDS = ['WCSDIM', 'CTYPE1', 'CRVAL1', 'CRPIX1', 'CDELT1', 'CD1_1', 'LTM1_1', 'CTYPE2', 'CD2_2', 'LTM2_2',
+                'DC-FLAG', 'DCLOG1']
+
+
+def get_wcs_header(header):
+    """Header with the wavelength solution of another header only
+
+    Args:
+        header (object): Header of a calibrated spectrum.
+
+    Returns:
+        wcs_header (object): New header with the WCS, WAT and APNUM keywords.
+
+    """
+    wcs_header = fits.Header()
+    for card in header.cards:
+        if card.keyword in WCS_KEYWORDS or card.keyword.startswith('WAT') or card.keyword.startswith('APNUM'):
+            wcs_header.append(card)
+    return wcs_header
+
+
+class FrameWriter(object):
+    """Collects the calibrated spectra of a science frame and writes them in one file
+
+    Attributes:
+        file_name (str): Full path of the output file.
+        mode (str): 'mef' or 'stacked'.
+        wsolution (object): Wavelength solution shared by all the apertures, needed by 'stacked' when the spectra were
+            not resampled.
+        apertures (list): One dictionary per aperture with the keys 'header', 'data', 'variance', 'background' and
+            'lamps', a list of (header, data) pairs.
+
+    """
+
+    def __init__(self, file_name, mode='mef', wsolution=None):
+        """Creates an empty frame
+
+        Args:
+            file_name (str): Full path of the output file.
+            mode (str): 'mef' or 'stacked'.
+            wsolution (object): Wavelength solution shared by all the apertures.
+
+        """
+        self.file_name = file_name
+        self.mode = mode
+        self.wsolution = wsolution
+        self.apertures = []
+
+    def add_aperture(self, header, data, variance=None, background=None, lamps=None):
+        """Adds the spectra of an aperture
+
+        Args:
+            header (object): Header of the calibrated spectrum, with its wavelength solution and APNUM1.
+            data (array): Calibrated spectrum.
+            variance (array): Variance of the spectrum.
+            background (array): Background subtracted from the spectrum.
+            lamps (list): (header, data) of every comparison lamp extracted with the aperture.
+
+        """
+        self.apertures.append({'header': header,
+                               'data': np.asarray(data),
+                               'variance': variance,
+                               'background': background,
+                               'lamps': lamps or []})
+
+    def write(self):
+        """Writes all the apertures to the output file
+
+        Returns:
+            file_name (str): The output file, None if there was nothing to write.
+
+        """
+        if len(self.apertures) == 0:
+            log.warning('There are no spectra to write to %s', self.file_name)
+            return None
+        if self.mode == 'stacked':
+            hdu_list = fits.HDUList([self.get_stacked_hdu()])
+        else:
+            hdu_list = self.get_extensions()
+        hdu_list.writeto(self.file_name, clobber=True)
+        log.info('Created new file: %s with %s apertures', self.file_name, len(self.apertures))
+        return self.file_name
+
+    def get_extensions(self):
+        """Multi-extension FITS with the extensions SCI, VAR, BKG and LAMP of every aperture
+
+        Returns:
+            hdu_list (object): astropy.io.fits.HDUList
+
+        """
+        primary_header = self.apertures[0]['header'].copy()
+        for keyword in get_wcs_header(primary_header).keys():
+            if keyword in primary_header:
+                del primary_header[keyword]
+        hdu_list = fits.HDUList([fits.PrimaryHDU(header=primary_header)])
+        for number, aperture in enumerate(self.apertures, 1):
+            # the same solution describes the variance and the background, the header is built once per aperture
+            wcs_header = get_wcs_header(aperture['header'])
+            extensions = [('SCI', aperture['header'], aperture['data']),
+                          ('VAR', wcs_header, aperture['variance']),
+                          ('BKG', wcs_header, aperture['background'])]
+            for lamp_number, (lamp_header, lamp_data) in enumerate(aperture['lamps'], 1):
+                name = 'LAMP' if len(aperture['lamps']) == 1 else 'LAMP%s' % lamp_number
+                extensions.append((name, lamp_header, lamp_data))
+            for name, header, data in extensions:
+                if data is None:
+                    continue
+                hdu = fits.ImageHDU(data=np.asarray(data), header=header.copy())
+                hdu.header['EXTNAME'] = name
+                hdu.header['EXTVER'] = number
+                hdu_list.append(hdu)
+        hdu_list[0].header['NEXTEND'] = len(hdu_list) - 1
+        return hdu_list
+
+    def get_stacked_hdu(self):
+        """Primary HDU with one row per aperture and one band per kind of spectrum
+
+        Returns:
+            hdu (object): astropy.io.fits.PrimaryHDU
+
+        """
+        bands = [('spectrum - background subtracted', [aperture['data'] for aperture in self.apertures])]
+        for key, band_id in [('variance', 'variance'), ('background', 'background')]:
+            if all([aperture[key] is not None for aperture in self.apertures]):
+                bands.append((band_id, [aperture[key] for aperture in self.apertures]))
+        n_lamps = min([len(aperture['lamps']) for aperture in self.apertures])
+        for lamp_index in range(n_lamps):
+            lamp_name = self.apertures[0]['lamps'][lamp_index][0].get('OBJECT', '')
+            bands.append(('lamp %s' % lamp_name, [aperture['lamps'][lamp_index][1] for aperture in self.apertures]))
+
+        data = np.array([np.vstack(rows) for band_id, rows in bands])
+        if len(bands) == 1:
+            data = data[0]
+        header = self.apertures[0]['header'].copy()
+        for keyword in [keyword for keyword in header.keys() if keyword.startswith('BANDID')]:
+            del header[keyword]
+        for number, (band_id, rows) in enumerate(bands, 1):
+            header['BANDID%s' % number] = band_id
+        for number, aperture in enumerate(self.apertures, 1):
+            header['APNUM%s' % number] = aperture['header'].get('APNUM1', '%s 1' % number)
+
+        if header.get('CTYPE1') == 'MULTISPE':
+            # every aperture has its own description, all with the same solution
+            header = wsbuilder.add_multispec_solution(header,
+                                                      self.wsolution,
+                                                      data.shape[-1],
+                                                      aperture=list(range(1, len(self.apertures) + 1)))
+        else:
+            header['CTYPE2'] = 'LINEAR'
+            header['CD2_2'] = 1.
+            header['LTM2_2'] = 1.
+            header['WAT2_001'] = 'wtype=linear'
+        header['WCSDIM'] = data.ndim
+        if data.ndim == 3:
+            header['CTYPE3'] = 'LINEAR'
+            header['CD3_3'] = 1.
+            header['LTM3_3'] = 1.
+            header['WAT3_001'] = 'wtype=linear'
+        return fits.PrimaryHDU(data=data, header=header)
@@ -5,16 +5,20 @@ This module performs intermediate steps in the process to obtain a wavelength ca
 the __call__ method returns a list contained uni-dimensional data extracted and the modified instance of ScienceObject
 """
 from astropy.io import fits
-import matplotlib.pyplot as plt
 import numpy as np
 from astropy.modeling import models, fitting
 import logging
 
+import detection
+import tracing
 
 # FORMAT = '%(levelname)s:%(filename)s:%(module)s: %(message)s'
 # log.basicConfig(level=log.INFO, format=FORMAT)
 log = logging.getLogger('redspec.process')
 
+# FWHM of a gaussian in units of its standard deviation
+GAUSSIAN_FWHM = 2.3548
+
 
 class Process(object):
     """Set of tools for extracting Goodman High Throughput Spectrograph data.
@@ -92,8 +96,9 @@ class Process(object):
         """Identify spectra in 2D (image) data
 
         This method takes a sample of the image and averages it in the dispersion direction, then analyze the spatial
-        direction in search for peaks and count them as candidates to targets. In order to validate the target it will
-        do a Voigt profile fit and if the new center deviates too much from the original location it will be discarded.
+        direction in search for peaks and count them as candidates to targets, see goodman_spec.detection. The center
+        of all the candidates is measured at once and a Voigt profile is fitted only to those whose profile is
+        ambiguous. If the center deviates too much from the original location the candidate will be discarded.
 
         Returns:
             identified_targets (list): Each element being and IdentifiedTarget instance
@@ -113,82 +118,95 @@ class Process(object):
         sample_std = np.std(sample)
 
         # search for spectra
-        all_found = []
-        rising = False
-        falling = False
-        trend_length = 0
-        for i in range(len(sample) - 1):
-            if sample[i] > max(1.1 * sample_median, sample_std):
-                if sample[i] > sample[i + 1]:
-                    if rising and trend_length > 4:
-                        all_found.append(i)
-                        plt.axvline(i, color='r')
-                        trend_length = 0
-                    rising = False
-                    falling = True
-                    trend_length += 1
-                else:
-                    if falling and trend_length > 4:
-                        plt.axvline(i, color='g')
-                        trend_length = 0
-                        pass
-                    rising = True
-                    falling = False
-                    trend_length += 1
+        peaks, half_widths = detection.find_peaks(sample, height=max(1.1 * sample_median, sample_std))
+        centers, amplitudes, fwhms, ambiguous = detection.measure_peaks(sample, peaks, half_widths)
 
         # validate targets
         identified_targets = []
-        for spectrum in all_found:
-            # print spectrum
-            for i in range(0, min(spectrum, abs(y_size - spectrum)) - 100):
-                # print spectrum - i, spectrum + i, y_size - spectrum, x_size
-                if sample[spectrum - i] < sample[(spectrum - i) - 1] or sample[spectrum + i] < sample[(spectrum + i) + 1]:
-                    # plt.plot([x for x in range(spectrum - i, spectrum + i)], sample[spectrum - i:spectrum + i], color='g')
-                    sample_width = abs(2 * i)
-
-                    try:
-                        sub_sample_x_axis = [x for x in range(spectrum - i, spectrum + i)]
-                        sub_sample = sample[spectrum - i:spectrum + i]
-                        # centroid = np.sum(sub_sample_x_axis * sub_sample) / np.sum(sub_sample)
-                        # old procedure
-                        voigt_init = models.Voigt1D(x_0=spectrum, amplitude_L=sample[spectrum], fwhm_L=8, fwhm_G=8)
-                        fit_voigt = fitting.LevMarLSQFitter()
-                        voigt = fit_voigt(voigt_init, sub_sample_x_axis, sub_sample)
-                        # print(voigt)
-                        if abs(voigt.x_0.value - spectrum) < 5:
-                            identified_targets.append(IdentifiedTarget(
-                                amplitude=voigt.amplitude_L.value,
-                                mean=voigt.x_0.value,
-                                stddev=voigt.fwhm_L.value,
-                                fwhmg=voigt.fwhm_G.value,
-                                raw_width=sample_width,
-                                sample_loc=sample_loc))
-                            # fitted_model = voigt
-                            if self.args.plots_enabled:
-                                plt.axvspan(spectrum - i, spectrum + i, color='r', alpha=0.3, label='Spectrum width')
-                                plt.plot(sub_sample_x_axis, voigt(sub_sample_x_axis), label='Voigt Fit')
-                                # plt.axvline(centroid, color='k')
-                                plt.axvline(voigt.x_0.value, color='m', label='Voigt x_0')
-                                plt.axvline(spectrum, color='c', label='Spectrum location')
-                        else:
-                            log.info('Spectrum found at pixel %s is discarded', spectrum)
-                    except TypeError:
-                        pass
-                    break
+        voigt_fits = []
+        for index in range(len(peaks)):
+            spectrum = peaks[index]
+            sample_width = int(2 * half_widths[index])
+            # a clean peak is taken as a gaussian of the measured width
+            target = IdentifiedTarget(amplitude=amplitudes[index],
+                                      mean=centers[index],
+                                      stddev=fwhms[index] / GAUSSIAN_FWHM,
+                                      fwhmg=fwhms[index],
+                                      raw_width=sample_width,
+                                      sample_loc=sample_loc)
+            if ambiguous[index]:
+                # old procedure, only for the profiles that are not a single clean peak
+                try:
+                    sub_sample_x_axis = [x for x in range(spectrum - half_widths[index], spectrum + half_widths[index])]
+                    sub_sample = sample[spectrum - half_widths[index]:spectrum + half_widths[index]]
+                    voigt_init = models.Voigt1D(x_0=spectrum, amplitude_L=sample[spectrum], fwhm_L=8, fwhm_G=8)
+                    fit_voigt = fitting.LevMarLSQFitter()
+                    voigt = fit_voigt(voigt_init, sub_sample_x_axis, sub_sample)
+                except TypeError:
+                    continue
+                target = IdentifiedTarget(amplitude=voigt.amplitude_L.value,
+                                          mean=voigt.x_0.value,
+                                          stddev=self.get_voigt_fwhm(voigt.fwhm_L.value,
+                                                                     voigt.fwhm_G.value) / GAUSSIAN_FWHM,
+                                          fwhmg=voigt.fwhm_G.value,
+                                          raw_width=sample_width,
+                                          sample_loc=sample_loc)
+                voigt_fits.append([sub_sample_x_axis, voigt])
+            if abs(target.mean - spectrum) < 5:
+                identified_targets.append(target)
+            else:
+                log.info('Spectrum found at pixel %s is discarded', spectrum)
 
         if self.args.plots_enabled:
-            plt.title(self.science_object.name)
-            plt.axhline(sample_median, color='m', label='Median')
-            plt.axhline(1.1 * sample_median, color='c', label='110% Median')
-            plt.plot(sample, label='Data')
-            plt.xlabel('Pixel (Spatial Direction)')
-            plt.ylabel('Intensity')
-            plt.legend(loc='best')
-            plt.show()
-        # for target in identified_targets:
-            # print target
+            self.plot_identified_spectra(sample, sample_median, peaks, half_widths, identified_targets, voigt_fits)
         return identified_targets
 
+    @staticmethod
+    def get_voigt_fwhm(fwhm_l, fwhm_g):
+        """FWHM of a Voigt profile from the FWHM of its components
+
+        Uses the approximation of Olivero & Longbothum (1977), accurate to 0.02%.
+
+        Args:
+            fwhm_l (float): FWHM of the Lorentzian component.
+            fwhm_g (float): FWHM of the gaussian component.
+
+        Returns:
+            fwhm (float): FWHM of the profile, same units as the components.
+
+        """
+        fwhm_l = abs(fwhm_l)
+        return 0.5346 * fwhm_l + np.sqrt(0.2166 * fwhm_l ** 2 + fwhm_g ** 2)
+
+    def plot_identified_spectra(self, sample, sample_median, peaks, half_widths, identified_targets, voigt_fits):
+        """Plots the spatial profile used by identify_spectra and the spectra found in it
+
+        Args:
+            sample (array): Spatial profile.
+            sample_median (float): Median of the profile.
+            peaks (array): Location of the candidates.
+            half_widths (array): Half width of the window of every candidate.
+            identified_targets (list): IdentifiedTarget instances that were accepted.
+            voigt_fits (list): Pairs of x axis and Voigt1D for the candidates that were fitted.
+
+        """
+        import matplotlib.pyplot as plt
+        for spectrum, half_width in zip(peaks, half_widths):
+            plt.axvspan(spectrum - half_width, spectrum + half_width, color='r', alpha=0.3, label='Spectrum width')
+            plt.axvline(spectrum, color='c', label='Spectrum location')
+        for sub_sample_x_axis, voigt in voigt_fits:
+            plt.plot(sub_sample_x_axis, voigt(sub_sample_x_axis), label='Voigt Fit')
+        for target in identified_targets:
+            plt.axvline(target.mean, color='m', label='Target mean')
+        plt.title(self.science_object.name)
+        plt.axhline(sample_median, color='m', label='Median')
+        plt.axhline(1.1 * sample_median, color='c', label='110% Median')
+        plt.plot(sample, label='Data')
+        plt.xlabel('Pixel (Spatial Direction)')
+        plt.ylabel('Intensity')
+        plt.legend(loc='best')
+        plt.show()
+
     def trace(self, targets):
         """Finds the trace of a spectrum given an initial location
 
@@ -197,9 +215,10 @@ class Process(object):
         It takes about fifty sub-samples along the dispersion direction with a width of fifty pixels each.
         All the parameters can be changed with the variables half_n_sigma, ends_pix_spacing, n_samples and
         sample_width variables. The sub-samples are flattened along the dispersion direction using numpy.median and
-        the location of the maximum value is recorded. Alternatively is possible to do a gaussian fit but my tests
-        suggest is not much what you earn with this now is disabled by default. Enable it by changing do_gaussian_fit to
-        True. Once there is a list of maximum locations a Chebyshev 1D of second order is fitted to define the trace.
+        the location of the peak is recorded. The peaks of all the sub-samples of all the targets are estimated at once
+        in closed form and only the ambiguous ones are refined with a Voigt fit, see goodman_spec.tracing. Fitting every
+        sub-sample can be enabled by changing do_voigt_fit to True. Once there is a list of maximum locations a
+        Chebyshev 1D of second order is fitted to define the trace.
         The Chebyshev function is defined for all the range of pixels in the dispersion direction of the image.
         This method also mask the regions that will be extracted as science target (or spectrum) and the regions
         that will be used for background subtractions. At first two regions are defined for each science target
@@ -209,10 +228,6 @@ class Process(object):
         If both subtraction regions are valid they will be averaged and then subtracted.
         If no background region are valid, no background subtraction will happen.
 
-        Note:
-            It is not worth doing gaussian fits to the sub samples since it will not improve the result. The only case
-            this might be useful is the case when someone does an interpolation along the spatial direction.
-
         Args:
             targets (list): Each element is a class that stores the parameters of the gaussian fitted to the data in
                         previous steps. This data tells the location in the image of the target or targets.
@@ -223,10 +238,8 @@ class Process(object):
 
         """
 
-        # True enables gaussian fits and false disables it. Gaussian fit was left for experimental purposes
-        do_gaussian_fit = False
-        # Voigt fits better
-        do_voigt_fit = True
+        # True fits a Voigt profile to every sub-sample, otherwise only the ambiguous ones are fitted
+        do_voigt_fit = False
         # half of number of sigmas to be sub_sampled
         half_n_sigma = 5
         # space allowance in pixels for extreme of images
@@ -241,12 +254,29 @@ class Process(object):
         traces = []
         regions = []
 
+        # sub-samples of all the targets are collapsed first and their centroids are computed at once
+        limit_list = []
+        profile_list = []
         for target in targets:
             # target.print_all()
             # x_min = int(target.mean - half_n_sigma * target.stddev)
             x_min = int(target.mean - target.raw_width / 2.)
             # x_max = int(target.mean + half_n_sigma * target.stddev)
             x_max = int(target.mean + target.raw_width / 2.)
+            sample_data = self.data[x_min:x_max, :]
+            sample_y = sample_data.shape[1]
+            sample_starts = np.linspace(0, sample_y - ends_pix_spacing, n_samples, dtype=int)
+            limit_list.append([x_min, x_max, sample_y, sample_starts])
+            profile_list.append(tracing.get_profiles(sample_data, sample_starts, sample_width))
+
+        if do_voigt_fit:
+            centroid_list = [np.array([tracing.fit_voigt_centroid(profile) for profile in profiles])
+                             for profiles in profile_list]
+        else:
+            centroid_list, _ = tracing.get_centroids(profile_list)
+
+        for target_index in range(len(targets)):
+            x_min, x_max, sample_y, sample_starts = limit_list[target_index]
             width = x_max - x_min
             background_offset = 1.5 * width
             # target value in mask is -1, for background 0 for non-masked is 1
@@ -254,49 +284,8 @@ class Process(object):
 
             regions.append([x_min, x_max, width])
 
-            sample_data = self.data[x_min:x_max, :]
-            sample_y = sample_data.shape[1]
-
-            max_positions = []
-            max_index = []
-            for index_y in np.linspace(0, sample_y - ends_pix_spacing, n_samples, dtype=int):
-
-                sub_sample = sample_data[:, index_y:index_y + n_samples]
-
-                sub_median = np.median(sub_sample, axis=1)
-
-                # print sub_median
-                sub_x_axis = range(len(sub_median))
-
-                sub_argmax = np.argmax(sub_median)
-                sub_max = np.max(sub_median)
-
-                if do_gaussian_fit:
-                    # Will leave this here just in case someone wants to experiment
-                    # A Voigt profile is better for this case
-                    gauss_init = models.Gaussian1D(amplitude=sub_max, mean=sub_argmax, stddev=1.)
-                    fit_gaussian = fitting.LevMarLSQFitter()
-                    gauss = fit_gaussian(gauss_init, sub_x_axis, sub_median)
-                    max_positions.append(gauss.mean.value + x_min)
-                    max_index.append(index_y + int(sample_width / 2.))
-                elif do_voigt_fit:
-                    voigt_init = models.Voigt1D(x_0=sub_argmax, amplitude_L=sub_max, fwhm_L=8, fwhm_G=8)
-                    fit_voigt = fitting.LevMarLSQFitter()
-                    voigt = fit_voigt(voigt_init, sub_x_axis, sub_median)
-                    max_positions.append(voigt.x_0.value + x_min)
-                    max_index.append(index_y + int(sample_width / 2.))
-                    if False:
-                        plt.plot(sub_x_axis, sub_median, color='r', label='Data')
-                        plt.plot(sub_x_axis, voigt(sub_x_axis), color='g', label='Voigt Fit')
-                        plt.title(self.science_object.name)
-                        plt.xlabel('Pixel (spatial direction)')
-                        plt.ylabel('Intensity')
-                        plt.legend(loc='best')
-                        plt.show()
-
-                else:
-                    max_positions.append(sub_argmax + x_min)
-                    max_index.append(index_y + int(sample_width / 2.))
+            max_positions = list(centroid_list[target_index] + x_min)
+            max_index = list(sample_starts + int(sample_width / 2.))
 
             # chebyshev fitting for defining the trace
             if np.std(max_positions) < width:
@@ -320,6 +309,7 @@ class Process(object):
                 self.science_object.update_no_targets(add_one=True)
 
                 if self.args.plots_enabled:
+                    import matplotlib.pyplot as plt
                     fig1 = plt.figure(1)
                     fig1.canvas.set_window_title('Trace')
                     plt.title(self.science_object.name)
@@ -476,55 +466,49 @@ class Process(object):
 
                 # Getting data shape
                 data_y = self.data.shape[1]
-                sci = []
-
-                unsubtracted = []
-                subtracted_background = []
 
                 # Actual extraction
-                # Avoid printing inside this loop since it goes through all the columns
-                for i in range(data_y):
-                    # Define limits of aperture for spectrum
-                    x_min = int(round(chebyshev(i))) - half_width
-                    x_max = int(round(chebyshev(i))) + half_width
-                    apnum1 = '%s %s %s %s'%(trace_index + 1, 1, x_min, x_max)
-                    if i == int(data_y/2):
-                        hist = 'Aperture for extraction [%s:%s] at %s' % (x_min, x_max, i)
-                        history_headers.append(hist)
-                        log.debug(hist)
-                        log.debug('APNUM1 = %s', apnum1)
-
-                    # If there are background extraction zones here are prepared to subtract
-                    if len(background) > 1:
-                        background_part = []
-                        for back in background:
-                            part = np.sum(self.data[back[0]:back[1], i])
-                            # background_median = np.median(self.data[back[0]:back[1], i])
-                            # part2 = abs(x_max - x_min) * background_median
-                            background_part.append(part)
-                        background_data = np.mean(background_part)
-                    elif len(background) == 1:
-                        background_data = np.sum(self.data[background[0][0]:background[0][1], i])
-                    else:
-                        background_data = 0
-
-                    # Stored for debugging process
-                    # print background_data
-                    subtracted_background.append(background_data)
-                    unsubtracted.append(np.sum(self.data[x_min:x_max, i]))
-
-                    data_point = np.sum(self.data[x_min:x_max, i]) - background_data
-                    # print('DATA POINT ', np.sum(self.data[x_min:x_max, i]), background_data)
-                    sci.append(data_point)
-
-                    # Lamp extraction
-                    if len(self.lamps_data) > 0:
-                        for limit_index in range(self.science_object.lamp_count):
-                            lamp_point = np.sum(self.lamps_data[limit_index][x_min:x_max, i])
-                            all_lamps[limit_index] = np.append(all_lamps[limit_index], lamp_point)
+                # The trace is evaluated once for all the columns and every aperture is summed in a single pass
+                columns = np.arange(data_y)
+                center = self.round_half_away(chebyshev(columns))
+                x_min = center - half_width
+                x_max = center + half_width
+                apnum1 = '%s %s %s %s' % (trace_index + 1, 1, x_min[-1], x_max[-1])
+                middle = int(data_y / 2)
+                hist = 'Aperture for extraction [%s:%s] at %s' % (x_min[middle], x_max[middle], middle)
+                history_headers.append(hist)
+                log.debug(hist)
+                log.debug('APNUM1 = %s', apnum1)
+
+                # If there are background extraction zones here are prepared to subtract
+                if len(background) > 1:
+                    background_part = [self.sum_apertures(self.data,
+                                                          np.full(data_y, back[0], dtype=int),
+                                                          np.full(data_y, back[1], dtype=int))
+                                       for back in background]
+                    subtracted_background = np.mean(np.column_stack(background_part), axis=1)
+                elif len(background) == 1:
+                    subtracted_background = self.sum_apertures(self.data,
+                                                               np.full(data_y, background[0][0], dtype=int),
+                                                               np.full(data_y, background[0][1], dtype=int))
+                else:
+                    subtracted_background = 0
+
+                unsubtracted = self.sum_apertures(self.data, x_min, x_max)
+                sci = unsubtracted - subtracted_background
+                variance = self.get_variance(unsubtracted, x_max - x_min, subtracted_background, width, len(background))
+
+                # Lamp extraction
+                if len(self.lamps_data) > 0:
+                    for limit_index in range(self.science_object.lamp_count):
+                        all_lamps[limit_index] = self.sum_apertures(self.lamps_data[limit_index],
+                                                                    x_min,
+                                                                    x_max).astype(np.float64)
                 # Construction of extracted_object (to be returned)
                 # extracted_object.append(np.array(sci))
                 sci_pack.add_data(np.array(sci))
+                sci_pack.add_variance(variance)
+                sci_pack.add_background(subtracted_background * np.ones(data_y))
                 # if int(trace_index + 1) > 1:
                 #     new_header.rename_keyword('APNUM1', 'APNUM%s' % str(int(trace_index + 1)))
                 new_header['APNUM1'] = apnum1
@@ -543,6 +527,7 @@ class Process(object):
                 #
                 # Plot background subtraction
                 if self.args.plots_enabled:
+                    import matplotlib.pyplot as plt
                     # sci_sample = sci[int(len(sci) / 2.) - 30:int(len(sci) / 2.) + 30]
                     fig = plt.figure(1)
                     fig.canvas.set_window_title('Subtraction')
@@ -553,7 +538,7 @@ class Process(object):
                     # plt.yscale('log')
                     plt.plot(sci, color='k', alpha=1, label='Background Subtracted')
                     plt.plot(unsubtracted, color='k', alpha=0.5, label='Unsubtracted')
-                    plt.plot(subtracted_background, color='r', label='Background')
+                    plt.plot(subtracted_background * np.ones(len(sci)), color='r', label='Background')
                     # plt.plot(all_lamps[0],label='lamp 1')
                     # plt.plot(all_lamps[1],label='lamp 2')
                     plt.legend(loc='best')
@@ -570,6 +555,80 @@ class Process(object):
             log.error("There are no traces discovered here!!.")
             return None
 
+    def get_variance(self, unsubtracted, n_pixels, background, background_width, n_background):
+        """Variance of an extracted spectrum from the CCD equation
+
+        Uses the keywords GAIN (e-/ADU) and RDNOISE (e-) of the header, one and zero if they are missing.
+
+        Args:
+            unsubtracted (array): Sum of the aperture in every column, ADU.
+            n_pixels (array): Number of pixels summed in every column.
+            background (array): Background subtracted, the mean of n_background sums of background_width pixels.
+            background_width (int): Pixels of every background zone.
+            n_background (int): Number of background zones, zero if there was no background subtraction.
+
+        Returns:
+            variance (array): Variance of the background subtracted spectrum, ADU squared.
+
+        """
+        gain = float(self.header.get('GAIN', 1.))
+        read_noise = float(self.header.get('RDNOISE', 0.))
+        variance = np.abs(unsubtracted) / gain + n_pixels * (read_noise / gain) ** 2
+        if n_background > 0:
+            variance = variance + (np.abs(background) / gain +
+                                   background_width * (read_noise / gain) ** 2) / n_background
+        return np.asarray(variance, dtype=np.float64)
+
+    @staticmethod
+    def round_half_away(values):
+        """Rounds to the nearest integer, halves away from zero
+
+        Vectorized equivalent of int(round(value)) in Python 2, numpy.round rounds halves to the nearest even
+        integer instead.
+
+        Args:
+            values (array): Values to be rounded.
+
+        Returns:
+            rounded (array): Integer array.
+
+        """
+        values = np.asarray(values, dtype=np.float64)
+        magnitude = np.floor(np.abs(values) + 0.5)
+        # floor(x + 0.5) is one too large when x + 0.5 rounds up, e.g. 0.49999999999999994
+        magnitude[magnitude - 0.5 > np.abs(values)] -= 1
+        return (np.sign(values) * magnitude).astype(int)
+
+    @staticmethod
+    def sum_apertures(data, x_min, x_max):
+        """Sums data[x_min[i]:x_max[i], i] for every column i
+
+        The apertures of all the columns are gathered in a contiguous array of shape (columns, width) and summed along
+        the second axis, which gives exactly the same values as summing every slice separately. Columns whose
+        aperture is not completely inside the image are summed one by one with the original slice, that way negative
+        indices and truncated apertures keep their meaning.
+
+        Args:
+            data (array): 2D image, spatial direction in the first axis.
+            x_min (array): First row of the aperture for every column.
+            x_max (array): End of the aperture (excluded) for every column.
+
+        Returns:
+            sums (array): Sum of the aperture of every column.
+
+        """
+        n_rows, n_columns = data.shape
+        columns = np.arange(n_columns)
+        width = x_max - x_min
+        inside = (x_min >= 0) & (x_max <= n_rows) & (width == width[0]) & (width > 0)
+        if np.all(~inside):
+            return np.array([np.sum(data[x_min[i]:x_max[i], i]) for i in columns])
+        rows = np.where(inside, x_min, 0)[:, np.newaxis] + np.arange(width[inside][0])[np.newaxis, :]
+        sums = data[np.minimum(rows, n_rows - 1), columns[:, np.newaxis]].sum(axis=1)
+        for i in columns[~inside]:
+            sums[i] = np.sum(data[x_min[i]:x_max[i], i])
+        return sums
+
     @staticmethod
     def add_wcs_keys(header):
         """Adds generic keyword to the header
@@ -616,9 +675,11 @@ class IdentifiedTarget(object):
 
         Args:
             amplitude (float): Peak value of the target's sample
-            mean (float): Voigt fit center
-            stddev (float): Full width at half maximum of Lorentzian component
-            fwhmg (float): Full width at half maximum of Gaussian component
+            mean (float): Voigt fit center, or measured center of a clean peak
+            stddev (float): Standard deviation in pixels of the gaussian with the FWHM of the profile, the total FWHM
+                of the Voigt fit or the measured width of a clean peak
+            fwhmg (float): Full width at half maximum in pixels of Gaussian component, or measured width of a clean
+                peak
             raw_width (int): Width of the sample in dispersion axis.
             sample_loc (int): Location of the sample in the dispersion direction.
         """
@@ -665,12 +726,16 @@ class SciencePack(object):
             self.headers (list): Stores science target headers
             self.lamps_data (list): Stores comparison lamps data
             self.lamps_headers (list): Stores comparison lamps headers.
+            self.variance (list): Stores the variance of every science target
+            self.background (list): Stores the background subtracted from every science target
 
         """
         self.data = []
         self.headers = []
         self.lamps_data = []
         self.lamps_headers = []
+        self.variance = []
+        self.background = []
 
     def add_data(self, new_data):
         """Appends science data"""
@@ -680,6 +745,14 @@ class SciencePack(object):
         """Appends science header"""
         self.headers.append(new_header)
 
+    def add_variance(self, new_variance):
+        """Appends the variance of a science target"""
+        self.variance.append(new_variance)
+
+    def add_background(self, new_background):
+        """Appends the background of a science target"""
+        self.background.append(new_background)
+
     def add_lamp(self, new_lamp):
         """Appends comparison lamp data"""
         self.lamps_data.append(new_lamp)
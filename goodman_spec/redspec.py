@@ -20,6 +20,10 @@ import argparse
 import logging
 # from astropy import log
 import warnings
+from goodman_ccd.header_index import HeaderIndex
+from goodman_ccd.parallel import map_frames_logged
+from goodman_ccd.watcher import DirectoryWatcher
+import solution_store
 from process import Process, SciencePack
 from wavelength import WavelengthCalibration
 
@@ -46,15 +50,22 @@ class MainApp(object):
     def __init__(self):
         """Initalization of important parameters
 
-        Initializes the list of images using ccdproc.ImageFileCollection and pandas the get the arguments that define
+        Initializes the list of images using goodman_ccd's HeaderIndex and pandas the get the arguments that define
         the working of the pipeline using arpargse and instantiate a Night class, an object that will store relevant
         information of the observed night being processed.
 
         """
         self.image_collection = pd.DataFrame
         self.args = self.get_args()
+        # created before the night is set, so the files that arrive while it is processed are not taken as existing
+        self.watcher = None
+        if self.args.telescope:
+            self.watcher = DirectoryWatcher(self.args.source,
+                                            patterns=[self.args.pattern + '*.fits'],
+                                            interval=self.args.poll_interval)
         self.night = self.set_night()
         self.extracted_data = None
+        self.pending_targets = []
         self.wsolution = None
         self.calibration_lamp = None
         self.wavelength_solution_obj = None
@@ -71,57 +82,99 @@ class MainApp(object):
         # TODO (simon): Add the possibility of managing multi wavelength solutions for different capabilities
         self.organize_full_night()
         # print(len(self.night.sci_targets))
-        for i in range(len(self.night.sci_targets)):
-            science_object = self.night.sci_targets[i]
-            # print(science_object)
-            # print(self.night.sci_targets)
-            process = Process(science_object, self.args)
-            if self.args.procmode == 0:
-                if self.wavelength_solution_obj is None:
-                    self.extracted_data, self.night.sci_targets[i] = process()
-                    if isinstance(self.extracted_data, SciencePack):
-                        wavelength_calibration = WavelengthCalibration(self.extracted_data,
-                                                                       self.night.sci_targets[i],
-                                                                       self.args)
+        target_indexes = list(range(len(self.night.sci_targets)))
+        if self.args.procmode == 0 and self.args.jobs != 1 and not self.args.plots_enabled:
+            # targets are processed one by one until there is a wavelength solution, the rest only apply it
+            while len(target_indexes) > 0 and self.wavelength_solution_obj is None:
+                self.process_target(target_indexes.pop(0))
+            self.process_targets_parallel(target_indexes)
+        else:
+            for i in target_indexes:
+                self.process_target(i)
 
-                        self.wavelength_solution_obj = wavelength_calibration()
+        # Keep processing the data that arrives while observing
+        if self.args.telescope:
+            self.run_telescope_mode()
 
-                        # self.night.set_night_wsolution(process.get_wsolution())
-                        # self.night.set_night_calibration_lamp(process.get_calibration_lamp())
-                    else:
-                        log.error('No data was extracted from this target.')
-                else:
-                    if self.wavelength_solution_obj.check_compatibility(process.header):
-                        log.debug(self.night.night_wsolution)
-                        self.extracted_data, self.night.sci_targets[i] = process(extract_lamps=True)
-                        if isinstance(self.extracted_data, SciencePack):
-                            wavelength_calibration = WavelengthCalibration(self.extracted_data,
-                                                                           self.night.sci_targets[i],
-                                                                           self.args)
-
-                            wavelength_calibration(self.wavelength_solution_obj)
-                        else:
-                            log.error('No data was extracted from this target.')
-                    else:
-                        log.debug('Incompatibility of solution to new data')
-                        time.sleep(3)
-                        # TODO(simon): complete this part
-            elif self.args.procmode == 1:
+    def process_target(self, i):
+        """Extracts and wavelength calibrates one science target of the night
+
+        Args:
+            i (int): Index of the target in self.night.sci_targets
+
+        Raises:
+            NotImplementedError: For observing modes 2 and 3
+
+        """
+        science_object = self.night.sci_targets[i]
+        # print(science_object)
+        # print(self.night.sci_targets)
+        process = Process(science_object, self.args)
+        if self.args.procmode == 0:
+            if self.wavelength_solution_obj is None:
                 self.extracted_data, self.night.sci_targets[i] = process()
-                if self.extracted_data is not None:
+                if isinstance(self.extracted_data, SciencePack):
                     wavelength_calibration = WavelengthCalibration(self.extracted_data,
                                                                    self.night.sci_targets[i],
                                                                    self.args)
 
                     self.wavelength_solution_obj = wavelength_calibration()
+
+                    # self.night.set_night_wsolution(process.get_wsolution())
+                    # self.night.set_night_calibration_lamp(process.get_calibration_lamp())
                 else:
                     log.error('No data was extracted from this target.')
-            elif self.args.procmode == 2:
-                raise NotImplementedError
-            elif self.args.procmode == 3:
-                raise NotImplementedError
-            # else:
-                # process = Process(self.night.source, science_object, self.args, self.night.night_wsolution)
+            else:
+                if self.wavelength_solution_obj.check_compatibility(process.header):
+                    log.debug(self.night.night_wsolution)
+                    self.extracted_data, self.night.sci_targets[i] = process(extract_lamps=True)
+                    if isinstance(self.extracted_data, SciencePack):
+                        wavelength_calibration = WavelengthCalibration(self.extracted_data,
+                                                                       self.night.sci_targets[i],
+                                                                       self.args)
+
+                        wavelength_calibration(self.wavelength_solution_obj)
+                    else:
+                        log.error('No data was extracted from this target.')
+                else:
+                    log.debug('Incompatibility of solution to new data')
+                    time.sleep(3)
+                    # TODO(simon): complete this part
+        elif self.args.procmode == 1:
+            self.extracted_data, self.night.sci_targets[i] = process()
+            if self.extracted_data is not None:
+                wavelength_calibration = WavelengthCalibration(self.extracted_data,
+                                                               self.night.sci_targets[i],
+                                                               self.args)
+
+                self.wavelength_solution_obj = wavelength_calibration()
+            else:
+                log.error('No data was extracted from this target.')
+        elif self.args.procmode == 2:
+            raise NotImplementedError
+        elif self.args.procmode == 3:
+            raise NotImplementedError
+        # else:
+            # process = Process(self.night.source, science_object, self.args, self.night.night_wsolution)
+
+    def process_targets_parallel(self, target_indexes):
+        """Extracts several targets at once and applies the wavelength solution of the night to them
+
+        The targets are independent once the wavelength solution exists. The log of every target is emitted in order
+        and the output files are the same as the ones of process_target called for each target.
+
+        Args:
+            target_indexes (list): Indexes of the targets in self.night.sci_targets
+
+        """
+        results = map_frames_logged(self._process_target_worker, target_indexes, jobs=self.args.jobs)
+        for i, result in zip(target_indexes, results):
+            self.night.sci_targets[i], self.extracted_data = result
+
+    def _process_target_worker(self, i):
+        """Runs process_target in a worker and returns the updated target and its extracted data"""
+        self.process_target(i)
+        return self.night.sci_targets[i], self.extracted_data
 
     @staticmethod
     def get_args():
@@ -164,6 +217,15 @@ class MainApp(object):
             -i or --non-interactive: Interactive Wavelength Solution. Enabled by default
             -o or --output-prefix: Prefix to use to name wavelength calibrated spectrum
             -R or --reference-files: Directory of reference files location
+            -t or --telescope: Telescope mode, keeps processing new files as they arrive to the source directory.
+            --poll-interval: Seconds between checks for new files in telescope mode.
+            --solution-store: Directory of wavelength solutions kept between nights.
+            --max-solution-age: Days after which a stored solution is not used anymore.
+            --max-drift: Largest drift in pixels of the lamp for reusing a stored solution directly.
+            --resampling: Method for resampling the spectra to a linear wavelength axis, none keeps the pixels
+                    and writes the non-linear solution in the IRAF multispec format.
+            --output-mode: single writes every target and lamp to its own file, mef and stacked write all the
+                    apertures of a science frame with their variance, background and lamps to one file.
             --plots-enabled: Show plots for intermediate steps. For debugging only.
 
         Raises:
@@ -234,14 +296,30 @@ Supported Observing modes are:
                             help="Name of an ASCII file describing which science target\
                                 uses which lamp. default <lamp.txt>")
 
-        # parser.add_argument('-t', '--telescope',
-        #                     action='store_true',
-        #                     default=False,
-        #                     dest='telescope',
-        #                     help="Enables the <Telescope> mode i.e. it run sequentially,\
-        #                         designed to use while observing at the telescope. Catches\
-        #                          new files arriving to the <source> folder. (NI!)")
+        parser.add_argument('-t', '--telescope',
+                            action='store_true',
+                            default=False,
+                            dest='telescope',
+                            help="Enables the <Telescope> mode i.e. it run sequentially,\
+                                designed to use while observing at the telescope. Catches\
+                                 new files arriving to the <source> folder.")
+
+        parser.add_argument('--poll-interval',
+                            action='store',
+                            default=2.,
+                            type=float,
+                            metavar='<Seconds>',
+                            dest='poll_interval',
+                            help="Seconds between checks for new files in <Telescope> mode. Default <2>")
 
+        parser.add_argument('-j', '--jobs',
+                            action='store',
+                            default=1,
+                            type=int,
+                            dest='jobs',
+                            metavar='<N>',
+                            help="Number of processes used to extract the targets once there is a wavelength solution "
+                                 "in <Proc Mode> 0. Zero means all the available cores. Default <1> (serial).")
 
 
         parser.add_argument('-o', '--output-prefix',
@@ -264,6 +342,57 @@ Supported Observing modes are:
                             dest='interactive_ws',
                             help="Interactive wavelength solution. Enabled by default.")
 
+        parser.add_argument('--solution-store',
+                            action='store',
+                            default=None,
+                            type=str,
+                            metavar='<Store Path>',
+                            dest='solution_store',
+                            help="Directory where wavelength solutions are kept between nights. A stored solution of "
+                                 "the same instrument configuration is reused or used as first guess. Disabled by "
+                                 "default.")
+
+        parser.add_argument('--max-solution-age',
+                            action='store',
+                            default=solution_store.DEFAULT_MAX_AGE,
+                            type=float,
+                            metavar='<Days>',
+                            dest='max_solution_age',
+                            help="Stored solutions older than this are not used and are removed. "
+                                 "Default <%g>" % solution_store.DEFAULT_MAX_AGE)
+
+        parser.add_argument('--max-drift',
+                            action='store',
+                            default=solution_store.DEFAULT_MAX_DRIFT,
+                            type=float,
+                            metavar='<Pixels>',
+                            dest='max_drift',
+                            help="Largest drift of the lamp for using a stored solution directly, beyond it the "
+                                 "solution is found again. Default <%g>" % solution_store.DEFAULT_MAX_DRIFT)
+
+        parser.add_argument('--resampling',
+                            action='store',
+                            default='spline',
+                            type=str,
+                            metavar='<Method>',
+                            dest='resampling',
+                            choices=['spline', 'linear', 'cubic', 'flux', 'none'],
+                            help="Method for resampling the spectra to a linear wavelength axis: spline, linear, "
+                                 "cubic or flux (conserves the counts). With none the spectra are not resampled and "
+                                 "the solution is written in the IRAF multispec format. Default <spline>")
+
+        parser.add_argument('--output-mode',
+                            action='store',
+                            default='single',
+                            type=str,
+                            metavar='<Mode>',
+                            dest='output_mode',
+                            choices=['single', 'mef', 'stacked'],
+                            help="Output files: single writes a file per target and lamp, mef writes all the "
+                                 "apertures of a science frame with their variance, background and lamps to one "
+                                 "multi-extension FITS, stacked to one array with a row per aperture. "
+                                 "Default <single>")
+
         parser.add_argument('--plots-enabled',
                             action='store_true',
                             default=False,
@@ -325,8 +454,7 @@ Supported Observing modes are:
         Uses information parsed by arguments to construct a table with the values of the keys specified within the
         code itself. A night object stores specific values regarding the night that is going to be processed. If the
         program is not going to be used while observing at the telescope it creates two lists of images, one for
-        science and another for lamp files. Although the telescope mode is not fully developed yet, in case of it being
-        selected it will return the night object without the list of images.
+        science and another for lamp files. In telescope mode it is called again every time a new file arrives.
 
         Returns:
             new_night (class): A class that stores critical data of the night that will be processed and can be
@@ -335,7 +463,7 @@ Supported Observing modes are:
         """
         keys = ['date', 'date-obs', 'obstype', 'object', 'exptime', 'ra', 'dec', 'grating']
         try:
-            image_collection = ccd.ImageFileCollection(self.args.source, keys)
+            image_collection = HeaderIndex(self.args.source, keys)
             self.image_collection = image_collection.summary.to_pandas()
         except ValueError as error:
             log.error('The images contain duplicated keywords')
@@ -353,15 +481,52 @@ Supported Observing modes are:
         gratings_array = self.image_collection.grating.unique()
         new_night.set_gratings(gratings=gratings_array)
 
-        # if self.args.telescope:
-        #     new_night.is_telescope()
-        #     log.info("Telescope Mode is not implemented yet...")
-        #     return new_night
-        # else:
+        if self.args.telescope:
+            new_night.is_telescope()
         new_night.add_sci(self.image_collection.file[self.image_collection.obstype == 'OBJECT'])
         new_night.add_lamp(self.image_collection.file[self.image_collection.obstype == 'COMP'])
         return new_night
 
+    def run_telescope_mode(self):
+        """Processes the reduced frames that arrive to the source directory while observing
+
+        New files matching the search pattern are detected by a DirectoryWatcher. Every new science target is
+        extracted and calibrated right away if there is a suitable lamp, otherwise it waits until a new lamp arrives.
+        The files that arrived while the night was processed are processed first.
+        """
+        log.info('Telescope mode: waiting for new files in %s (Ctrl+C to stop)', self.args.source)
+        self.pending_targets = []
+        # files written after the watcher was created but included in the night are already processed
+        self.watcher.mark_seen([os.path.join(self.args.source, file_name)
+                                for file_name in self.image_collection.file])
+        self.watcher.watch(self.process_new_file)
+
+    def process_new_file(self, path):
+        """Updates the night with a new file and processes the targets that can be processed
+
+        Args:
+            path (str): Full path of the new file.
+
+        """
+        file_name = os.path.basename(path)
+        self.night = self.set_night()
+        if file_name in self.night.sci:
+            self.pending_targets.append(file_name)
+        elif file_name not in self.night.lamp:
+            log.info('File %s is not a science target or a lamp', file_name)
+            return
+        pending_targets = self.pending_targets
+        self.pending_targets = []
+        for target in pending_targets:
+            self.night.sci = [target]
+            self.night.sci_targets = []
+            self.organize_full_night()
+            if len(self.night.sci_targets) == 0 or self.night.sci_targets[0].lamp_count == 0:
+                log.info('No lamp for %s yet, waiting for one', target)
+                self.pending_targets.append(target)
+            else:
+                self.process_target(0)
+
     def organize_full_night(self):
         """Organize the data according to the Processing Mode
 
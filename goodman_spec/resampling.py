@@ -0,0 +1,236 @@
+"""Resampling of spectra to a linear wavelength axis
+
+WavelengthCalibration.linearize_spectrum used to fit a new interpolating spline through the nonlinear wavelength axis
+of every spectrum. Every method of this module except 'spline' only depends on the wavelength axis, so the resampling is
+computed once as a sparse matrix and applied to any number of spectra that share the wavelength solution with a single
+matrix product:
+
+* 'linear': linear interpolation between the two closest pixels.
+* 'cubic': cubic convolution interpolation (Keys, a = -0.5) with the four closest pixels.
+* 'flux': every pixel is a bin between the midpoints to its neighbours, its counts are shared among the new bins in
+  proportion to their overlap. The total counts are conserved.
+* 'spline': the interpolating spline of every spectrum followed by a median filter of size three, the former behaviour
+  and the default.
+* 'none': the spectra are not resampled, their wavelength axis is the solution itself and has to be written in the
+  IRAF multispec format, see goodman_spec.wsbuilder.add_multispec_solution.
+
+The matrices are kept by get_resampler for every wavelength solution and number of pixels.
+
+"""
+import logging
+import collections
+import numpy as np
+import scipy.interpolate
+import scipy.sparse
+from scipy import signal
+
+log = logging.getLogger('redspec.resampling')
+
+METHODS = ['spline', 'linear', 'cubic', 'flux', 'none']
+
+# number of resamplers kept by get_resampler
+CACHE_SIZE = 16
+
+# parameter of the cubic convolution kernel, -0.5 reproduces cubic polynomials exactly
+CUBIC_PARAMETER = -0.5
+
+_resamplers = collections.OrderedDict()
+
+
+def get_linear_axis(wavelength):
+    """Linear wavelength axis with the same range and number of samples
+
+    Args:
+        wavelength (array): Wavelength of every pixel, monotonic.
+
+    Returns:
+        new_wavelength (array): Linear axis from the first to the last wavelength.
+
+    """
+    return np.linspace(wavelength[0], wavelength[-1], len(wavelength))
+
+
+def get_bin_edges(wavelength):
+    """Edges of the bin of every sample, halfway to its neighbours
+
+    Args:
+        wavelength (array): Increasing wavelength of every sample.
+
+    Returns:
+        edges (array): One more element than wavelength.
+
+    """
+    middle = 0.5 * (wavelength[1:] + wavelength[:-1])
+    return np.concatenate([[2 * wavelength[0] - middle[0]], middle, [2 * wavelength[-1] - middle[-1]]])
+
+
+def get_cubic_weights(fraction):
+    """Weights of the cubic convolution kernel for the four pixels around every position
+
+    Args:
+        fraction (array): Distance from every position to the pixel at its left, between 0 and 1.
+
+    Returns:
+        weights (array): One row per position for the pixels at -1, 0, 1 and 2 from the pixel at its left.
+
+    """
+    distance = np.abs(fraction[:, np.newaxis] - np.arange(-1, 3)[np.newaxis, :])
+    near = (CUBIC_PARAMETER + 2) * distance ** 3 - (CUBIC_PARAMETER + 3) * distance ** 2 + 1
+    far = CUBIC_PARAMETER * (distance ** 3 - 5 * distance ** 2 + 8 * distance - 4)
+    return np.where(distance <= 1, near, np.where(distance < 2, far, 0.))
+
+
+def get_resampling_matrix(wavelength, new_wavelength, method='linear'):
+    """Sparse matrix that resamples spectra from one wavelength axis to another
+
+    Args:
+        wavelength (array): Wavelength of every pixel, monotonic.
+        new_wavelength (array): Wavelength of every new sample, within the range of wavelength.
+        method (str): 'linear', 'cubic' or 'flux'.
+
+    Returns:
+        matrix (object): scipy.sparse.csr_matrix with one row per new sample and one column per pixel.
+
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    new_wavelength = np.asarray(new_wavelength, dtype=float)
+    n_pixels = len(wavelength)
+    # the interpolation works on increasing axes, columns refer to the original order of the pixels
+    columns = np.arange(n_pixels)
+    if wavelength[0] > wavelength[-1]:
+        wavelength = wavelength[::-1]
+        columns = columns[::-1]
+    if method == 'flux':
+        edges = get_bin_edges(wavelength)
+        new_edges = np.sort(get_bin_edges(new_wavelength))
+        # every piece between two consecutive edges of either axis belongs to one bin of each
+        pieces = np.unique(np.concatenate([edges, new_edges]))
+        pieces = pieces[(pieces >= max(edges[0], new_edges[0])) & (pieces <= min(edges[-1], new_edges[-1]))]
+        middle = 0.5 * (pieces[1:] + pieces[:-1])
+        pixel = np.searchsorted(edges, middle) - 1
+        new_pixel = np.searchsorted(new_edges, middle) - 1
+        if new_wavelength[0] > new_wavelength[-1]:
+            new_pixel = len(new_wavelength) - 1 - new_pixel
+        weights = np.diff(pieces) / np.diff(edges)[pixel]
+        rows = new_pixel
+        columns = columns[pixel]
+    else:
+        position = np.interp(new_wavelength, wavelength, np.arange(n_pixels, dtype=float))
+        left = np.clip(np.floor(position).astype(int), 0, n_pixels - 2)
+        fraction = position - left
+        if method == 'linear':
+            offsets = np.array([0, 1])
+            weights = np.column_stack([1 - fraction, fraction])
+        elif method == 'cubic':
+            offsets = np.arange(-1, 3)
+            weights = get_cubic_weights(fraction)
+        else:
+            raise ValueError('Unknown resampling method: %s' % method)
+        # pixels beyond the ends repeat the last one
+        pixel = np.clip(left[:, np.newaxis] + offsets[np.newaxis, :], 0, n_pixels - 1)
+        rows = np.repeat(np.arange(len(new_wavelength)), len(offsets))
+        columns = columns[pixel.ravel()]
+        weights = weights.ravel()
+    return scipy.sparse.coo_matrix((weights, (rows, columns)), shape=(len(new_wavelength), n_pixels)).tocsr()
+
+
+class Resampler(object):
+    """Resamples spectra from the wavelength axis of a solution to a linear one
+
+    Attributes:
+        wavelength (array): Wavelength of every pixel.
+        new_wavelength (array): Linear wavelength axis, the same as wavelength for 'none'.
+        method (str): One of METHODS.
+        matrix (object): Sparse resampling matrix, None for 'spline' and 'none'.
+
+    """
+
+    def __init__(self, wavelength, method='spline'):
+        """Computes the resampling matrix
+
+        Args:
+            wavelength (array): Wavelength of every pixel, monotonic.
+            method (str): One of METHODS.
+
+        """
+        if method not in METHODS:
+            raise ValueError('Unknown resampling method: %s' % method)
+        self.wavelength = np.asarray(wavelength, dtype=float)
+        self.new_wavelength = get_linear_axis(self.wavelength)
+        self.method = method
+        self.matrix = None
+        if method == 'none':
+            self.new_wavelength = self.wavelength
+        elif method != 'spline':
+            self.matrix = get_resampling_matrix(self.wavelength, self.new_wavelength, method)
+
+    def __call__(self, data):
+        """Resamples one spectrum or a stack of spectra
+
+        Args:
+            data (array): Spectrum, or one spectrum per row.
+
+        Returns:
+            new_data (array): Resampled data, same shape as data.
+
+        """
+        data = np.asarray(data, dtype=float)
+        if self.method == 'none':
+            return data.copy()
+        if self.matrix is not None:
+            return self.matrix.dot(data.T).T
+        spectra = np.atleast_2d(data)
+        new_data = np.empty(spectra.shape)
+        for row, spectrum in enumerate(spectra):
+            tck = scipy.interpolate.splrep(self.wavelength, spectrum, s=0)
+            # the spline can overshoot where the data is too steep
+            new_data[row] = signal.medfilt(scipy.interpolate.splev(self.new_wavelength, tck, der=0))
+        return new_data.reshape(data.shape)
+
+    def resample_variance(self, variance):
+        """Variance of the resampled spectra
+
+        Every new sample is a weighted sum of pixels, its variance is the sum of the variances times the squared
+        weights, assuming the pixels are independent. The spline has no weights, the variance is interpolated like the
+        data.
+
+        Args:
+            variance (array): Variance of one spectrum, or one per row.
+
+        Returns:
+            new_variance (array): Variance of the resampled data, same shape as variance.
+
+        """
+        variance = np.asarray(variance, dtype=float)
+        if self.matrix is None:
+            return self(variance)
+        return self.matrix.multiply(self.matrix).dot(variance.T).T
+
+
+def get_resampler(model, n_pixels, method='spline'):
+    """Resampler of a wavelength solution, computed once for every solution and number of pixels
+
+    Args:
+        model (object): Wavelength solution, a model from astropy.modeling.models.
+        n_pixels (int): Length of the spectra.
+        method (str): One of METHODS.
+
+    Returns:
+        resampler (object): Resampler for the wavelength axis model(1..n_pixels).
+
+    """
+    domain = getattr(model, 'domain', None)
+    key = (model.__class__.__name__,
+           tuple(np.asarray(model.parameters, dtype=float)),
+           () if domain is None else tuple(np.ravel(domain)),
+           n_pixels,
+           method)
+    if key in _resamplers:
+        resampler = _resamplers.pop(key)
+    else:
+        log.debug('Computing %s resampling of %s pixels', method, n_pixels)
+        resampler = Resampler(model(np.arange(1, n_pixels + 1)), method)
+    _resamplers[key] = resampler
+    while len(_resamplers) > CACHE_SIZE:
+        _resamplers.popitem(last=False)
+    return resampler
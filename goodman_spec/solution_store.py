@@ -0,0 +1,321 @@
+"""Persistent store of wavelength solutions
+
+A wavelength solution depends on the instrument configuration, the keywords compared by
+WavelengthSolution.check_compatibility, and changes little from one night to the next. SolutionStore keeps the
+solutions found by redspec in a directory so that a later night with the same configuration can start from them:
+
+* index.json describes every stored solution: the spectral features of its lamp (see
+  WavelengthSolution.set_spectral_features), the date of the lamp, the model and the quality of the fit.
+* <id>.npy is the comparison lamp the solution was found with.
+
+A stored solution is never used blindly. The new lamp is cross correlated with the stored one to measure the drift of
+the spectrum on the detector (see get_drift). If it moved less than max_drift pixels the stored solution, shifted by
+the drift, is used directly and only has to fit the lines of the new lamp about as well as it fitted its own (see
+accepts), otherwise it is only the starting point of a new solution. Solutions of lamps taken more than max_age days
+apart from the new one are ignored, and only the newest max_per_configuration solutions of every configuration are
+kept.
+
+"""
+import os
+import json
+import uuid
+import logging
+import datetime
+import numpy as np
+from astropy.modeling import models, fitting
+from scipy import signal
+
+log = logging.getLogger('redspec.solution_store')
+
+# name of the index inside the store directory
+INDEX_FILE_NAME = 'index.json'
+
+# stored solutions of lamps taken more than this many days apart are not used
+DEFAULT_MAX_AGE = 30.
+
+# largest drift in pixels for using a stored solution directly
+DEFAULT_MAX_DRIFT = 1.
+
+# number of solutions kept for every instrument configuration
+DEFAULT_MAX_PER_CONFIGURATION = 5
+
+# largest drift in pixels searched by the cross correlation
+DEFAULT_SEARCH_RANGE = 100
+
+# a reused solution may have this times the RMS error of the original fit, or the original plus RMS_MARGIN Angstrom
+MAX_RMS_RATIO = 2.
+RMS_MARGIN = 0.2
+
+
+def get_date(header):
+    """Date of an observation
+
+    Args:
+        header (object): FITS header.
+
+    Returns:
+        date (object): datetime.date from DATE-OBS or DATE, today if neither can be read.
+
+    """
+    for key in ['DATE-OBS', 'DATE']:
+        try:
+            return datetime.datetime.strptime(str(header[key])[:10], '%Y-%m-%d').date()
+        except (KeyError, ValueError):
+            continue
+    log.warning('The date of the lamp could not be read, using today')
+    return datetime.date.today()
+
+
+def model_to_dict(model):
+    """JSON serializable description of a 1D model from astropy.modeling.models
+
+    Args:
+        model (object): Fitted model, e.g. Chebyshev1D or Linear1D.
+
+    Returns:
+        content (dict): Name of the model class, degree, domain, window and parameters.
+
+    """
+    content = {'name': model.__class__.__name__,
+               'parameters': [float(value) for value in model.parameters]}
+    for attribute in ['degree', 'domain', 'window']:
+        value = getattr(model, attribute, None)
+        if value is not None:
+            content[attribute] = value if attribute == 'degree' else [float(limit) for limit in value]
+    return content
+
+
+def dict_to_model(content):
+    """Model from the description written by model_to_dict
+
+    Args:
+        content (dict): Description of the model.
+
+    Returns:
+        model (object): Model with the stored parameters.
+
+    """
+    model_class = getattr(models, content['name'])
+    keywords = dict([(key, content[key]) for key in ['domain', 'window'] if key in content])
+    if 'degree' in content:
+        model = model_class(content['degree'], **keywords)
+    else:
+        model = model_class(**keywords)
+    model.parameters = np.array(content['parameters'])
+    return model
+
+
+def shift_model(model, drift, pixel_axis):
+    """Solution for a lamp that moved on the detector
+
+    Args:
+        model (object): Linear model from astropy.modeling.models, e.g. a polynomial.
+        drift (float): The new pixel p sees what the old one saw at p + drift, see get_drift.
+        pixel_axis (array): Pixels where the shifted model has to be valid.
+
+    Returns:
+        model (object): Model of the same kind that returns model(p + drift). It is exact for polynomials.
+
+    """
+    pixel_axis = np.asarray(pixel_axis, dtype=float)
+    if drift == 0:
+        return model.copy()
+    linear_fitter = fitting.LinearLSQFitter()
+    return linear_fitter(model.copy(), pixel_axis, model(pixel_axis + drift))
+
+
+def get_drift(stored_lamp, lamp, search_range=DEFAULT_SEARCH_RANGE):
+    """Shift of the lines of a lamp with respect to a stored lamp
+
+    Args:
+        stored_lamp (array): Lamp of the stored solution.
+        lamp (array): New lamp.
+        search_range (int): Largest shift searched in pixels.
+
+    Returns:
+        drift (float): Sub-pixel shift, lamp[p] matches stored_lamp[p + drift]. None if the lamps do not correlate
+            within search_range.
+
+    """
+    # only the lines matter, the square root keeps the brightest lines from dominating
+    stored_lines = np.sqrt(np.maximum(stored_lamp - np.median(stored_lamp), 0))
+    lines = np.sqrt(np.maximum(lamp - np.median(lamp), 0))
+    if not np.any(stored_lines > 0) or not np.any(lines > 0):
+        return None
+    correlation = signal.fftconvolve(stored_lines, lines[::-1], mode='full')
+    # element k of the full correlation is the shift k - (len(lamp) - 1)
+    zero = len(lamp) - 1
+    first = max(zero - search_range, 0)
+    window = correlation[first:zero + search_range + 1]
+    peak = int(np.argmax(window))
+    if peak == 0 or peak == len(window) - 1:
+        return None
+    left, center, right = window[peak - 1:peak + 2]
+    curvature = left - 2 * center + right
+    drift = float(first + peak - zero)
+    if curvature < 0:
+        drift += 0.5 * (left - right) / curvature
+    return drift
+
+
+class SolutionStore(object):
+    """Directory of wavelength solutions of previous nights
+
+    Attributes:
+        location (str): Store directory.
+        max_age (float): Maximum difference in days between the stored lamp and the new one.
+        max_drift (float): Maximum drift in pixels for using a stored solution directly.
+        max_per_configuration (int): Number of solutions kept for every instrument configuration.
+        entries (dict): Content of the index, for every solution id a dictionary with the keys 'features', 'date',
+            'lamp_name', 'reference_lamp', 'model', 'rms_error' and 'evaluation_comment'.
+
+    """
+
+    def __init__(self, location, max_age=DEFAULT_MAX_AGE, max_drift=DEFAULT_MAX_DRIFT,
+                 max_per_configuration=DEFAULT_MAX_PER_CONFIGURATION):
+        """Loads the index of a store directory, the directory is created if it does not exist
+
+        Args:
+            location (str): Store directory.
+            max_age (float): Maximum difference in days between the stored lamp and the new one.
+            max_drift (float): Maximum drift in pixels for using a stored solution directly.
+            max_per_configuration (int): Number of solutions kept for every instrument configuration.
+
+        """
+        self.location = location
+        self.max_age = max_age
+        self.max_drift = max_drift
+        self.max_per_configuration = max_per_configuration
+        self.entries = {}
+        if not os.path.isdir(location):
+            os.makedirs(location)
+        self.index_path = os.path.join(location, INDEX_FILE_NAME)
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as index_file:
+                    self.entries = json.load(index_file)
+            except (IOError, ValueError) as error:
+                log.warning('Ignoring unreadable solution index %s: %s', self.index_path, error)
+
+    def save(self):
+        """Writes the index to disk"""
+        temporary_path = self.index_path + '.tmp'
+        with open(temporary_path, 'w') as index_file:
+            json.dump(self.entries, index_file, indent=1, sort_keys=True)
+        os.rename(temporary_path, self.index_path)
+
+    def _lamp_path(self, solution_id):
+        """Full path of the lamp of a solution"""
+        return os.path.join(self.location, solution_id + '.npy')
+
+    def _age(self, solution_id, date):
+        """Days between the lamp of a solution and a date"""
+        stored_date = datetime.datetime.strptime(self.entries[solution_id]['date'], '%Y-%m-%d').date()
+        return abs((date - stored_date).days)
+
+    def find(self, header, lamp_data, is_compatible):
+        """Closest stored solution in time for a new lamp
+
+        Args:
+            header (object): FITS header of the new lamp.
+            lamp_data (array): New lamp.
+            is_compatible (callable): Takes the spectral features of a stored solution, returns True if it can be
+                applied to the new lamp.
+
+        Returns:
+            stored (tuple): Model shifted to the new lamp, drift in pixels and index entry of the solution. None if
+                no stored solution is compatible, recent enough and correlates with the new lamp.
+
+        """
+        date = get_date(header)
+        lamp_data = np.asarray(lamp_data, dtype=float)
+        candidates = [solution_id for solution_id in self.entries
+                      if self._age(solution_id, date) <= self.max_age and
+                      is_compatible(self.entries[solution_id]['features'])]
+        for solution_id in sorted(candidates, key=lambda candidate: self._age(candidate, date)):
+            entry = self.entries[solution_id]
+            try:
+                stored_lamp = np.load(self._lamp_path(solution_id))
+            except IOError as error:
+                log.warning('Ignoring stored solution %s: %s', solution_id, error)
+                continue
+            drift = get_drift(stored_lamp, lamp_data)
+            if drift is None:
+                log.info('Lamp does not correlate with the stored lamp of %s', entry['date'])
+                continue
+            model = shift_model(dict_to_model(entry['model']), drift, np.arange(1, len(lamp_data) + 1))
+            log.info('Found stored solution of %s, drift %.2f pixels', entry['date'], drift)
+            return model, drift, entry
+        return None
+
+    def accepts(self, entry, rms_error):
+        """Whether a reused solution fits the new lamp as well as the original one
+
+        Args:
+            entry (dict): Index entry of the stored solution.
+            rms_error (float): RMS error of the reused solution on the new lamp, in Angstrom.
+
+        Returns:
+            True or False
+
+        """
+        stored_rms_error = entry['rms_error'] or 0.
+        limit = max(MAX_RMS_RATIO * stored_rms_error, stored_rms_error + RMS_MARGIN)
+        return rms_error is not None and rms_error <= limit
+
+    def add(self, header, lamp_data, model, features, is_compatible, lamp_name='', reference_lamp='',
+            rms_error=None, evaluation_comment=None):
+        """Stores a new solution and evicts the old ones
+
+        Args:
+            header (object): FITS header of the lamp.
+            lamp_data (array): Lamp the solution was found with.
+            model (object): Wavelength solution.
+            features (dict): Spectral features of the lamp, see WavelengthSolution.set_spectral_features.
+            is_compatible (callable): Takes the spectral features of a stored solution, returns True if it belongs to
+                the same configuration.
+            lamp_name (str): OBJECT of the lamp.
+            reference_lamp (str): File name of the lamp.
+            rms_error (float): RMS error of the solution in Angstrom.
+            evaluation_comment (str): Comment added to the headers.
+
+        Returns:
+            solution_id (str): Identifier of the new solution.
+
+        """
+        date = get_date(header)
+        solution_id = '%s_%s' % (date.strftime('%Y%m%d'), uuid.uuid4().hex[:8])
+        np.save(self._lamp_path(solution_id), np.asarray(lamp_data, dtype=float))
+        self.entries[solution_id] = {'features': features,
+                                     'date': date.strftime('%Y-%m-%d'),
+                                     'lamp_name': lamp_name,
+                                     'reference_lamp': reference_lamp,
+                                     'model': model_to_dict(model),
+                                     'rms_error': None if rms_error is None else float(rms_error),
+                                     'evaluation_comment': evaluation_comment}
+        self.evict(is_compatible)
+        self.save()
+        log.info('Wavelength solution stored as %s', solution_id)
+        return solution_id
+
+    def evict(self, is_compatible):
+        """Removes the old solutions and keeps the newest ones of a configuration
+
+        A solution is old when its lamp was taken more than max_age days before the newest lamp in the store, so
+        reducing an old night does not remove the solutions of the recent ones.
+
+        Args:
+            is_compatible (callable): Selects the solutions of the configuration of the lamp just added.
+
+        """
+        newest = sorted(self.entries, key=lambda solution_id: self.entries[solution_id]['date'], reverse=True)
+        if len(newest) == 0:
+            return
+        date = datetime.datetime.strptime(self.entries[newest[0]]['date'], '%Y-%m-%d').date()
+        configuration = [solution_id for solution_id in newest if is_compatible(self.entries[solution_id]['features'])]
+        expired = [solution_id for solution_id in newest if self._age(solution_id, date) > self.max_age]
+        for solution_id in set(expired + configuration[self.max_per_configuration:]):
+            log.debug('Removing stored solution %s', solution_id)
+            del self.entries[solution_id]
+            if os.path.isfile(self._lamp_path(solution_id)):
+                os.remove(self._lamp_path(solution_id))
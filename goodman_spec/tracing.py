@@ -0,0 +1,168 @@
+"""Centroids of the sub-samples used to trace spectra
+
+Process.trace takes about fifty sub-samples of every target along the dispersion axis, collapses each of them to a
+spatial profile and fits a Chebyshev to the location of the peaks. Fitting a Voigt profile with LevMarLSQFitter to
+every sub-sample dominated the processing time of a frame, so the centroids are now estimated in closed form for all
+the profiles of all the targets at once:
+
+* a parabola through the maximum and its two neighbours gives the sub-pixel peak, it is computed on the logarithm of
+  the background subtracted profile, which is exact for a Gaussian core, and on the profile itself when the logarithm
+  is not defined.
+* the flux weighted first moment over the core of the profile is an independent estimate.
+
+When both estimates agree the profile is a clean, single peak and the parabolic peak is used. Profiles whose maximum is
+at the edge of the sample, that are not peaked or where both estimates disagree (blends, asymmetric profiles, very low
+signal) are flagged as ambiguous and only those are refined with the Voigt fit used before.
+
+"""
+import logging
+import numpy as np
+from astropy.modeling import models, fitting
+
+log = logging.getLogger('redspec.tracing')
+
+# maximum difference in pixels between the parabolic peak and the first moment of a clean profile
+AMBIGUITY_TOLERANCE = 0.5
+
+
+def get_profiles(data, starts, sample_width):
+    """Median spatial profiles of sub-samples along the dispersion axis
+
+    Args:
+        data (array): 2D cut of the image around a target, spatial direction in the first axis.
+        starts (array): First column of every sub-sample.
+        sample_width (int): Number of columns of every sub-sample.
+
+    Returns:
+        profiles (array): Array of shape (len(starts), data.shape[0]).
+
+    """
+    starts = np.asarray(starts, dtype=int)
+    columns = starts[:, np.newaxis] + np.arange(sample_width)[np.newaxis, :]
+    if len(starts) > 0 and columns[-1, -1] >= data.shape[1]:
+        # the last sub-sample is truncated by the edge of the image, same as slicing
+        return np.array([np.median(data[:, start:start + sample_width], axis=1) for start in starts])
+    # axes are (row, sub-sample, column)
+    return np.median(data[:, columns], axis=2).T
+
+
+def stack_profiles(profile_list):
+    """Stacks profiles of different lengths in a single array
+
+    Shorter profiles are padded at the end with their own minimum, which does not change their maximum nor, after
+    subtracting the background, their moments.
+
+    Args:
+        profile_list (list): 2D arrays of profiles, one per target, of shape (n_profiles, n_rows).
+
+    Returns:
+        profiles (array): Array of shape (total number of profiles, longest n_rows).
+
+    """
+    length = max([profiles.shape[1] for profiles in profile_list])
+    padded = []
+    for profiles in profile_list:
+        pad = np.repeat(np.min(profiles, axis=1)[:, np.newaxis], length - profiles.shape[1], axis=1)
+        padded.append(np.hstack([profiles, pad]))
+    return np.vstack(padded)
+
+
+def estimate_centroids(profiles, tolerance=AMBIGUITY_TOLERANCE):
+    """Closed form centroids of a stack of profiles
+
+    Args:
+        profiles (array): 2D array, one profile per row.
+        tolerance (float): Maximum difference in pixels between the parabolic peak and the first moment.
+
+    Returns:
+        centroids (array): Location of the peak of every profile, in pixels from the start of the profile.
+        ambiguous (array): Boolean array, True for the profiles whose estimate is not reliable.
+
+    """
+    profiles = np.asarray(profiles, dtype=np.float64)
+    n_profiles, n_rows = profiles.shape
+    index = np.arange(n_profiles)
+    axis = np.arange(n_rows)
+
+    peak = np.argmax(profiles, axis=1)
+    edge = (peak == 0) | (peak == n_rows - 1)
+    inner = np.clip(peak, 1, n_rows - 2)
+
+    # background from the ends of the profiles
+    ends = min(3, n_rows)
+    background = np.minimum(np.median(profiles[:, :ends], axis=1), np.median(profiles[:, -ends:], axis=1))
+    signal = profiles - background[:, np.newaxis]
+    left = signal[index, inner - 1]
+    center = signal[index, inner]
+    right = signal[index, inner + 1]
+
+    # parabola through the logarithm (gaussian core) or through the values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        positive = (left > 0) & (center > 0) & (right > 0)
+        log_left = np.log(np.where(positive, left, 1.))
+        log_center = np.log(np.where(positive, center, 1.))
+        log_right = np.log(np.where(positive, right, 1.))
+        curvature = np.where(positive, log_left - 2 * log_center + log_right, left - 2 * center + right)
+        shift = np.where(positive, 0.5 * (log_left - log_right), 0.5 * (left - right)) / curvature
+    peaked = (curvature < 0) & np.isfinite(shift) & (np.abs(shift) <= 1)
+    parabolic = inner + np.where(peaked, shift, 0.)
+
+    # first moment over the pixels above half of the maximum around the peak
+    half_width = np.maximum(1, np.sum(signal > 0.5 * center[:, np.newaxis], axis=1) // 2)
+    core = np.abs(axis[np.newaxis, :] - np.round(parabolic)[:, np.newaxis]) <= half_width[:, np.newaxis]
+    weights = np.where(core, np.maximum(signal, 0), 0)
+    total = np.sum(weights, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        moment = np.sum(weights * axis[np.newaxis, :], axis=1) / total
+
+    ambiguous = edge | ~peaked | (total <= 0) | ~(np.abs(moment - parabolic) <= tolerance)
+    return parabolic, ambiguous
+
+
+def fit_voigt_centroid(profile):
+    """Location of the peak of a profile from a Voigt fit
+
+    Args:
+        profile (array): Spatial profile.
+
+    Returns:
+        centroid (float): Fitted x_0 in pixels from the start of the profile.
+
+    """
+    voigt_init = models.Voigt1D(x_0=np.argmax(profile), amplitude_L=np.max(profile), fwhm_L=8, fwhm_G=8)
+    fit_voigt = fitting.LevMarLSQFitter()
+    voigt = fit_voigt(voigt_init, range(len(profile)), profile)
+    return voigt.x_0.value
+
+
+def get_centroids(profile_list, refine=True, tolerance=AMBIGUITY_TOLERANCE):
+    """Centroids of the profiles of several targets, with Voigt fits only where needed
+
+    Args:
+        profile_list (list): 2D arrays of profiles, one per target, see get_profiles.
+        refine (bool): Fit a Voigt profile to the ambiguous profiles. If False their closed form estimate is kept.
+        tolerance (float): See estimate_centroids.
+
+    Returns:
+        centroid_list (list): Array of centroids for every target, in pixels from the start of its profiles.
+        ambiguous_list (list): Boolean array for every target, True for the profiles that were refined.
+
+    """
+    if len(profile_list) == 0:
+        return [], []
+    centroids, ambiguous = estimate_centroids(stack_profiles(profile_list), tolerance=tolerance)
+    centroid_list = []
+    ambiguous_list = []
+    start = 0
+    for profiles in profile_list:
+        stop = start + len(profiles)
+        target_centroids = centroids[start:stop]
+        target_ambiguous = ambiguous[start:stop]
+        if refine:
+            for index in np.nonzero(target_ambiguous)[0]:
+                target_centroids[index] = fit_voigt_centroid(profiles[index])
+        centroid_list.append(target_centroids)
+        ambiguous_list.append(target_ambiguous)
+        start = stop
+    log.debug('Voigt refinement of %s out of %s profiles', np.count_nonzero(ambiguous), len(centroids))
+    return centroid_list, ambiguous_list
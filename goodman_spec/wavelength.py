@@ -11,6 +11,7 @@ to the image's header following the FITS standard.
 from __future__ import print_function
 
 import logging
+import os
 import sys
 
 import matplotlib.pyplot as plt
@@ -21,8 +22,11 @@ from astropy.io import fits
 from astropy.stats import sigma_clip
 from scipy import signal
 
+import output
+import resampling
 import wsbuilder
-from linelist import ReferenceData
+from linelist import ReferenceData, get_closest_index
+from solution_store import SolutionStore
 
 # FORMAT = '%(levelname)s:%(filename)s:%(module)s: 	%(message)s'
 # log.basicConfig(level=log.INFO, format=FORMAT)
@@ -65,8 +69,18 @@ class WavelengthCalibration(object):
         self.reference_data = ReferenceData(self.args)
         self.science_object = science_object
         self.slit_offset = None
-        self.interpolation_size = 200
         self.line_search_method = 'derivative'
+        """Automatic wavelength finding"""
+        # largest error of the grating equation in Angstrom
+        self.automatic_max_shift = 300.
+        # initial tolerance for matching lines, in pixels
+        self.automatic_tolerance = 5.
+        # minimum number of matched lines for a solution
+        self.automatic_min_lines = 8
+        # number of match and fit iterations
+        self.automatic_iterations = 5
+        # random subsets of candidate lines tried by the first match, see wsbuilder.WavelengthFitter.ransac_fit
+        self.automatic_ransac_trials = 2000
         """Instrument configuration and spectral characteristics"""
         self.gratings_dict = {'SYZY_400': 400,
                               'KOSI_600': 600,
@@ -116,6 +130,11 @@ class WavelengthCalibration(object):
         self.sci_filename = self.science_object.file_name
         # self.history_of_lamps_solutions = {}
         self.reference_solution = None
+        self.solution_store = None
+        if self.args.solution_store is not None:
+            self.solution_store = SolutionStore(self.args.solution_store,
+                                                max_age=self.args.max_solution_age,
+                                                max_drift=self.args.max_drift)
 
     def __call__(self, wsolution_obj=None):
         """Call method for the WavelengthSolution Class
@@ -144,35 +163,38 @@ class WavelengthCalibration(object):
                     self.lamp_header = self.science_pack.lamps_headers[lamp_index]
                     self.lamp_name = self.lamp_header['OBJECT']
                     log.info('Processing Comparison Lamp: %s', self.lamp_name)
-                    self.data1 = self.interpolate(self.lamp_data)
                     # self.lines_limits = self.get_line_limits()
                     # self.lines_center = self.get_line_centers(self.lines_limits)
                     self.lines_center = self.get_lines_in_lamp()
                     self.spectral = self.get_spectral_characteristics()
-                    if self.args.interactive_ws:
-                        self.interactive_wavelength_solution()
-                    else:
-                        log.warning('Automatic Wavelength Solution is not fully implemented yet')
-                        self.automatic_wavelength_solution()
-                        # self.wsolution = self.wavelength_solution()
+                    prior = None
+                    if self.solution_store is not None:
+                        prior = self.use_stored_solution()
+                    is_stored = self.wsolution is not None
+                    if not is_stored:
+                        if self.args.interactive_ws:
+                            self.interactive_wavelength_solution()
+                        else:
+                            self.automatic_wavelength_solution(prior=prior)
+                            # self.wsolution = self.wavelength_solution()
                     if self.wsolution is not None:
                         self.linear_lamp = self.linearize_spectrum(self.lamp_data)
-                        self.lamp_header = self.add_wavelength_solution(self.lamp_header,
-                                                                        self.linear_lamp,
-                                                                        self.science_object.lamp_file[lamp_index - 1])
-                        for target_index in range(self.science_object.no_targets):
-                            log.debug('Processing target %s', target_index + 1)
-                            new_data = self.science_pack.data[target_index]
-                            new_header = self.science_pack.headers[target_index]
-                            if self.science_object.no_targets > 1:
-                                new_index = target_index + 1
-                            else:
-                                new_index = None
-                            self.linearized_sci = self.linearize_spectrum(new_data)
-                            self.header = self.add_wavelength_solution(new_header,
-                                                                       self.linearized_sci,
-                                                                       self.sci_filename,
-                                                                       index=new_index)
+                        # a stored solution keeps the evaluation of the night it was found, see use_stored_solution
+                        evaluation_comment = self.evaluation_comment if is_stored else None
+                        if self.args.output_mode == 'single':
+                            lamp_file = self.science_object.lamp_file[lamp_index - 1]
+                            self.lamp_header = self.add_wavelength_solution(self.lamp_header,
+                                                                            self.linear_lamp,
+                                                                            lamp_file,
+                                                                            evaluation_comment)
+                        else:
+                            # the lamps are written together with the targets
+                            self.lamp_header = self.set_wavelength_solution_header(self.lamp_header.copy(),
+                                                                                   self.linear_lamp,
+                                                                                   evaluation_comment)
+                        if self.solution_store is not None and not is_stored:
+                            self.store_solution()
+                        self.write_targets(evaluation_comment)
                         wavelength_solution = WavelengthSolution(solution_type='non_linear',
                                                                  model_name='chebyshev',
                                                                  model_order=3,
@@ -195,20 +217,89 @@ class WavelengthCalibration(object):
             # print('wavelengthSolution ', self.wsolution)
             # print('Evaluation Comment', self.evaluation_comment)
             # repeat for all sci
-            for target_index in range(self.science_object.no_targets):
+            self.write_targets(self.evaluation_comment)
+
+    def write_targets(self, evaluation_comment=None):
+        """Linearizes all the targets and writes them with the wavelength solution
+
+        With the 'single' output mode (--output-mode) every target goes to its own file, numbered if there are more
+        than one. Otherwise all the apertures of the science frame, with their variance, background and comparison
+        lamps, are written to a single file, see goodman_spec.output.
+
+        Args:
+            evaluation_comment (str): A comment with information regarding the quality of the wavelength solution
+
+        """
+        no_targets = self.science_object.no_targets
+        new_x_axis, linearized_targets = self.linearize_spectrum(self.get_targets_data())
+        if self.args.output_mode == 'single':
+            for target_index in range(no_targets):
                 log.debug('Processing target %s', target_index + 1)
-                new_data = self.science_pack.data[target_index]
                 new_header = self.science_pack.headers[target_index]
-                if self.science_object.no_targets > 1:
+                if no_targets > 1:
                     new_index = target_index + 1
                 else:
                     new_index = None
-                self.linearized_sci = self.linearize_spectrum(new_data)
+                self.linearized_sci = [new_x_axis, linearized_targets[target_index]]
                 self.header = self.add_wavelength_solution(new_header,
                                                            self.linearized_sci,
                                                            self.sci_filename,
-                                                           self.evaluation_comment,
+                                                           evaluation_comment,
                                                            index=new_index)
+            return
+
+        resampler = resampling.get_resampler(self.wsolution, linearized_targets.shape[-1], self.args.resampling)
+        variance = [None] * no_targets
+        if len(self.science_pack.variance) == no_targets:
+            variance = resampler.resample_variance(np.array(self.science_pack.variance, dtype=float))
+        background = [None] * no_targets
+        if len(self.science_pack.background) == no_targets:
+            background = resampler(np.array(self.science_pack.background, dtype=float))
+
+        # every target has one extraction of every lamp, see process.Process.extract
+        lamp_count = self.science_object.lamp_count
+        lamp_headers = []
+        linearized_lamps = None
+        if lamp_count > 0 and len(self.science_pack.lamps_data) == no_targets * lamp_count:
+            linearized_lamps = resampler(np.array(self.science_pack.lamps_data, dtype=float))
+            # the lamp headers only differ in APNUM1, they are built once
+            for lamp_index in range(lamp_count):
+                lamp_header = self.science_pack.lamps_headers[lamp_index].copy()
+                lamp_headers.append(self.set_wavelength_solution_header(lamp_header,
+                                                                        [new_x_axis, linearized_lamps[lamp_index]],
+                                                                        self.evaluation_comment))
+
+        frame_writer = output.FrameWriter(self.args.destiny + self.args.output_prefix + self.sci_filename,
+                                          mode=self.args.output_mode,
+                                          wsolution=self.wsolution)
+        for target_index in range(no_targets):
+            log.debug('Processing target %s', target_index + 1)
+            self.linearized_sci = [new_x_axis, linearized_targets[target_index]]
+            self.header = self.set_wavelength_solution_header(self.science_pack.headers[target_index],
+                                                              self.linearized_sci,
+                                                              evaluation_comment)
+            lamps = []
+            if linearized_lamps is not None:
+                for lamp_index in range(lamp_count):
+                    lamp_header = lamp_headers[lamp_index].copy()
+                    lamp_header['APNUM1'] = self.header['APNUM1']
+                    lamps.append((lamp_header, linearized_lamps[target_index * lamp_count + lamp_index]))
+            frame_writer.add_aperture(self.header,
+                                      linearized_targets[target_index],
+                                      variance=variance[target_index],
+                                      background=background[target_index],
+                                      lamps=lamps)
+        frame_writer.write()
+
+    def get_targets_data(self):
+        """Extracted spectra of all the targets, one per row, so they can be linearized together
+
+        Returns:
+            targets_data (array): Two dimensional array with the spectrum of every target.
+
+        """
+        return np.array([self.science_pack.data[target_index]
+                         for target_index in range(self.science_object.no_targets)], dtype=float)
 
     def get_wsolution(self):
         """Get the mathematical model of the wavelength solution
@@ -278,54 +369,26 @@ class WavelengthCalibration(object):
 
         For every line center (pixel value) it will scan left first until the data stops decreasing, it assumes it
         is an emission line and then will scan right until it stops decreasing too. Defined those limits it will
+        calculate the centroid of the symmetric part around the peak. For asymmetric lines, e.g. blends, the centroid
+        is biased and the sub-pixel maximum of the interpolating spline is used instead, see get_spline_peaks. All the
+        lines are measured at once by get_line_centroids.
+
+        Args:
+            data (array): Lamp spectrum.
+            lines (array): Pixel of every line as an index of data, e.g. from scipy.signal.argrelmax.
+            plots (bool): Show the data and the centers.
+
+        Returns:
+            new_center (list): Center of every line in pixels, starting at one.
+
         """
-        new_center = []
-        x_size = data.shape[0]
         median = np.median(data)
-        for line in lines:
-            # TODO (simon): Check if this definition is valid, so far is not critical
-            left_limit = 0
-            right_limit = 1
-            condition = True
-            left_index = int(line)
-            while condition and left_index - 2 > 0:
-                if (data[left_index - 1] > data[left_index]) and (data[left_index - 2] > data[left_index - 1]):
-                    condition = False
-                    left_limit = left_index
-                elif data[left_index] < median:
-                    condition = False
-                    left_limit = left_index
-                else:
-                    left_limit = left_index
-                left_index -= 1
-
-            # id right limit
-            condition = True
-            right_index = int(line)
-            while condition and right_index + 2 < x_size - 1:
-                if (data[right_index + 1] > data[right_index]) and (data[right_index + 2] > data[right_index + 1]):
-                    condition = False
-                    right_limit = right_index
-                elif data[right_index] < median:
-                    condition = False
-                    right_limit = right_index
-                else:
-                    right_limit = right_index
-                right_index += 1
-            index_diff = [abs(line - left_index), abs(line - right_index)]
-
-            sub_x_axis = range(line - min(index_diff), (line + min(index_diff)) + 1)
-            sub_data = data[line - min(index_diff):(line + min(index_diff)) + 1]
-            centroid = np.sum(sub_x_axis * sub_data) / np.sum(sub_data)
-            # checks for asymmetries
-            differences = [abs(data[line] - data[left_limit]), abs(data[line] - data[right_limit])]
-            if max(differences) / min(differences) >= 2.:
-                if plots:
-                    plt.axvspan(line - 1, line + 1, color='g', alpha=0.3)
-                new_center.append(line + 1)
-            else:
-                new_center.append(centroid + 1)
+        centroids, asymmetric = self.get_line_centroids(data, lines)
+        spline_peaks = self.get_spline_peaks(data, lines)
+        new_center = list(np.where(asymmetric, spline_peaks, centroids) + 1)
         if plots:
+            for line in np.asarray(lines)[asymmetric]:
+                plt.axvspan(line - 1, line + 1, color='g', alpha=0.3)
             fig = plt.figure(1)
             fig.canvas.set_window_title('Lines Detected in Lamp')
             plt.axhline(median, color='b')
@@ -337,6 +400,65 @@ class WavelengthCalibration(object):
             plt.show()
         return new_center
 
+    @staticmethod
+    def get_line_centroids(data, lines):
+        """Centroid and asymmetry of all the lines of a lamp at once
+
+        Going away from the peak of a line its limit is the first pixel where the data rises for two consecutive
+        pixels or falls below the median of the lamp. The centroid is computed over the pixels within the distance of
+        the closest limit at each side of the peak. A line is asymmetric when the drop from the peak to one of its
+        limits is at least twice the drop to the other.
+
+        The limits of every line are looked up in the sorted list of pixels where the scan would stop, the
+        result is the same as walking pixel by pixel from every peak, which is what recenter_lines did before.
+
+        Args:
+            data (array): Lamp spectrum.
+            lines (array): Pixel of every line as an index of data.
+
+        Returns:
+            centroids (array): Centroid of every line as a fractional index of data.
+            asymmetric (array): Boolean array, True for the asymmetric lines.
+
+        """
+        lines = np.asarray(lines, dtype=int)
+        x_size = data.shape[0]
+        if len(lines) == 0:
+            return np.array([]), np.array([], dtype=bool)
+        median = np.median(data)
+        below = data < median
+        index = np.arange(x_size)
+        # going left the scan stops at i (i > 2) if data rises at i - 1 and i - 2 or data[i] is below the median
+        left_stops = index[3:][(data[2:-1] > data[3:]) & (data[1:-2] > data[2:-1]) | below[3:]]
+        # going right the scan stops at i (i < x_size - 3) if data rises at i + 1 and i + 2 or data[i] is below
+        right_stops = index[:x_size - 3][(data[1:x_size - 2] > data[:x_size - 3]) &
+                                         (data[2:x_size - 1] > data[1:x_size - 2]) | below[:x_size - 3]]
+
+        # closest stop at each side, when there is none the scan ends at the edge (or does not start)
+        left = np.searchsorted(left_stops, lines, side='right') - 1
+        left_found = left >= 0
+        left_limit = np.where(left_found, np.append(left_stops, 0)[left], np.where(lines > 2, 3, 0))
+        left_index = np.where(left_found, left_limit - 1, np.where(lines > 2, 2, lines))
+        right = np.searchsorted(right_stops, lines, side='left')
+        right_found = right < len(right_stops)
+        right_limit = np.where(right_found,
+                               np.append(right_stops, 0)[right],
+                               np.where(lines < x_size - 3, x_size - 4, 1))
+        right_index = np.where(right_found, right_limit + 1, np.where(lines < x_size - 3, x_size - 3, lines))
+
+        # centroid over the symmetric window around the peak
+        half_width = np.minimum(np.abs(lines - left_index), np.abs(lines - right_index))
+        offsets = np.arange(-np.max(half_width), np.max(half_width) + 1)
+        window = np.abs(offsets)[np.newaxis, :] <= half_width[:, np.newaxis]
+        pixels = lines[:, np.newaxis] + offsets[np.newaxis, :]
+        values = np.where(window, data[np.clip(pixels, 0, x_size - 1)], 0).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centroids = np.sum(pixels * values, axis=1) / np.sum(values, axis=1)
+            differences = np.column_stack([np.abs(data[lines] - data[left_limit]),
+                                           np.abs(data[lines] - data[right_limit])])
+            asymmetric = np.max(differences, axis=1) / np.min(differences, axis=1) >= 2.
+        return centroids, asymmetric
+
     def get_spectral_characteristics(self):
         """Calculates some Goodman's specific spectroscopic values.
 
@@ -399,29 +521,37 @@ class WavelengthCalibration(object):
                                     'pix2': pixel_two}
         return spectral_characteristics
 
-    def interpolate(self, spectrum):
-        """Creates an interpolated version of the input spectrum
+    @staticmethod
+    def get_spline_peaks(data, lines, half_width=1.):
+        """Sub-pixel maximum of the interpolating spline of a spectrum around every line
 
-        This method creates an interpolated version of the input array, it is used mainly for a spectrum but it can
-        also be used with any unidimensional array, assuming you are happy with the interpolation_size attribute
-        defined for this class. The reason for doing interpolation is that it allows to find the lines and its
-        respective center more precisely. The default interpolation size is 200 (two hundred) points.
+        The cubic spline through the samples of the spectrum is piecewise polynomial, so its maxima are found exactly
+        as the roots of its derivative, a quadratic in every pixel, instead of evaluating the spline on a finer grid.
 
         Args:
-            spectrum (array): an uncalibrated spectrum or any unidimensional array.
+            data (array): Spectrum.
+            lines (array): Pixel of every line, as an index of data.
+            half_width (float): Maximum distance in pixels between the pixel of a line and its maximum.
 
         Returns:
-            Two dimensional array containing x-axis and interpolated array. The x-axis preserves original pixel values.
+            peaks (array): Location of the maximum of every line as a fractional index of data. The pixel of the line
+                is kept when the spline has no maximum close to it.
 
         """
-        x_axis = range(1, spectrum.size + 1)
-        first_x = x_axis[0]
-        last_x = x_axis[-1]
-        new_x_axis = np.linspace(first_x, last_x, spectrum.size * self.interpolation_size)
-
-        tck = scipy.interpolate.splrep(x_axis, spectrum, s=0)
-        new_spectrum = scipy.interpolate.splev(new_x_axis, tck, der=0)
-        return [new_x_axis, new_spectrum]
+        lines = np.asarray(lines, dtype=float)
+        x_axis = np.arange(len(data), dtype=float)
+        spline = scipy.interpolate.PPoly.from_spline(scipy.interpolate.splrep(x_axis, data, s=0))
+        roots = spline.derivative().roots(extrapolate=False)
+        roots = roots[np.isfinite(roots)]
+        maxima = np.sort(roots[spline.derivative(2)(roots) < 0])
+        if len(maxima) == 0 or len(lines) == 0:
+            return lines
+        # closest maximum at each side of every line
+        index = np.searchsorted(maxima, lines)
+        left = maxima[np.maximum(index - 1, 0)]
+        right = maxima[np.minimum(index, len(maxima) - 1)]
+        nearest = np.where(np.abs(left - lines) <= np.abs(right - lines), left, right)
+        return np.where(np.abs(nearest - lines) <= half_width, nearest, lines)
 
     def recenter_line_by_data(self, data_name, x_data):
         """Finds a better center for a click-selected line
@@ -447,8 +577,7 @@ class WavelengthCalibration(object):
         """
         if data_name == 'reference':
             pseudo_center = np.argmin(abs(self.reference_solution[0] - x_data))
-            reference_line_index = np.argmin(abs(self.reference_data.get_line_list_by_name(self.lamp_name) - x_data))
-            reference_line_value = self.reference_data.get_line_list_by_name(self.lamp_name)[reference_line_index]
+            reference_line_value = self.reference_data.get_closest_lines(self.lamp_name, [x_data])[0]
             sub_x = self.reference_solution[0][pseudo_center - 10: pseudo_center + 10]
             sub_y = self.reference_solution[1][pseudo_center - 10: pseudo_center + 10]
             center_of_mass = np.sum(sub_x * sub_y) / np.sum(sub_y)
@@ -514,17 +643,331 @@ class WavelengthCalibration(object):
                                                                 + np.arctan((pixel * binning - 2048) * 0.015 / 377.2)))
         return wavelength
 
-    def automatic_wavelength_solution(self):
-        """Automatic Wavelength Solution NotImplemented
+    def automatic_wavelength_solution(self, prior=None):
+        """Finds the wavelength solution without user interaction
+
+        The grating equation (see get_spectral_characteristics and predicted_wavelength) gives a first pixel to
+        wavelength relation that is off by up to some tens of Angstrom, and by a different amount at each end of the
+        spectrum. The lamp is cross correlated with a reference spectrum, the reference lamp of the same elements when
+        there is one in the reference directory or else a spectrum built from the reference line list, first as a
+        whole and then in segments, which gives a smooth correction of the grating equation (see
+        get_prior_correction). The first identification of the detected lines (get_lines_in_lamp) is the consensus of
+        all the reference lines within tolerance (see wsbuilder.WavelengthFitter.ransac_fit), then they are matched
+        to the closest reference lines and a Chebyshev of third degree is fitted with wsbuilder.WavelengthFitter, the
+        same model the interactive mode uses. Matching and fitting are repeated with a tolerance that shrinks with the
+        residuals and outliers are rejected by the sigma clipping of the fitter.
+
+        The solution is evaluated the same way as in the interactive mode, see evaluate_solution.
+
+        Args:
+            prior (array): Approximate wavelength of every pixel, e.g. a stored solution of a previous night (see
+                use_stored_solution). If given it replaces the corrected grating equation.
+
+        Returns:
+            wsolution (object): The fitted model, also stored in self.wsolution. None if there were not enough matched
+                lines.
+
+        """
+        self.wsolution = None
+        pixel_axis = np.array(self.raw_pixel_axis, dtype=float)
+        lines_center = np.array(self.lines_center, dtype=float)
+        reference_lines = self.reference_data.get_line_array(self.lamp_name)
+        if len(lines_center) < self.automatic_min_lines or len(reference_lines) < self.automatic_min_lines:
+            log.error('Not enough lines for an automatic wavelength solution of %s', self.lamp_name)
+            return None
+
+        if prior is None:
+            prior = self.predicted_wavelength(pixel_axis)
+            correction = self.get_prior_correction(prior)
+            if correction is None:
+                log.error('The lamp %s does not correlate with its reference', self.lamp_name)
+                return None
+            prior = prior + correction
+
+        wavelengths = np.interp(lines_center, pixel_axis, prior)
+        dispersion = abs(np.median(np.diff(prior)))
+        tolerance = self.automatic_tolerance * dispersion
+        wavelength_fitter = wsbuilder.WavelengthFitter(model='chebyshev', degree=3, sigma=3., iterations=3)
+        # blends and wrong identifications are sorted out by the consensus of all the reference lines within tolerance
+        pixels, angstroms = self.get_candidate_lines(lines_center, wavelengths, reference_lines, tolerance)
+        wsolution, inliers = wavelength_fitter.ransac_fit(pixels,
+                                                          angstroms,
+                                                          dispersion,
+                                                          n_trials=self.automatic_ransac_trials,
+                                                          random_state=np.random.RandomState(0))
+        if wsolution is not None and np.count_nonzero(inliers) >= self.automatic_min_lines:
+            wavelengths = wsolution(lines_center)
+        for iteration in range(self.automatic_iterations):
+            pixels, angstroms = self.match_lines(lines_center, wavelengths, reference_lines, tolerance)
+            if len(pixels) < self.automatic_min_lines:
+                log.error('Only %s lines of %s could be matched to the reference', len(pixels), self.lamp_name)
+                return None
+            wsolution = wavelength_fitter.ws_fit(pixels, angstroms)
+            if wsolution is None:
+                return None
+            good = wavelength_fitter.mask
+            rms = np.sqrt(np.mean((angstroms[good] - wsolution(pixels[good])) ** 2))
+            log.debug('Iteration %s: %s lines matched, RMS %.3f Angstrom', iteration + 1, len(pixels), rms)
+            wavelengths = wsolution(lines_center)
+            tolerance = min(tolerance, max(3 * rms, abs(np.median(np.diff(prior)))))
+
+        self.wsolution = wsolution
+        rms_error, n_points, n_rejections = self.evaluate_solution()
+        log.info('Automatic Wavelength Solution: RMSE = %s Npoints = %s, NRej = %s', rms_error, n_points, n_rejections)
+        return self.wsolution
+
+    def get_prior_correction(self, prior, n_segments=10):
+        """Correction of the grating equation from the cross correlation with a reference spectrum
+
+        The lamp is resampled to a linear wavelength grid using the grating equation. The offset of the whole lamp
+        with respect to the reference spectrum is searched within automatic_max_shift, then the offset of every segment
+        of the lamp is searched within a quarter of that range around it. The error of the grating equation changes
+        along the spectrum, a second order polynomial is fitted to the offsets of the segments that correlate.
+
+        Args:
+            prior (array): Wavelength of every pixel according to the grating equation.
+            n_segments (int): Number of segments.
+
+        Returns:
+            correction (array): Angstrom to add to prior for every pixel. None if the lamp does not correlate.
+
+        """
+        dispersion = abs(np.median(np.diff(prior)))
+        order = np.argsort(prior)
+        grid = np.arange(np.min(prior), np.max(prior), dispersion)
+        lamp = np.interp(grid, prior[order], np.asarray(self.lamp_data, dtype=float)[order])
+        # only the lines matter, the square root keeps the brightest lines from dominating
+        lamp = np.sqrt(np.maximum(lamp - np.median(lamp), 0))
+
+        max_lag = int(self.automatic_max_shift / dispersion)
+        ref_grid = np.arange(-max_lag, len(grid) + max_lag) * dispersion + grid[0]
+        reference = self.get_reference_spectrum(ref_grid, dispersion)
+        shift = self.get_correlation_shift(lamp, reference)
+        if shift is None:
+            return None
+
+        # lamp[i] matches reference[i + shift], the segments are searched within a quarter of the maximum shift
+        lag = max(int(max_lag / 4), 1)
+        centers = []
+        offsets = []
+        edges = np.linspace(0, len(grid), n_segments + 1).astype(int)
+        for start, stop in zip(edges[:-1], edges[1:]):
+            first = max(int(round(start + shift)) - lag, 0)
+            last = min(int(round(stop + shift)) + lag, len(reference))
+            segment_shift = self.get_correlation_shift(lamp[start:stop], reference[first:last])
+            if segment_shift is not None:
+                centers.append(grid[int((start + stop) / 2)])
+                offsets.append((first + segment_shift - start - max_lag) * dispersion)
+        if len(offsets) < 4:
+            return np.ones(len(prior)) * (shift - max_lag) * dispersion
+        centers = np.array(centers)
+        offsets = np.array(offsets)
+        good = ~np.ma.getmaskarray(sigma_clip(offsets - np.polyval(np.polyfit(centers, offsets, 2), centers),
+                                              sigma=3, iters=1))
+        coefficients = np.polyfit(centers[good], offsets[good], 2)
+        log.debug('Correction of the grating equation: %s', coefficients)
+        return np.polyval(coefficients, prior)
+
+    def get_reference_spectrum(self, grid, dispersion):
+        """Reference lamp of the same elements sampled on a wavelength grid
+
+        Uses the reference lamp from the reference directory when there is one, otherwise a synthetic spectrum of the
+        reference lines with the width of the lines of the lamp, see ReferenceData.get_ref_spectrum_from_linelist.
+
+        Args:
+            grid (array): Wavelength of every sample, linear.
+            dispersion (float): Angstrom per pixel of the lamp.
+
+        Returns:
+            reference (array): Reference spectrum, without continuum.
+
+        """
+        reference_file = self.reference_data.get_reference_lamps_by_name(self.lamp_name)
+        if reference_file is not None and os.path.isfile(reference_file):
+            log.debug('Using reference file: %s', reference_file)
+            ref_data = fits.getdata(reference_file)
+            ref_header = fits.getheader(reference_file)
+            ref_wavelength, ref_flux = wsbuilder.ReadWavelengthSolution(ref_header, ref_data)()
+            reference = np.interp(grid, np.asarray(ref_wavelength, dtype=float), np.asarray(ref_flux, dtype=float),
+                                  left=0, right=0)
+            return np.sqrt(np.maximum(reference - np.median(reference[reference > 0]), 0))
+        fwhm = self.get_line_fwhm(self.lamp_data, np.asarray(self.lines_center) - 1) * dispersion
+        log.debug('Using synthetic reference spectrum, FWHM %.2f Angstrom', fwhm)
+        synthetic = self.reference_data.get_ref_spectrum_from_linelist(grid[0], grid[-1], self.lamp_name,
+                                                                       sampling=dispersion, fwhm=fwhm)
+        if synthetic is None:
+            return np.zeros(len(grid))
+        reference = np.interp(grid, synthetic[0], synthetic[1], left=0, right=0)
+        return np.sqrt(reference)
+
+    @staticmethod
+    def get_line_fwhm(data, lines, default=2., half_window=10):
+        """Typical FWHM of the lines of a lamp
+
+        Args:
+            data (array): Lamp.
+            lines (list): Index of the maximum of every line, starting at zero, rounded to the closest pixel.
+            default (float): Returned when no line can be measured.
+            half_window (int): Pixels at each side of a line where its width is measured.
+
+        Returns:
+            fwhm (float): Median number of contiguous pixels above half of the height of the lines, at least one.
+
+        """
+        data = np.asarray(data, dtype=float)
+        lines = np.round(np.asarray(lines, dtype=float)).astype(int)
+        lines = lines[(lines >= half_window) & (lines < len(data) - half_window)]
+        if len(lines) == 0:
+            return default
+        background = np.median(data)
+        windows = data[lines[:, np.newaxis] + np.arange(-half_window, half_window + 1)[np.newaxis, :]]
+        above = windows > (background + 0.5 * (windows[:, half_window] - background))[:, np.newaxis]
+        # pixels above half maximum that are contiguous with the maximum, at each side
+        right = np.sum(np.cumprod(above[:, half_window:], axis=1), axis=1)
+        left = np.sum(np.cumprod(above[:, half_window::-1], axis=1), axis=1)
+        widths = (left + right - 1)[windows[:, half_window] > background]
+        if len(widths) == 0:
+            return default
+        return max(float(np.median(widths)), 1.)
+
+    @staticmethod
+    def get_correlation_shift(data, reference):
+        """Shift of data within a longer reference that maximizes their cross correlation
+
+        Args:
+            data (array): Spectrum.
+            reference (array): Spectrum on the same sampling, longer than data.
+
+        Returns:
+            shift (float): Sub-sample shift, data[i] matches reference[i + shift]. None if either is empty.
+
+        """
+        if not np.any(data > 0) or not np.any(reference > 0) or len(reference) < len(data):
+            return None
+        correlation = signal.fftconvolve(reference, data[::-1], mode='valid')
+        peak = int(np.argmax(correlation))
+        if len(correlation) > 1 and (peak == 0 or peak == len(correlation) - 1):
+            # the maximum is outside of the searched range
+            return None
+        shift = float(peak)
+        if len(correlation) > 2:
+            left, center, right = correlation[peak - 1:peak + 2]
+            curvature = left - 2 * center + right
+            if curvature < 0:
+                shift += 0.5 * (left - right) / curvature
+        return shift
+
+    @staticmethod
+    def get_candidate_lines(lines_center, wavelengths, reference_lines, tolerance):
+        """Every reference line that could be each detected line
+
+        Args:
+            lines_center (array): Pixel value of the detected lines.
+            wavelengths (array): Current estimate of the wavelength of the detected lines.
+            reference_lines (array): Laboratory wavelength of the lines of the lamp, sorted.
+            tolerance (float): Maximum difference in Angstrom.
+
+        Returns:
+            pixels (array): Pixel value of the detected line of every candidate.
+            angstroms (array): Reference wavelength of every candidate.
+
+        """
+        reference_lines = np.asarray(reference_lines)
+        first = np.searchsorted(reference_lines, np.asarray(wavelengths) - tolerance, side='left')
+        last = np.searchsorted(reference_lines, np.asarray(wavelengths) + tolerance, side='right')
+        counts = last - first
+        # position of every candidate within the reference lines of its detected line
+        offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(np.asarray(lines_center), counts), reference_lines[np.repeat(first, counts) + offsets]
+
+    @staticmethod
+    def match_lines(lines_center, wavelengths, reference_lines, tolerance):
+        """Pairs detected lines with the closest reference line
+
+        Each reference line is used at most once, by the detected line closest to it.
 
-        Raises:
-            NotImplemented
+        Args:
+            lines_center (array): Pixel value of the detected lines.
+            wavelengths (array): Current estimate of the wavelength of the detected lines.
+            reference_lines (array): Laboratory wavelength of the lines of the lamp, sorted.
+            tolerance (float): Maximum difference in Angstrom.
+
+        Returns:
+            pixels (array): Pixel value of the matched lines.
+            angstroms (array): Reference wavelength of the matched lines.
 
         """
-        # needs:
-        #   - self.sci, self.header
-        #   - self.lines_center
-        raise NotImplemented
+        reference_lines = np.asarray(reference_lines)
+        closest = get_closest_index(reference_lines, wavelengths)
+        closest_distance = np.abs(reference_lines[closest] - wavelengths)
+        matched = closest_distance <= tolerance
+        # a reference line claimed by several detected lines goes to the closest one
+        for reference_index in np.unique(closest[matched]):
+            claims = np.nonzero(matched & (closest == reference_index))[0]
+            if len(claims) > 1:
+                matched[claims] = False
+                matched[claims[np.argmin(closest_distance[claims])]] = True
+        return np.asarray(lines_center)[matched], reference_lines[closest[matched]]
+
+    def use_stored_solution(self):
+        """Looks for a solution of a previous night with the same instrument configuration
+
+        The stored solution closest in time is shifted by the drift of the lamp on the detector. When the drift is
+        below the limit of the store and the shifted solution fits the lines of this lamp as well as it fitted its own
+        it is used directly and stored in self.wsolution, together with its evaluation comment in
+        self.evaluation_comment, otherwise it only seeds the automatic solution.
+
+        Returns:
+            prior (array): Wavelength of every pixel according to the stored solution when it can not be used
+                directly. None if it was used directly or if there is no suitable solution.
+
+        """
+        features = WavelengthSolution.set_spectral_features(self.lamp_header)
+        stored = self.solution_store.find(self.lamp_header,
+                                          self.lamp_data,
+                                          lambda stored_features: WavelengthSolution.compare_spectral_features(
+                                              stored_features, features))
+        if stored is None:
+            log.info('There is no stored solution for this configuration')
+            return None
+        model, drift, entry = stored
+        if abs(drift) <= self.solution_store.max_drift:
+            self.wsolution = model
+            rms_error, n_points, n_rejections = self.evaluate_solution()
+            if self.solution_store.accepts(entry, rms_error):
+                log.info('Using stored solution of %s: RMSE = %s Npoints = %s, NRej = %s',
+                         entry['date'],
+                         rms_error,
+                         n_points,
+                         n_rejections)
+                self.evaluation_comment = entry.get('evaluation_comment')
+                return None
+            log.warning('Stored solution of %s does not fit this lamp, RMSE %s instead of %s',
+                        entry['date'],
+                        rms_error,
+                        entry['rms_error'])
+            self.wsolution = None
+            self.rms_error = None
+        else:
+            log.info('Lamp drifted %.1f pixels since %s, the stored solution is used as first guess',
+                     drift,
+                     entry['date'])
+        return model(np.array(self.raw_pixel_axis, dtype=float))
+
+    def store_solution(self):
+        """Adds the current solution to the solution store"""
+        rms_error = self.evaluate_solution()[0]
+        features = WavelengthSolution.set_spectral_features(self.lamp_header)
+        self.solution_store.add(self.lamp_header,
+                                self.lamp_data,
+                                self.wsolution,
+                                features,
+                                lambda stored_features: WavelengthSolution.compare_spectral_features(
+                                    stored_features, features),
+                                lamp_name=self.lamp_name,
+                                reference_lamp=self.calibration_lamp,
+                                rms_error=rms_error,
+                                evaluation_comment=self.evaluation_comment)
 
     def interactive_wavelength_solution(self):
         """Find the wavelength solution interactively
@@ -572,8 +1015,19 @@ class WavelengthCalibration(object):
             fits_ws_reader = wsbuilder.ReadWavelengthSolution(ref_header, ref_data)
             self.reference_solution = fits_ws_reader()
         else:
-            reference_plots_enabled = False
-            log.error('Please Check the OBJECT Keyword of your reference data')
+            dispersion = abs(self.red_limit - self.blue_limit) / len(self.lamp_data)
+            self.reference_solution = self.reference_data.get_ref_spectrum_from_linelist(
+                self.blue_limit,
+                self.red_limit,
+                self.lamp_name,
+                sampling=dispersion,
+                fwhm=self.get_line_fwhm(self.lamp_data, np.asarray(self.lines_center) - 1) * dispersion)
+            if self.reference_solution is not None:
+                log.info('No reference file for %s, using a synthetic reference spectrum', self.lamp_name)
+                reference_plots_enabled = True
+            else:
+                reference_plots_enabled = False
+                log.error('Please Check the OBJECT Keyword of your reference data')
 
         # ------- Plots -------
         self.i_fig, ((self.ax1, self.ax2), (self.ax3, self.ax4)) = plt.subplots(2,
@@ -878,15 +1332,10 @@ class WavelengthCalibration(object):
         square_differences = []
         if self.wsolution is not None:
             wlines = self.wsolution(self.lines_center)
-            for i in range(len(wlines)):
-                # [abs(list_val - wlines[i]) for list_val in self.reference_data.get_line_list_by_name(self.lamp_name)]
-                closer_index = np.argmin(abs(self.reference_data.get_line_list_by_name(self.lamp_name) - wlines[i]))
-                rline = self.reference_data.get_line_list_by_name(self.lamp_name)[closer_index]
-                rw_difference = wlines[i] - rline
-                # print('Difference w - r ', rw_difference, rline)
-                square_differences.append(rw_difference ** 2)
-                new_physical.append(self.lines_center[i])
-                new_wavelength.append(rline)
+            rlines = self.reference_data.get_closest_lines(self.lamp_name, wlines)
+            square_differences = list((wlines - rlines) ** 2)
+            new_physical = list(self.lines_center)
+            new_wavelength = list(rlines)
             clipped_differences = sigma_clip(square_differences, sigma=2, iters=3)
             if len(new_wavelength) == len(new_physical) == len(clipped_differences):
                 for i in range(len(new_wavelength)):
@@ -992,15 +1441,9 @@ class WavelengthCalibration(object):
 
         """
         if self.wsolution is not None:
-            differences = np.array([])
             wavelength_line_centers = self.wsolution(self.lines_center)
-
-            for wline in wavelength_line_centers:
-                closer_index = np.argmin(abs(self.reference_data.get_line_list_by_name(self.lamp_name) - wline))
-                rline = self.reference_data.get_line_list_by_name(self.lamp_name)[closer_index]
-                rw_difference = wline - rline
-                # print 'Difference w - r ', rw_difference, rline
-                differences = np.append(differences, rw_difference)
+            differences = wavelength_line_centers - self.reference_data.get_closest_lines(self.lamp_name,
+                                                                                        wavelength_line_centers)
 
             clipping_sigma = 2.
             # print(differences)
@@ -1130,28 +1573,28 @@ class WavelengthCalibration(object):
         """Produces a linearized version of the spectrum
 
         Storing wavelength solutions in a FITS header is not simple at all for non-linear solutions therefore is easier
-        for the final user and for the development code to have the spectrum linearized. It first finds a spline
-        representation of the data, then creates a linear wavelength axis (angstrom) and finally it resamples the data
-        from the spline representation to the linear wavelength axis.
+        for the final user and for the development code to have the spectrum linearized. It creates a linear wavelength
+        axis (angstrom) and resamples the data to it with the method selected by the --resampling argument, see
+        goodman_spec.resampling. The resampling depends only on the wavelength solution and the number of pixels, it is
+        computed once and applied to all the spectra.
 
-        It also applies a median filter of kernel size three to smooth the linearized spectrum. Sometimes the splines
-        produce funny things when the original data is too steep.
+        The default method finds a spline representation of the data, resamples the spline and applies a median filter
+        of kernel size three to smooth the linearized spectrum. Sometimes the splines produce funny things when the
+        original data is too steep.
 
         Args:
-            data (Array): The non-linear spectrum
+            data (Array): The non-linear spectrum, or one spectrum per row
             plots (bool): Whether to show the plots or not
 
         Returns:
-            linear_data (list): Contains two elements: Linear wavelength axis and the smoothed linearized data itself.
+            linear_data (list): Contains two elements: Linear wavelength axis and the linearized data itself.
 
         """
-        pixel_axis = range(1, len(data) + 1, 1)
         if self.wsolution is not None:
-            x_axis = self.wsolution(pixel_axis)
-            new_x_axis = np.linspace(x_axis[0], x_axis[-1], len(data))
-            tck = scipy.interpolate.splrep(x_axis, data, s=0)
-            linearized_data = scipy.interpolate.splev(new_x_axis, tck, der=0)
-            smoothed_linearized_data = signal.medfilt(linearized_data)
+            resampler = resampling.get_resampler(self.wsolution, np.shape(data)[-1], self.args.resampling)
+            x_axis = resampler.wavelength
+            new_x_axis = resampler.new_wavelength
+            linearized_data = resampler(data)
             if plots:
                 fig6 = plt.figure(6)
                 plt.xlabel('Wavelength (Angstrom)')
@@ -1159,7 +1602,6 @@ class WavelengthCalibration(object):
                 fig6.canvas.set_window_title('Linearized Data')
                 plt.plot(x_axis, data, color='k', label='Data')
                 plt.plot(new_x_axis, linearized_data, color='r', linestyle=':', label='Linearized Data')
-                plt.plot(new_x_axis, smoothed_linearized_data, color='m', alpha=0.5, label='Smoothed Linearized Data')
                 plt.tight_layout()
                 plt.legend(loc=3)
                 plt.show()
@@ -1173,14 +1615,14 @@ class WavelengthCalibration(object):
                 plt.legend(loc=3)
                 plt.show()
 
-            linear_data = [new_x_axis, smoothed_linearized_data]
+            linear_data = [new_x_axis, linearized_data]
             return linear_data
 
     def add_wavelength_solution(self, new_header, spectrum, original_filename, evaluation_comment=None, index=None):
         """Add wavelength solution to the new FITS header
 
         Defines FITS header keyword values that will represent the wavelength solution in the header so that the image
-        can be read in any other astronomical tool. (e.g. IRAF)
+        can be read in any other astronomical tool. (e.g. IRAF), see set_wavelength_solution_header.
 
         Notes:
             This method also saves the data to a new FITS file, This should be in separated methods to have more control
@@ -1197,32 +1639,7 @@ class WavelengthCalibration(object):
             new_header (object): An Astropy header object. Although not necessary since there is no further processing
 
         """
-        if evaluation_comment is None:
-            rms_error, n_points, n_rejections = self.evaluate_solution()
-            self.evaluation_comment = 'Lamp Solution RMSE = %s Npoints = %s, NRej = %s' % (rms_error,
-                                                                                           n_points,
-                                                                                           n_rejections)
-            new_header['HISTORY'] = self.evaluation_comment
-        else:
-            new_header['HISTORY'] = evaluation_comment
-
-        new_crpix = 1
-        new_crval = spectrum[0][new_crpix - 1]
-        new_cdelt = spectrum[0][new_crpix] - spectrum[0][new_crpix - 1]
-
-        new_header['BANDID1'] = 'spectrum - background none, weights none, clean no'
-        # new_header['APNUM1'] = '1 1 1452.06 1454.87'
-        new_header['WCSDIM'] = 1
-        new_header['CTYPE1'] = 'LINEAR  '
-        new_header['CRVAL1'] = new_crval
-        new_header['CRPIX1'] = new_crpix
-        new_header['CDELT1'] = new_cdelt
-        new_header['CD1_1'] = new_cdelt
-        new_header['LTM1_1'] = 1.
-        new_header['WAT0_001'] = 'system=equispec'
-        new_header['WAT1_001'] = 'wtype=linear label=Wavelength units=angstroms'
-        new_header['DC-FLAG'] = 0
-        new_header['DCLOG1'] = 'REFSPEC1 = %s' % self.calibration_lamp
+        new_header = self.set_wavelength_solution_header(new_header, spectrum, evaluation_comment)
 
         # print(new_header['APNUM*'])
         if index is None:
@@ -1242,6 +1659,53 @@ class WavelengthCalibration(object):
         # print new_header
         return new_header
 
+    def set_wavelength_solution_header(self, new_header, spectrum, evaluation_comment=None):
+        """Writes the wavelength solution keywords to a FITS header
+
+        The solution is linear unless the spectra are not resampled (--resampling none), then the non-linear solution
+        is written in the IRAF multispec format.
+
+        Args:
+            new_header (object): An Astropy header object
+            spectrum (Array): Linear wavelength axis and the processed data
+            evaluation_comment (str): A comment with information regarding the quality of the wavelength solution
+
+        Returns:
+            new_header (object): The same header
+
+        """
+        if evaluation_comment is None:
+            rms_error, n_points, n_rejections = self.evaluate_solution()
+            self.evaluation_comment = 'Lamp Solution RMSE = %s Npoints = %s, NRej = %s' % (rms_error,
+                                                                                           n_points,
+                                                                                           n_rejections)
+            new_header['HISTORY'] = self.evaluation_comment
+        else:
+            new_header['HISTORY'] = evaluation_comment
+
+        new_header['BANDID1'] = 'spectrum - background none, weights none, clean no'
+        # new_header['APNUM1'] = '1 1 1452.06 1454.87'
+        if self.args.resampling == 'none':
+            # the spectrum keeps its pixels, the solution itself goes to the header
+            new_header = wsbuilder.add_multispec_solution(new_header, self.wsolution, len(spectrum[1]))
+        else:
+            new_crpix = 1
+            new_crval = spectrum[0][new_crpix - 1]
+            new_cdelt = spectrum[0][new_crpix] - spectrum[0][new_crpix - 1]
+
+            new_header['WCSDIM'] = 1
+            new_header['CTYPE1'] = 'LINEAR  '
+            new_header['CRVAL1'] = new_crval
+            new_header['CRPIX1'] = new_crpix
+            new_header['CDELT1'] = new_cdelt
+            new_header['CD1_1'] = new_cdelt
+            new_header['LTM1_1'] = 1.
+            new_header['WAT0_001'] = 'system=equispec'
+            new_header['WAT1_001'] = 'wtype=linear label=Wavelength units=angstroms'
+            new_header['DC-FLAG'] = 0
+        new_header['DCLOG1'] = 'REFSPEC1 = %s' % self.calibration_lamp
+        return new_header
+
     def display_onscreen_message(self, message='', color='red'):
         """Uses the fourth subplot to display a message
 
@@ -1448,44 +1912,60 @@ class WavelengthSolution(object):
 
         """
         if header is not None:
-            new_dict = self.set_spectral_features(header)
-            for key in new_dict.keys():
-                if self.spectral_dict['camera'] == 'red':
-                    if key in ['grating', 'roi', 'instconf', 'wavmode'] and new_dict[key] != self.spectral_dict[key]:
-                        log.debug('Keyword: %s does not Match', key.upper())
-                        log.info('%s - Solution: %s - New Data: %s', key.upper(), self.spectral_dict[key], new_dict[key])
-                        return False
-                    elif key in ['cam_ang',  'grt_ang'] and abs(new_dict[key] - self.spectral_dict[key]) > 1:
-                        log.debug('Keyword: %s Lamp: %s Data: %s',
-                                  key,
-                                  self.spectral_dict[key],
-                                  new_dict[key])
-                        log.info('Solution belong to a different Instrument Configuration.')
-                        return False
-                    # else:
-                    #     return True
-                elif self.spectral_dict['camera'] == 'blue':
-                    if key in ['grating', 'ccdsum', 'serial_bin', 'parallel_bin']and new_dict[key] != self.spectral_dict[key]:
-                        log.debug('Keyword: %s does not Match', key.upper())
-                        log.info('%s - Solution: %s - New Data: %s',
-                                 key.upper(),
-                                 self.spectral_dict[key],
-                                 new_dict[key])
-                        return False
-                    elif key in ['cam_ang',  'grt_ang'] and abs(float(new_dict[key]) - float(self.spectral_dict[key])) > 1:
-                        log.debug('Keyword: %s Lamp: %s Data: %s',
-                                  key,
-                                  self.spectral_dict[key],
-                                  new_dict[key])
-                        log.info('Solution belong to a different Instrument Configuration.')
-                        return False
-                    # else:
-                    #     return True
-            return True
+            return self.compare_spectral_features(self.spectral_dict, self.set_spectral_features(header))
         else:
             log.error('Header has not been parsed')
             return False
 
+    @staticmethod
+    def compare_spectral_features(spectral_dict, new_dict):
+        """Compares the instrument configuration of a solution with the one of new data
+
+        Args:
+            spectral_dict (dict): Spectral features of the solution, see set_spectral_features.
+            new_dict (dict): Spectral features of the new data.
+
+        Returns:
+            True or False
+
+        """
+        if spectral_dict['camera'] != new_dict['camera']:
+            log.debug('Solution and new data come from different cameras')
+            return False
+        for key in new_dict.keys():
+            if spectral_dict['camera'] == 'red':
+                if key in ['grating', 'roi', 'instconf', 'wavmode'] and new_dict[key] != spectral_dict[key]:
+                    log.debug('Keyword: %s does not Match', key.upper())
+                    log.info('%s - Solution: %s - New Data: %s', key.upper(), spectral_dict[key], new_dict[key])
+                    return False
+                elif key in ['cam_ang',  'grt_ang'] and abs(new_dict[key] - spectral_dict[key]) > 1:
+                    log.debug('Keyword: %s Lamp: %s Data: %s',
+                              key,
+                              spectral_dict[key],
+                              new_dict[key])
+                    log.info('Solution belong to a different Instrument Configuration.')
+                    return False
+                # else:
+                #     return True
+            elif spectral_dict['camera'] == 'blue':
+                if key in ['grating', 'ccdsum', 'serial_bin', 'parallel_bin']and new_dict[key] != spectral_dict[key]:
+                    log.debug('Keyword: %s does not Match', key.upper())
+                    log.info('%s - Solution: %s - New Data: %s',
+                             key.upper(),
+                             spectral_dict[key],
+                             new_dict[key])
+                    return False
+                elif key in ['cam_ang',  'grt_ang'] and abs(float(new_dict[key]) - float(spectral_dict[key])) > 1:
+                    log.debug('Keyword: %s Lamp: %s Data: %s',
+                              key,
+                              spectral_dict[key],
+                              new_dict[key])
+                    log.info('Solution belong to a different Instrument Configuration.')
+                    return False
+                # else:
+                #     return True
+        return True
+
     def linear_solution_string(self, header):
         pass
 
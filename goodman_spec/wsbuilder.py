@@ -6,62 +6,225 @@
 from __future__ import print_function
 import shlex
 import logging
+import numpy as np
 from astropy.modeling import models, fitting
-import matplotlib.pyplot as plt
 
 
 # log.basicConfig(level=log.DEBUG)
 log = logging.getLogger('redspec.wsbuilder')
 
+# number of characters of the value of every WAT keyword of IRAF
+WAT_CARD_LENGTH = 68
+
+# format of the numbers of multispec descriptions
+MULTISPEC_FORMAT = '%.15g'
+
 
 class WavelengthFitter(object):
-    """Contains methods to do pixel to angstrom fit"""
+    """Contains methods to do pixel to angstrom fit
+
+    Chebyshev, Legendre and linear models are linear in their parameters and are fitted with a direct linear least
+    squares solve (astropy's LinearLSQFitter), which is exact and takes a fraction of a millisecond. The polynomials are
+    fitted on the domain of the pixels given to ws_fit, which keeps the problem well conditioned for any degree.
+    Optionally the points that deviate more than sigma standard deviations are rejected and the model refitted, up to
+    iterations times.
+    """
 
-    def __init__(self, model='chebyshev', degree=3):
+    def __init__(self, model='chebyshev', degree=3, sigma=None, iterations=3):
         """Initializes the class
 
         Args:
-            model (str): Name of the model to fit, Chebyshev (default) or Linear
-            degree (int): Degree of the model. Only needed by Chebyshev model.
+            model (str): Name of the model to fit, Chebyshev (default), Legendre or Linear
+            degree (int): Degree of the model. Only needed by Chebyshev and Legendre models.
+            sigma (float): Rejection threshold in standard deviations of the residuals, None to fit all the points.
+            iterations (int): Maximum number of rejection and refit cycles.
         """
         self.model_name = model
         self.degree = degree
+        self.sigma = sigma
+        self.iterations = iterations
         self.model = None
         self.model_fit = None
+        self.mask = None
         self.model_constructor()
 
     def model_constructor(self):
         """Generates callable mathematical model
 
-        It can do chebyshev and linear model only but is easy to implement others.
+        It can do chebyshev, legendre and linear models but is easy to implement others.
         Chebyshev 3rd degree is by default since provided the best results for Goodman data.
         """
         if self.model_name == 'chebyshev':
             self.model = models.Chebyshev1D(degree=self.degree)
-            self.model_fit = fitting.LevMarLSQFitter()
+        elif self.model_name == 'legendre':
+            self.model = models.Legendre1D(degree=self.degree)
         elif self.model_name == 'linear':
             self.model = models.Linear1D()
-            self.model_fit = fitting.LinearLSQFitter()
-        # return model
+        else:
+            log.error('Unknown model: %s', self.model_name)
+            return
+        self.model_fit = fitting.LinearLSQFitter()
 
-    def ws_fit(self, physical, wavelength):
+    def ws_fit(self, physical, wavelength, weights=None):
         """Wavelength solution fit
 
         Takes a list of pixel values and its respective wavelength values to do a fit to
-        the mathematical model defined with the class.
+        the mathematical model defined with the class. The points used by the last fit are
+        stored in the mask attribute.
+
+        Args:
+            physical (list): Pixel values.
+            wavelength (list): Wavelength of every pixel value.
+            weights (list): Weight of every point, e.g. the inverse of the uncertainty of the wavelength.
 
         Returns:
             fitted_model (class): Fitted model
         """
-        if self.model and self.model_fit is not None:
+        if self.model is None or self.model_fit is None:
+            log.error('Either model or model fitter were not constructed')
+            return None
+        physical = np.asarray(physical, dtype=float)
+        wavelength = np.asarray(wavelength, dtype=float)
+        n_parameters = len(self.model.parameters)
+        if len(physical) < n_parameters:
+            log.info('Please add more data points.')
+            log.error('%s points can not constrain a model with %s parameters', len(physical), n_parameters)
+            return None
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+        if self.model_name == 'linear':
+            model = self.model.copy()
+        else:
+            model = self.model.__class__(degree=self.degree, domain=[np.min(physical), np.max(physical)])
+
+        self.mask = np.ones(len(physical), dtype=bool)
+        fitted_model = None
+        for iteration in range(self.iterations + 1):
             try:
-                fitted_model = self.model_fit(self.model, physical, wavelength)
-                return fitted_model
+                fitted_model = self.model_fit(model,
+                                              physical[self.mask],
+                                              wavelength[self.mask],
+                                              weights=None if weights is None else weights[self.mask])
             except TypeError as error:
                 log.info('Please add more data points.')
                 log.error('TypeError: %s', error)
-        else:
+                return None
+            if self.sigma is None or iteration == self.iterations:
+                break
+            residuals = wavelength - fitted_model(physical)
+            deviation = np.std(residuals[self.mask])
+            new_mask = np.abs(residuals - np.median(residuals[self.mask])) <= self.sigma * deviation
+            # the rejection never leaves less points than the model needs plus one to measure the residuals
+            if np.array_equal(new_mask, self.mask) or np.count_nonzero(new_mask) <= n_parameters:
+                break
+            self.mask = new_mask
+        return fitted_model
+
+    def get_basis(self, physical, domain):
+        """Design matrix of the model, the value of every basis function at every point
+
+        Args:
+            physical (array): Pixel values.
+            domain (list): Pixel range mapped to [-1, 1] for Chebyshev and Legendre models.
+
+        Returns:
+            basis (array): One row per point and one column per parameter.
+        """
+        if self.model_name == 'linear':
+            return np.polynomial.polynomial.polyvander(physical, 1)
+        mapped = 2. * (physical - domain[0]) / (domain[1] - domain[0]) - 1.
+        if self.model_name == 'legendre':
+            return np.polynomial.legendre.legvander(mapped, self.degree)
+        return np.polynomial.chebyshev.chebvander(mapped, self.degree)
+
+    def ransac_fit(self, physical, wavelength, tolerance, n_trials=2000, random_state=None, chunk_size=500):
+        """Wavelength solution from candidate line identifications that are mostly wrong
+
+        Every detected line can have several candidate wavelengths, blends and missing or wrong identifications are
+        allowed. Random subsets of as many candidates as the model has parameters, all of different lines, are solved
+        exactly at once, and the candidates of all the trial models are evaluated with array operations. Trials that
+        are not monotonic over the pixel range are discarded. The trial that agrees within tolerance with the largest
+        number of lines wins, its best candidate for every line is refitted with ws_fit, including its sigma clipping
+        if enabled, and the inliers are selected again with the refitted model.
+
+        Args:
+            physical (list): Pixel value of every candidate, the same pixel repeats for every candidate of a line.
+            wavelength (list): Candidate wavelength for the pixel.
+            tolerance (float): Largest difference in Angstrom between a model and an inlier.
+            n_trials (int): Number of random subsets.
+            random_state (object): numpy.random.RandomState, for repeatable results.
+            chunk_size (int): Trials evaluated together, limits the memory to chunk_size times the candidates.
+
+        Returns:
+            fitted_model (class): Fitted model, None if no trial is consistent with enough lines.
+            inliers (array): Boolean mask of the candidates that agree with the model, at most one per line.
+        """
+        if self.model is None:
             log.error('Either model or model fitter were not constructed')
+            return None, None
+        if random_state is None:
+            random_state = np.random.RandomState()
+        physical = np.asarray(physical, dtype=float)
+        wavelength = np.asarray(wavelength, dtype=float)
+        order = np.argsort(physical, kind='mergesort')
+        physical = physical[order]
+        wavelength = wavelength[order]
+        inliers = np.zeros(len(physical), dtype=bool)
+        n_parameters = len(self.model.parameters)
+        # every line is a group of consecutive candidates with the same pixel
+        lines, line_starts, line_index = np.unique(physical, return_index=True, return_inverse=True)
+        if len(lines) <= n_parameters:
+            log.error('%s lines can not constrain a model with %s parameters', len(lines), n_parameters)
+            return None, inliers
+        domain = [lines[0], lines[-1]]
+        basis = self.get_basis(physical, domain)
+        monotonic_basis = self.get_basis(np.linspace(domain[0], domain[1], 4 * n_parameters), domain)
+
+        best_score = n_parameters
+        best_coefficients = None
+        for first in range(0, n_trials, chunk_size):
+            samples = random_state.randint(0, len(physical), (min(chunk_size, n_trials - first), n_parameters))
+            sampled_lines = np.sort(line_index[samples], axis=1)
+            samples = samples[np.all(np.diff(sampled_lines, axis=1) > 0, axis=1)]
+            if len(samples) == 0:
+                continue
+            coefficients = np.linalg.solve(basis[samples], wavelength[samples][:, :, np.newaxis])[:, :, 0]
+            steps = np.diff(np.dot(monotonic_basis, coefficients.T), axis=0)
+            coefficients = coefficients[np.all(steps > 0, axis=0) | np.all(steps < 0, axis=0)]
+            if len(coefficients) == 0:
+                continue
+            matches = np.abs(wavelength[:, np.newaxis] - np.dot(basis, coefficients.T)) <= tolerance
+            # a line counts once, no matter how many of its candidates match
+            scores = np.sum(np.logical_or.reduceat(matches, line_starts, axis=0), axis=0)
+            if np.max(scores) > best_score:
+                best_score = np.max(scores)
+                best_coefficients = coefficients[np.argmax(scores)]
+        if best_coefficients is None:
+            log.error('No model agrees with more than %s lines', n_parameters)
+            return None, inliers
+
+        predicted = np.dot(basis, best_coefficients)
+        for iteration in range(2):
+            candidates = self._closest_candidates(np.abs(wavelength - predicted), line_starts, tolerance)
+            fitted_model = self.ws_fit(physical[candidates], wavelength[candidates])
+            if fitted_model is None:
+                return None, inliers
+            predicted = fitted_model(physical)
+        candidates = self._closest_candidates(np.abs(wavelength - predicted), line_starts, tolerance)
+        inliers[order[candidates]] = True
+        log.debug('RANSAC model agrees with %s of %s lines', len(candidates), len(lines))
+        return fitted_model, inliers
+
+    @staticmethod
+    def _closest_candidates(distance, line_starts, tolerance):
+        """Index of the closest candidate of every line, only for the lines with a candidate within tolerance"""
+        line_ends = np.append(line_starts[1:], len(distance))
+        closest = np.minimum.reduceat(distance, line_starts)
+        # first candidate of every line that reaches the minimum distance
+        is_closest = distance == np.repeat(closest, line_ends - line_starts)
+        first = np.searchsorted(np.nonzero(is_closest)[0], line_starts)
+        candidates = np.nonzero(is_closest)[0][first]
+        return candidates[closest <= tolerance]
 
 
 class ReadWavelengthSolution(object):
@@ -74,6 +237,7 @@ class ReadWavelengthSolution(object):
         self.wat_wcs_dict = dict()
         self.wcs_dict = dict()
         self.wave_intens = []
+        self.solution = None
 
     def __call__(self):
         """call method
@@ -97,109 +261,35 @@ class ReadWavelengthSolution(object):
         return self.wave_intens
 
     def non_linear_solution(self, dimension):
-        """Non linear solutions reader
+        """Multispec solutions reader
 
-        Notes:
-            Not all kind of non-linear solutions are implemented
+        The WAT keywords of every dimension are joined, IRAF splits them in values of WAT_CARD_LENGTH characters, and
+        the solution is built when the description of the first aperture, spec1, is found. See parse_multispec for the
+        format.
 
         Args:
             dimension (int): Solutions can be multi-dimensionals, this method is called for each one of them.
 
         Returns:
+            solution (object): Callable wavelength solution, None if this dimension does not describe it.
 
         """
-        header = self.header
-        ctypen = header['CTYPE%s' % dimension]
-        if ctypen == 'MULTISPE':
-            wat_head = header['WAT%s*' % dimension]
-            if len(wat_head) == 1:
-                print('Get units')
-                wat_array = wat_head[0].split(' ')
-                for pair in wat_array:
-                    split_pair = pair.split('=')
-                    self.wat_wcs_dict[split_pair[0]] = split_pair[1]
-                    # print(wat_head[0].split(' '))
-            elif len(wat_head) > 1:
-                wat_string = ''
-                for key in wat_head:
-                    wat_string += header[key]
-                wat_array = shlex.split(wat_string.replace('=', ' '))
-                if len(wat_array) % 2 == 0:
-                    for i in range(0, len(wat_array), 2):
-                        # if wat_array[i] not in self.wcs_dict.keys():
-                        self.wat_wcs_dict[wat_array[i]] = wat_array[i + 1]
-                        print(wat_array[i], wat_array[i + 1])
+        wat_head = self.header['WAT%s_*' % dimension]
+        # FITS readers drop the trailing blanks of every value, they are part of the IRAF string
+        wat_string = ''.join([str(wat_head[key]).ljust(WAT_CARD_LENGTH) for key in sorted(wat_head.keys())])
+        wat_array = shlex.split(wat_string.replace('=', ' '))
+        for i in range(0, len(wat_array) - 1, 2):
+            self.wat_wcs_dict[wat_array[i]] = wat_array[i + 1]
 
         for key in self.wat_wcs_dict.keys():
             log.debug("%s -%s- %s", dimension, key, self.wat_wcs_dict[key])
         if 'spec1' in self.wat_wcs_dict.keys():
-            print(self.wat_wcs_dict['spec1'])
-            spec = self.wat_wcs_dict['spec1'].split()
-            aperture = int(spec[0])
-            beam = int(spec[1])
-            disp_type = int(spec[2])
-            disp_start = float(spec[3])
-            disp_del_av = float(spec[4])
-            pix_num = int(spec[5])
-            dopp_fact = float(spec[6])
-            aper_low = int(float(spec[7]))
-            aper_high = int(float(spec[8]))
-            weight = float(spec[9])
-            zeropoint = float(spec[10])
-            function_type = spec[11]
-            order = int(float(spec[12]))
-            min_pix_val = int(float(spec[13]))
-            max_pix_val = int(float(spec[14]))
-            # resto = list(spec[9:])
-            params = [float(i) for i in spec[15:]]
-            self.wcs_dict = {'aperture': aperture,
-                             'beam': beam,
-                             'dtype': disp_type,
-                             'dstart': disp_start,
-                             'avdelt': disp_del_av,
-                             'pnum': pix_num,
-                             'z': dopp_fact,
-                             'alow': aper_low,
-                             'ahigh': aper_high,
-                             'weight': weight,
-                             'zeropoint': zeropoint,
-                             'ftype': function_type,
-                             'order': order,
-                             'pmin': min_pix_val,
-                             'pmax': max_pix_val,
-                             'fpar': params}
-
-            function = ReadMathFunctions(self.wcs_dict)
-            solution = function.get_solution()
-            # print(solution)
-            # print("%s %s" % (params, len(params)))
-            wav1 = [4545.0519,
-                    4579.3495,
-                    4589.8978,
-                    4609.5673,
-                    4726.8683,
-                    4735.9058,
-                    4764.8646,
-                    4806.0205,
-                    4847.8095,
-                    5495.8738,
-                    5506.1128,
-                    5558.702,
-                    5572.5413,
-                    5606.733,
-                    5650.7043]
-            # data = fits.getdata('/data/simon/data/soar/work/goodman/test/extraction-tests/cuhear600nonlinearli.fits')
-            x_axis = range(1, len(self.data) + 1)
-            # x0 = range(len(self.data))
-            # print('x data', x_axis[0], x_axis[-1], len(self.data))
-            plt.title(self.header['OBJECT'])
-            plt.xlabel("%s (%s)" % (self.wat_wcs_dict['label'], self.wat_wcs_dict['units']))
-            plt.plot(solution(x_axis), self.data)
-            # plt.plot(solution(x0), self.data, color='g')
-            for line in wav1:
-                plt.axvline(line, color='r')
-            plt.show()
-            print(spec)
+            self.wcs_dict = parse_multispec(self.wat_wcs_dict['spec1'])
+            self.solution = ReadMathFunctions(self.wcs_dict).get_solution()
+            if self.solution is not None:
+                x_axis = np.arange(1, len(self.data) + 1)
+                self.wave_intens = [self.solution(x_axis), self.data]
+            return self.solution
 
     def linear_solution(self):
         """Linear solution reader
@@ -224,11 +314,17 @@ class ReadWavelengthSolution(object):
 
         # plt.xlabel("%s (%s)" % (self.wat_wcs_dict['label'], self.wat_wcs_dict['units']))
         self.wave_intens = [solution(x_axis), self.data]
+        self.solution = solution
         return solution
 
 
-
 class ReadMathFunctions(object):
+    """Callable solution from the dictionary of ReadWavelengthSolution
+
+    A multispec solution is the weighted sum of one or more functions of the physical pixel, with a zero point each,
+    divided by one plus the redshift, see parse_multispec. Chebyshev and Legendre functions are returned as models from
+    astropy.modeling.models, the other functions of IRAF as the Iraf classes of this module.
+    """
 
     def __init__(self, wcs_dict):
         self.wcs = wcs_dict
@@ -238,57 +334,87 @@ class ReadMathFunctions(object):
         elif self.wcs['dtype'] == 0:
             self.solution = self.linear_solution()
         elif self.wcs['dtype'] == 1:
-            self.log_linear()
+            self.solution = self.log_linear()
         elif self.wcs['dtype'] == 2:
-            if self.wcs['ftype'] == '1':
-                self.solution = self.chebyshev()
-            elif self.wcs['ftype'] == '2':
-                self.non_linear_legendre()
-            elif self.wcs['ftype'] == '3':
-                self.non_linear_cspline()
-            elif self.wcs['ftype'] == '4':
-                self.non_linear_lspline()
-            elif self.wcs['ftype'] == '5':
-                # pixel coordinates
-                pass
-            elif self.wcs['ftype'] == '6':
-                # sampled coordinate array
-                pass
+            functions = [self.get_function(function) for function in self.wcs['functions']]
+            if len(functions) == 0 or any([function is None for function in functions]):
+                log.error('The non linear solution could not be read')
+                return
+            if len(functions) == 1 and self.wcs['functions'][0]['weight'] == 1 and \
+                    self.wcs['functions'][0]['zeropoint'] == 0 and self.wcs['z'] == 0:
+                self.solution = functions[0]
             else:
-                log.error('Not Implemented')
+                self.solution = IrafWeightedSum(functions,
+                                                [function['weight'] for function in self.wcs['functions']],
+                                                [function['zeropoint'] for function in self.wcs['functions']],
+                                                self.wcs['z'])
         else:
             log.error('Not Implemented')
 
+    def get_function(self, function):
+        """Callable of one function of a non linear solution
+
+        Args:
+            function (dict): Function type, order and parameters from parse_multispec.
+
+        Returns:
+            solution (object): Callable of the physical pixel, None for unknown types.
+        """
+        if function['ftype'] == 1:
+            return self.chebyshev(function)
+        elif function['ftype'] == 2:
+            return self.non_linear_legendre(function)
+        elif function['ftype'] == 3:
+            return self.non_linear_cspline(function)
+        elif function['ftype'] == 4:
+            return self.non_linear_lspline(function)
+        elif function['ftype'] == 5:
+            return IrafPixelArray(function['fpar'])
+        elif function['ftype'] == 6:
+            return IrafSampledArray(function['fpar'][0::2], function['fpar'][1::2])
+        log.error('Not Implemented function type: %s', function['ftype'])
+        return None
+
     @staticmethod
     def none():
         return 0
 
     def linear_solution(self):
-        intercept = self.wcs['crval'] - (self.wcs['crpix'] - 1) * self.wcs['cdelt']
+        if 'crval' in self.wcs:
+            intercept = self.wcs['crval'] - (self.wcs['crpix'] - 1) * self.wcs['cdelt']
+            slope = self.wcs['cdelt']
+        else:
+            # multispec linear solution, dstart is the wavelength of the first pixel
+            intercept = self.wcs['dstart'] - self.wcs['avdelt']
+            slope = self.wcs['avdelt']
         # intercept = self.wcs['crval'] - self.wcs['crpix'] * self.wcs['cdelt']
-        linear = models.Linear1D(slope=self.wcs['cdelt'], intercept=intercept)
+        linear = models.Linear1D(slope=slope, intercept=intercept)
         return linear
 
-    @staticmethod
-    def log_linear():
-        return False
+    def log_linear(self):
+        return IrafLogLinear(self.wcs['dstart'], self.wcs['avdelt'])
 
-    def chebyshev(self):
-        cheb = models.Chebyshev1D(degree=self.wcs['order'], domain=[self.wcs['pmin'], self.wcs['pmax']], )
-        for param_index in range(self.wcs['order']):
-            cheb.parameters[param_index] = self.wcs['fpar'][param_index]
+    @staticmethod
+    def chebyshev(function):
+        # IRAF order is the number of coefficients
+        cheb = models.Chebyshev1D(degree=function['order'] - 1, domain=[function['pmin'], function['pmax']])
+        cheb.parameters = np.array(function['fpar'], dtype=float)
         return cheb
 
-    def non_linear_legendre(self):
-        raise NotImplementedError
+    @staticmethod
+    def non_linear_legendre(function):
+        legendre = models.Legendre1D(degree=function['order'] - 1, domain=[function['pmin'], function['pmax']])
+        legendre.parameters = np.array(function['fpar'], dtype=float)
+        return legendre
 
-    def non_linear_lspline(self):
-        raise NotImplementedError
+    @staticmethod
+    def non_linear_lspline(function):
+        return IrafLinearSpline(function['pmin'], function['pmax'], function['fpar'])
 
-    def non_linear_cspline(self):
+    @staticmethod
+    def non_linear_cspline(function):
         """Cubic Spline"""
-        # cubic_spline = models.
-        raise NotImplementedError
+        return IrafCubicSpline(function['pmin'], function['pmax'], function['fpar'])
 
     def get_solution(self):
         if self.solution is not None:
@@ -296,5 +422,246 @@ class ReadMathFunctions(object):
         else:
             log.error("The solution hasn't been found")
 
+
+class IrafLogLinear(object):
+    """Log-linear solution, dtype 1 of the multispec format"""
+
+    def __init__(self, start, delta):
+        self.start = start
+        self.delta = delta
+
+    def __call__(self, pixel):
+        return 10 ** (self.start + self.delta * (np.asarray(pixel, dtype=float) - 1))
+
+
+class IrafSpline(object):
+    """Spline of equal pieces between pmin and pmax, ftypes 3 and 4 of the multispec format
+
+    Attributes:
+        pmin (float): First physical pixel of the spline.
+        pmax (float): Last physical pixel of the spline.
+        coefficients (array): Coefficient of every basis function.
+        n_pieces (int): Number of pieces.
+    """
+    ftype = None
+    # basis functions that are not zero in every piece
+    n_basis = 1
+
+    def __init__(self, pmin, pmax, coefficients):
+        self.pmin = float(pmin)
+        self.pmax = float(pmax)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.n_pieces = len(self.coefficients) - self.n_basis + 1
+
+    def get_position(self, pixel):
+        """Piece of every pixel and the distance to both ends of the piece, the pixels outside belong to the ends"""
+        position = (np.asarray(pixel, dtype=float) - self.pmin) / (self.pmax - self.pmin) * self.n_pieces
+        piece = np.clip(np.floor(position).astype(int), 0, self.n_pieces - 1)
+        return piece, (piece + 1) - position, position - piece
+
+
+class IrafLinearSpline(IrafSpline):
+    """Linear spline, ftype 4 of the multispec format"""
+    ftype = 4
+    n_basis = 2
+
+    def __call__(self, pixel):
+        piece, a, b = self.get_position(pixel)
+        return a * self.coefficients[piece] + b * self.coefficients[piece + 1]
+
+
+class IrafCubicSpline(IrafSpline):
+    """Cubic B-spline, ftype 3 of the multispec format"""
+    ftype = 3
+    n_basis = 4
+
+    def __call__(self, pixel):
+        piece, a, b = self.get_position(pixel)
+        basis = [a ** 3, 1 + 3 * a * (1 + a * b), 1 + 3 * b * (1 + a * b), b ** 3]
+        return sum([basis[i] * self.coefficients[piece + i] for i in range(self.n_basis)])
+
+
+class IrafPixelArray(object):
+    """Wavelength of every physical pixel, interpolated linearly, ftype 5 of the multispec format"""
+    ftype = 5
+
+    def __init__(self, coordinates):
+        self.coordinates = np.asarray(coordinates, dtype=float)
+
+    def __call__(self, pixel):
+        pixel = np.asarray(pixel, dtype=float)
+        return np.interp(pixel, np.arange(1, len(self.coordinates) + 1), self.coordinates)
+
+
+class IrafSampledArray(object):
+    """Wavelength at some physical pixels, interpolated linearly, ftype 6 of the multispec format"""
+    ftype = 6
+
+    def __init__(self, pixels, coordinates):
+        self.pixels = np.asarray(pixels, dtype=float)
+        self.coordinates = np.asarray(coordinates, dtype=float)
+
+    def __call__(self, pixel):
+        return np.interp(np.asarray(pixel, dtype=float), self.pixels, self.coordinates)
+
+
+class IrafWeightedSum(object):
+    """Multispec solution made of several functions, or of one with a weight, zero point or redshift"""
+
+    def __init__(self, functions, weights, zeropoints, z=0.):
+        self.functions = functions
+        self.weights = weights
+        self.zeropoints = zeropoints
+        self.z = z
+
+    def __call__(self, pixel):
+        total = sum([weight * (function(pixel) + zeropoint)
+                     for function, weight, zeropoint in zip(self.functions, self.weights, self.zeropoints)])
+        return total / (1. + self.z)
+
+
+def parse_multispec(spec):
+    """Dictionary of a multispec aperture description
+
+    The description is ap beam dtype w1 dw nw z aplow aphigh, followed for non linear solutions by weight zeropoint
+    ftype and the parameters of every function. Chebyshev (ftype 1) and Legendre (2) have order pmin pmax and order
+    coefficients, cubic (3) and linear (4) splines npieces pmin pmax and npieces + 3 or npieces + 1 coefficients, a
+    pixel array (5) npts and npts wavelengths and a sampled array (6) npts and npts pairs of pixel and wavelength.
+
+    Args:
+        spec (str): Value of specN in the WAT2 keywords.
+
+    Returns:
+        wcs_dict (dict): The values of the description, the functions in the key 'functions'. The keys of the first
+            function are repeated at the top level.
+    """
+    values = spec.split()
+    wcs_dict = {'aperture': int(values[0]),
+                'beam': int(values[1]),
+                'dtype': int(values[2]),
+                'dstart': float(values[3]),
+                'avdelt': float(values[4]),
+                'pnum': int(float(values[5])),
+                'z': float(values[6]),
+                'alow': float(values[7]),
+                'ahigh': float(values[8]),
+                'functions': []}
+    index = 9
+    while wcs_dict['dtype'] == 2 and index + 3 < len(values):
+        function = {'weight': float(values[index]),
+                    'zeropoint': float(values[index + 1]),
+                    'ftype': int(float(values[index + 2]))}
+        index += 3
+        if function['ftype'] in [5, 6]:
+            function['order'] = int(float(values[index]))
+            function['pmin'] = None
+            function['pmax'] = None
+            n_parameters = function['order'] * (function['ftype'] - 4)
+            index += 1
+        else:
+            function['order'] = int(float(values[index]))
+            function['pmin'] = float(values[index + 1])
+            function['pmax'] = float(values[index + 2])
+            n_parameters = function['order'] + {1: 0, 2: 0, 3: 3, 4: 1}.get(function['ftype'], 0)
+            index += 3
+        function['fpar'] = [float(value) for value in values[index:index + n_parameters]]
+        index += n_parameters
+        wcs_dict['functions'].append(function)
+    if len(wcs_dict['functions']) > 0:
+        for key in ['weight', 'zeropoint', 'ftype', 'order', 'pmin', 'pmax', 'fpar']:
+            wcs_dict[key] = wcs_dict['functions'][0][key]
+    return wcs_dict
+
+
+def get_multispec_function(model, n_pixels):
+    """Multispec description of a wavelength solution
+
+    Chebyshev and Legendre models, whose domain is the pixel range pmin pmax, and the Iraf classes of this module are
+    written exactly. Any other model is written as the wavelength of every pixel (ftype 5).
+
+    Args:
+        model (object): Wavelength solution, a callable of the physical pixel.
+        n_pixels (int): Number of pixels of the spectrum.
+
+    Returns:
+        dtype (int): 0 for linear solutions, 2 for non linear ones.
+        function (str): Function type and parameters, empty for linear solutions.
+    """
+    if isinstance(model, models.Linear1D):
+        return 0, ''
+    if isinstance(model, (models.Chebyshev1D, models.Legendre1D)):
+        domain = getattr(model, 'domain', None)
+        window = getattr(model, 'window', None)
+        if domain is None:
+            domain = [-1, 1]
+        if window is None or np.allclose(window, [-1, 1]):
+            ftype = 1 if isinstance(model, models.Chebyshev1D) else 2
+            return 2, '%s %s %s %s %s' % (ftype,
+                                          len(model.parameters),
+                                          MULTISPEC_FORMAT % domain[0],
+                                          MULTISPEC_FORMAT % domain[1],
+                                          ' '.join([MULTISPEC_FORMAT % value for value in model.parameters]))
+    if isinstance(model, IrafSpline):
+        return 2, '%s %s %s %s %s' % (model.ftype,
+                                      model.n_pieces,
+                                      MULTISPEC_FORMAT % model.pmin,
+                                      MULTISPEC_FORMAT % model.pmax,
+                                      ' '.join([MULTISPEC_FORMAT % value for value in model.coefficients]))
+    if isinstance(model, IrafSampledArray):
+        pairs = np.column_stack([model.pixels, model.coordinates]).ravel()
+        return 2, '6 %s %s' % (len(model.pixels), ' '.join([MULTISPEC_FORMAT % value for value in pairs]))
+    coordinates = model(np.arange(1, n_pixels + 1))
+    return 2, '5 %s %s' % (n_pixels, ' '.join([MULTISPEC_FORMAT % value for value in coordinates]))
+
+
+def add_multispec_solution(header, model, n_pixels, label='Wavelength', units='angstroms', aperture=1, beam=1):
+    """Writes a wavelength solution in the IRAF multispec format, the spectrum does not need to be resampled
+
+    Args:
+        header (object): FITS header of the spectrum, the linear WCS keywords are removed.
+        model (object): Wavelength solution, a callable of the physical pixel.
+        n_pixels (int): Number of pixels of the spectrum.
+        label (str): Label of the wavelength axis.
+        units (str): Units of the wavelength.
+        aperture (int): Aperture number, or a list with the aperture of every row of a stacked spectrum, all with
+            the same solution.
+        beam (int): Beam number.
+
+    Returns:
+        header (object): The same header.
+    """
+    dtype, function = get_multispec_function(model, n_pixels)
+    first = float(model(1))
+    delta = (float(model(n_pixels)) - first) / max(n_pixels - 1, 1)
+    apertures = aperture if isinstance(aperture, (list, tuple)) else [aperture]
+    wat = 'wtype=multispec'
+    for number in apertures:
+        spec = '%s %s %s %s %s %s 0. 0. 0.' % (number,
+                                               beam,
+                                               dtype,
+                                               MULTISPEC_FORMAT % first,
+                                               MULTISPEC_FORMAT % delta,
+                                               n_pixels)
+        if dtype == 2:
+            spec += ' 1. 0. %s' % function
+        wat += ' spec%s = "%s"' % (number, spec)
+
+    for key in list(header.keys()):
+        if key.startswith('WAT2_') or key in ['CRVAL1', 'CRPIX1', 'CDELT1', 'DC-FLAG']:
+            del header[key]
+    header['WCSDIM'] = 2
+    header['CTYPE1'] = 'MULTISPE'
+    header['CTYPE2'] = 'MULTISPE'
+    header['CD1_1'] = 1.
+    header['CD2_2'] = 1.
+    header['LTM1_1'] = 1.
+    header['LTM2_2'] = 1.
+    header['WAT0_001'] = 'system=multispec'
+    header['WAT1_001'] = 'wtype=multispec label=%s units=%s' % (label, units)
+    for index, start in enumerate(range(0, len(wat), WAT_CARD_LENGTH)):
+        header['WAT2_%03d' % (index + 1)] = wat[start:start + WAT_CARD_LENGTH]
+    return header
+
+
 if __name__ == '__main__':
     pass